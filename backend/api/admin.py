@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     User, EmailOTP, StudentProfile, Notification, 
-    PlannerRequest, Book, Exam, SyllabusDetail
+    PlannerRequest, PlanCacheEntry, Book, Exam, SyllabusDetail
 )
 
 
@@ -61,6 +61,15 @@ class PlannerRequestAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'updated_at', 'expires_at')
 
 
+@admin.register(PlanCacheEntry)
+class PlanCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('key', 'exam', 'exam_date', 'hits', 'last_used_at', 'expires_at')
+    list_filter = ('exam_date',)
+    search_fields = ('key',)
+    ordering = ('-last_used_at',)
+    readonly_fields = ('key', 'hits', 'created_at', 'last_used_at')
+
+
 # ----------------------
 # Book Admin
 # ----------------------
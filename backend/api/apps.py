@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from .images import connect_signals
+        from .otp import check_backend
+        from .plan_cache import connect_signals as connect_plan_cache_signals
+        connect_signals()
+        connect_plan_cache_signals()
+        check_backend()
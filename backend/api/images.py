@@ -0,0 +1,289 @@
+"""
+Responsive image derivatives.
+
+Every image field listed in IMAGE_DERIVATIVES gets, after each new upload,
+resized copies at the configured widths in its own format (JPEG, or PNG when
+it has transparency) and WebP, plus a tiny blurred WebP placeholder inlined as
+a data URI. Files are named after the hash of the original's bytes, so they
+never change once written and can be cached forever.
+
+Resizing runs in a process pool after the upload's transaction commits; a
+storing thread owned by this module then writes the files and records them
+in the model's `<field>_variants` JSON column, stamped with the name of the
+original they were made from. The derivatives of a replaced or cleared image
+are deleted unless another record still uses the same bytes.
+"""
+import base64
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save
+
+logger = logging.getLogger('api')
+
+DERIVATIVES_DIR = 'derivatives'
+PLACEHOLDER_WIDTH = 16
+
+_executor = None
+_results = queue.Queue()
+_storer = None
+_storer_pid = None
+
+
+def variants_field(field_name):
+    return f'{field_name}_variants'
+
+
+# ----------------------
+# Rendering (runs in the worker processes; no database access)
+# ----------------------
+def render_derivatives(data, widths, quality):
+    from PIL import Image, ImageFilter, ImageOps
+
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    fallback = ('PNG', 'png') if has_alpha else ('JPEG', 'jpg')
+    digest = hashlib.sha256(data).hexdigest()[:20]
+
+    files = []
+    # Never upscale: widths past the original collapse onto the original width.
+    for width in sorted({min(width, image.width) for width in widths}):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for fmt, ext in (fallback, ('WEBP', 'webp')):
+            buffer = BytesIO()
+            options = {'quality': quality, 'optimize': True}
+            if fmt == 'JPEG':
+                options['progressive'] = True
+            elif fmt == 'WEBP':
+                options['method'] = 6
+            resized.save(buffer, fmt, **options)
+            files.append({
+                'name': f'{DERIVATIVES_DIR}/{digest[:2]}/{digest}-{width}.{ext}',
+                'width': width,
+                'format': ext,
+                'data': buffer.getvalue(),
+            })
+
+    tiny = image.resize(
+        (PLACEHOLDER_WIDTH, max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))), Image.BILINEAR
+    ).filter(ImageFilter.GaussianBlur(1))
+    buffer = BytesIO()
+    tiny.save(buffer, 'WEBP', quality=30)
+    placeholder = 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+    return {
+        'hash': digest,
+        'width': image.width,
+        'height': image.height,
+        'placeholder': placeholder,
+        'files': files,
+    }
+
+
+# ----------------------
+# Storing results
+# ----------------------
+def store_derivatives(model, pk, field_name, source, rendered):
+    """Save rendered files and record them, unless the image was replaced meanwhile."""
+    images = []
+    for item in rendered['files']:
+        if not default_storage.exists(item['name']):
+            default_storage.save(item['name'], ContentFile(item['data']))
+        images.append({'name': item['name'], 'width': item['width'], 'format': item['format']})
+
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or getattr(instance, field_name).name != source:
+        release_derivatives({'hash': rendered['hash'], 'images': images})
+        return None
+    previous = getattr(instance, variants_field(field_name)) or {}
+    variants = {
+        'source': source,
+        'hash': rendered['hash'],
+        'width': rendered['width'],
+        'height': rendered['height'],
+        'placeholder': rendered['placeholder'],
+        'images': images,
+    }
+    setattr(instance, variants_field(field_name), variants)
+    # A regular save so the model's own signals (cache versions, static
+    # export) see the new variants.
+    instance.save(update_fields=[variants_field(field_name)])
+    release_derivatives(previous)
+    return variants
+
+
+def clear_derivatives(model, pk, field_name):
+    """Forget and delete the derivatives of an image that was removed."""
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or getattr(instance, field_name):
+        return
+    previous = getattr(instance, variants_field(field_name)) or {}
+    setattr(instance, variants_field(field_name), {})
+    instance.save(update_fields=[variants_field(field_name)])
+    release_derivatives(previous)
+
+
+def release_derivatives(variants):
+    """Delete the files of `variants` unless some record's variants still use the same hash."""
+    if not variants.get('images') or _hash_in_use(variants['hash']):
+        return
+    for item in variants['images']:
+        default_storage.delete(item['name'])
+
+
+def _hash_in_use(digest):
+    from django.apps import apps
+
+    for label in settings.IMAGE_DERIVATIVES:
+        app_label, model_name, field_name = label.rsplit('.', 2)
+        model = apps.get_model(app_label, model_name)
+        if model.objects.filter(**{f'{variants_field(field_name)}__hash': digest}).exists():
+            return True
+    return False
+
+
+def generate_derivatives(instance, field_name):
+    """Render and store synchronously; used by the backfill command and when the pool is disabled."""
+    image = getattr(instance, field_name)
+    with image.open('rb') as handle:
+        data = handle.read()
+    rendered = render_derivatives(data, field_widths(instance, field_name), settings.IMAGE_DERIVATIVE_QUALITY)
+    return store_derivatives(type(instance), instance.pk, field_name, image.name, rendered)
+
+
+def field_widths(instance, field_name):
+    label = f'{instance._meta.app_label}.{instance._meta.object_name}.{field_name}'
+    return settings.IMAGE_DERIVATIVES[label]
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, not fork: gunicorn workers hold sockets and locks a forked
+        # child must not inherit.
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def schedule_derivatives(instance, field_name):
+    if settings.IMAGE_DERIVATIVE_WORKERS <= 0:
+        def generate():
+            try:
+                generate_derivatives(instance, field_name)
+            except Exception as e:
+                logger.error(f"Image derivatives for {getattr(instance, field_name).name} failed: {str(e)}")
+
+        transaction.on_commit(generate)
+        return
+
+    model, pk, image = type(instance), instance.pk, getattr(instance, field_name)
+    source = image.name
+
+    def submit():
+        try:
+            with image.open('rb') as handle:
+                data = handle.read()
+        except OSError as e:
+            logger.error(f"Reading {source} for derivatives failed: {str(e)}")
+            return
+        future = get_executor().submit(
+            render_derivatives, data, field_widths(instance, field_name), settings.IMAGE_DERIVATIVE_QUALITY
+        )
+        future.add_done_callback(lambda done: _finish(model, pk, field_name, source, done))
+
+    transaction.on_commit(submit)
+
+
+def _finish(model, pk, field_name, source, future):
+    # Runs on the executor's management thread, which must not block or touch
+    # the database; hand the result to the storing thread.
+    global _storer, _storer_pid
+    if _storer is None or _storer_pid != os.getpid() or not _storer.is_alive():
+        _storer_pid = os.getpid()
+        _storer = threading.Thread(target=_store_results, name='image-derivatives-store', daemon=True)
+        _storer.start()
+    _results.put((model, pk, field_name, source, future))
+
+
+def _store_results():
+    while True:
+        model, pk, field_name, source, future = _results.get()
+        close_old_connections()
+        try:
+            store_derivatives(model, pk, field_name, source, future.result())
+        except Exception:
+            logger.exception(f"Image derivatives for {source} failed")
+        finally:
+            close_old_connections()
+            _results.task_done()
+
+
+# ----------------------
+# Wiring
+# ----------------------
+def needs_derivatives(instance, field_name):
+    image = getattr(instance, field_name)
+    variants = getattr(instance, variants_field(field_name)) or {}
+    return bool(image) and variants.get('source') != image.name
+
+
+def _on_save(sender, instance, update_fields=None, **kwargs):
+    for label in settings.IMAGE_DERIVATIVES:
+        app_label, model_name, field_name = label.rsplit('.', 2)
+        if (app_label, model_name) != (sender._meta.app_label, sender._meta.object_name):
+            continue
+        if update_fields is not None and field_name not in update_fields:
+            continue
+        if needs_derivatives(instance, field_name):
+            schedule_derivatives(instance, field_name)
+        elif not getattr(instance, field_name) and getattr(instance, variants_field(field_name)):
+            transaction.on_commit(
+                lambda model=sender, pk=instance.pk, field_name=field_name: clear_derivatives(model, pk, field_name)
+            )
+
+
+def connect_signals():
+    from django.apps import apps
+
+    for label in settings.IMAGE_DERIVATIVES:
+        app_label, model_name, _ = label.rsplit('.', 2)
+        model = apps.get_model(app_label, model_name)
+        post_save.connect(_on_save, sender=model, dispatch_uid=f'image-derivatives-{model._meta.label}')
+
+
+def srcset(image, variants, request=None):
+    """Serializer representation of an image's derivatives, or None until they exist."""
+    if not image or not variants or variants.get('source') != image.name:
+        return None
+
+    def url(name):
+        location = default_storage.url(name)
+        return request.build_absolute_uri(location) if request is not None else location
+
+    by_format = {}
+    for item in variants['images']:
+        by_format.setdefault(item['format'], []).append(f"{url(item['name'])} {item['width']}w")
+    webp = by_format.pop('webp', [])
+    fallback = next(iter(by_format.values()), [])
+    return {
+        'srcset': ', '.join(fallback),
+        'webp_srcset': ', '.join(webp),
+        'placeholder': variants['placeholder'],
+        'width': variants['width'],
+        'height': variants['height'],
+    }
@@ -0,0 +1,215 @@
+"""
+Outbound email queue.
+
+Requests call `queue_mail`, which only inserts an OutboundEmail row, so they
+never wait on the mail provider. The `send_queued_mail` process claims due
+rows in batches (SELECT ... FOR UPDATE SKIP LOCKED, so several senders can
+run side by side), delivers them through EMAIL_BACKEND over one connection
+that stays open while there is work, and records the outcome: sent, retried
+later with exponential backoff, or failed after EMAIL_QUEUE_MAX_ATTEMPTS or
+at once when the server refuses the message permanently (a 5xx reply).
+
+A claim pushes the rows' next_attempt_at forward by a lease long enough to
+send the whole batch (EMAIL_TIMEOUT per message, plus EMAIL_QUEUE_LEASE), so
+mail claimed by a sender that died is picked up again once the lease ends.
+The outcome is only written while the claim still holds: a sender that
+outlived its lease leaves the row to whoever claimed it next.
+
+Mail queued with a `ttl` (login codes, which stop working after OTP_TTL) is
+deleted instead of sent once it expires, and is not retried past its expiry.
+"""
+import logging
+import smtplib
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger('api')
+
+# The server turned down one message; the session is still good for the next.
+# After any other error the connection is dropped and reopened.
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+PURGE_EVERY = 3600  # seconds between purges of old sent mail
+
+
+def queue_mail(subject, message, recipient_list, from_email=None, html_message=None, ttl=None):
+    """
+    Queue a message for the sender process; mirrors django.core.mail.send_mail.
+    With `ttl` (seconds) the message is dropped if it can't be sent in time.
+
+    The insert is a database write on the calling request (for OTP logins,
+    the only one); it is the price of never waiting on the mail provider.
+    """
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        html_body=html_message or '',
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(recipient_list),
+        expires_at=timezone.now() + timedelta(seconds=ttl) if ttl is not None else None,
+    )
+
+
+def retry_delay(attempts):
+    base = settings.EMAIL_QUEUE_RETRY_DELAY
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), base * 64))
+
+
+def permanent(error):
+    """Whether a refusal is final (5xx); 4xx replies are worth another try."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, MESSAGE_ERRORS) and error.smtp_code >= 500
+
+
+def build_message(mail, connection):
+    message = EmailMultiAlternatives(
+        subject=mail.subject,
+        body=mail.body,
+        from_email=mail.from_email,
+        to=mail.to,
+        connection=connection,
+    )
+    if mail.html_body:
+        message.attach_alternative(mail.html_body, 'text/html')
+    return message
+
+
+class MailSender:
+    def __init__(self, batch_size=None, connection=None):
+        self.batch_size = batch_size or settings.EMAIL_QUEUE_BATCH_SIZE
+        self.connection = connection
+        self._open = False
+        self.sent = 0
+        self.failed = 0
+        self.expired = 0
+
+    # -- connection --------------------------------------------------------
+
+    def _connection(self):
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+        if not self._open:
+            self.connection.open()
+            self._open = True
+        return self.connection
+
+    def close(self):
+        if self.connection is not None and self._open:
+            try:
+                self.connection.close()
+            except Exception as e:
+                logger.warning(f"Closing the mail connection failed: {str(e)}")
+        self._open = False
+
+    # -- queue -------------------------------------------------------------
+
+    def claim(self):
+        """
+        Lease a batch of due mail. The lease end, kept on each row as
+        `leased_until`, is the claim: outcomes are only written while the
+        row's next_attempt_at still matches it.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            batch = list(
+                OutboundEmail.objects.select_for_update(skip_locked=True)
+                .filter(status='queued', next_attempt_at__lte=now)
+                .order_by('next_attempt_at')[:self.batch_size]
+            )
+            leased_until = now + timedelta(seconds=settings.EMAIL_QUEUE_LEASE + len(batch) * settings.EMAIL_TIMEOUT)
+            OutboundEmail.objects.filter(pk__in=[mail.pk for mail in batch]).update(next_attempt_at=leased_until)
+        for mail in batch:
+            mail.next_attempt_at = mail.leased_until = leased_until
+        return batch
+
+    def _claimed(self, mail):
+        return OutboundEmail.objects.filter(
+            pk=mail.pk, status='queued', attempts=mail.attempts, next_attempt_at=mail.leased_until,
+        )
+
+    def _record(self, mail, **fields):
+        """Write the outcome of a claimed row; False if another sender has claimed it since."""
+        if self._claimed(mail).update(**fields):
+            return True
+        logger.warning(f"Email {mail.pk} was claimed again after its lease ran out; not recording this attempt")
+        return False
+
+    def send_batch(self):
+        """Deliver one claimed batch; returns the number of messages handled."""
+        batch = self.claim()
+        for mail in batch:
+            if mail.expires_at is not None and mail.expires_at <= timezone.now():
+                self._expired(mail)
+                continue
+            try:
+                build_message(mail, self._connection()).send()
+            except Exception as e:
+                if not isinstance(e, MESSAGE_ERRORS):
+                    self.close()
+                self._failed(mail, e)
+            else:
+                if self._record(mail, status='sent', sent_at=timezone.now(), attempts=mail.attempts + 1):
+                    self.sent += 1
+        return len(batch)
+
+    def _failed(self, mail, error):
+        last_error = f"{type(error).__name__}: {error}"
+        attempts = mail.attempts + 1
+        next_attempt_at = timezone.now() + retry_delay(attempts)
+        refused = permanent(error)
+        if not refused and mail.expires_at is not None and next_attempt_at >= mail.expires_at:
+            self._expired(mail, attempts)
+        elif refused or attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+            if self._record(mail, status='failed', attempts=attempts, last_error=last_error):
+                self.failed += 1
+                logger.error(f"Giving up on email to {', '.join(mail.to)}: {last_error}")
+        elif self._record(mail, attempts=attempts, last_error=last_error, next_attempt_at=next_attempt_at):
+            logger.warning(f"Email to {', '.join(mail.to)} failed (attempt {attempts}): {last_error}")
+
+    def _expired(self, mail, attempts=None):
+        # Nothing to keep: the body is a code that no longer works.
+        deleted, _ = self._claimed(mail).delete()
+        if deleted:
+            self.expired += 1
+            logger.warning(f"Dropped expired email to {', '.join(mail.to)} after {attempts or mail.attempts} attempt(s)")
+
+    def purge(self):
+        cutoff = timezone.now() - timedelta(days=settings.EMAIL_QUEUE_KEEP_DAYS)
+        deleted, _ = OutboundEmail.objects.filter(status='sent', sent_at__lt=cutoff).delete()
+        return deleted
+
+    def run(self, poll_interval, stop_event=None):
+        """Send until `stop_event` is set; the connection is closed whenever the queue runs dry."""
+        stop_event = stop_event or threading.Event()
+        last_purge = 0.0
+        try:
+            while not stop_event.is_set():
+                close_old_connections()
+                try:
+                    handled = self.send_batch()
+                    if time.monotonic() - last_purge > PURGE_EVERY:
+                        self.purge()
+                        last_purge = time.monotonic()
+                except Exception as e:
+                    logger.error(f"Sending queued mail failed: {str(e)}")
+                    handled = 0
+                if handled < self.batch_size:
+                    self.close()
+                    stop_event.wait(poll_interval)
+        finally:
+            self.close()
+
+
+def run_mail_sender(poll_interval, stop_event=None, batch_size=None):
+    """Deliver queued mail, polling every `poll_interval` seconds, until `stop_event` is set."""
+    sender = MailSender(batch_size=batch_size)
+    sender.run(poll_interval, stop_event)
+    return sender
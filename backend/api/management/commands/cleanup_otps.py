@@ -5,7 +5,7 @@ from api.models import EmailOTP
 
 
 class Command(BaseCommand):
-    help = 'Clean up expired OTP codes (older than 24 hours)'
+    help = 'Clean up OTP records (database backend codes, audit rows) older than 24 hours'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -0,0 +1,74 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.images import field_widths, needs_derivatives, render_derivatives, store_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Generate responsive image derivatives for images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate derivatives even where they are up to date',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=max(settings.IMAGE_DERIVATIVE_WORKERS, 1),
+            help='Resizing processes (default: IMAGE_DERIVATIVE_WORKERS)',
+        )
+
+    def handle(self, *args, **options):
+        self.generated = self.failed = 0
+        # Originals travel to the workers in memory, so only a few are in flight.
+        max_pending = options['workers'] * 4
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            pending = {}
+            for label in settings.IMAGE_DERIVATIVES:
+                app_label, model_name, field_name = label.rsplit('.', 2)
+                model = apps.get_model(app_label, model_name)
+                instances = model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''})
+
+                for instance in instances.iterator():
+                    if not options['force'] and not needs_derivatives(instance, field_name):
+                        continue
+                    image = getattr(instance, field_name)
+                    try:
+                        with image.open('rb') as handle:
+                            data = handle.read()
+                    except OSError as e:
+                        self.stderr.write(f'{label} #{instance.pk}: {e}')
+                        self.failed += 1
+                        continue
+
+                    future = pool.submit(
+                        render_derivatives, data, field_widths(instance, field_name),
+                        settings.IMAGE_DERIVATIVE_QUALITY,
+                    )
+                    pending[future] = (label, model, instance.pk, field_name, image.name)
+                    if len(pending) >= max_pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        self.store(pending, done)
+
+            self.store(pending, list(pending))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully generated derivatives for {self.generated} images ({self.failed} failed)'
+            )
+        )
+
+    def store(self, pending, futures):
+        for future in futures:
+            label, model, pk, field_name, source = pending.pop(future)
+            try:
+                store_derivatives(model, pk, field_name, source, future.result())
+                self.generated += 1
+            except Exception as e:
+                self.stderr.write(f'{label} #{pk}: {e}')
+                self.failed += 1
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from api import plan_cache
+from api.models import PlanCacheEntry
+
+
+class Command(BaseCommand):
+    help = 'Show plan cache statistics, or clear the cache (all of it, or for one exam)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete cached plans (all of them unless --exam is given)',
+        )
+        parser.add_argument(
+            '--exam',
+            type=int,
+            help='With --clear, only delete the plans built for this exam id',
+        )
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            if options['exam'] is not None:
+                deleted = plan_cache.invalidate([options['exam']])
+            else:
+                deleted, _ = PlanCacheEntry.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted} cached plans'))
+            return
+
+        stats = plan_cache.stats()
+        self.stdout.write(
+            f"{stats['entries']} cached plans ({stats['expired']} expired), {stats['hits']} hits served"
+        )
@@ -0,0 +1,92 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+def mock_plan(payload):
+    """
+    A placeholder plan in the generated_plan format: the draft sent by the
+    workers as is, otherwise the chosen subjects in turn, one per day.
+    """
+    if payload.get('draft_plan'):
+        return {**payload['draft_plan'], 'source': 'mock'}
+    constraints = payload.get('constraints') or {}
+    subjects = [name for name, choice in (constraints.get('subjects') or {}).items() if choice.get('checked')]
+    subjects = subjects or ['ریاضی', 'فیزیک', 'شیمی']
+    hours = payload['user_profile']['daily_hours'] or 8
+    days = []
+    for day in range(1, (payload.get('period_days') or 14) + 1):
+        subject = subjects[(day - 1) % len(subjects)]
+        days.append({'day': day, 'tasks': [{'subject': subject, 'topic': '', 'hours': hours}]})
+    return {'source': 'mock', 'days': days}
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.peak = max(server.peak, server.in_flight)
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            time.sleep(server.latency * random.uniform(0.5, 1.5))
+            if random.random() < server.failure_rate:
+                self.send_error(503, 'Mock LLM overloaded')
+                return
+            body = json.dumps({'plan': mock_plan(payload)}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+                server.served += 1
+
+    def log_message(self, format, *args):
+        server = self.server
+        self.server.stdout.write(
+            f"{self.address_string()} {format % args} (in flight: {server.in_flight}, peak: {server.peak})"
+        )
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for the planner LLM (the HTTPLLMClient protocol) for testing workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8089, help='Port to listen on (default: 8089)')
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=1.0,
+            help='Average seconds per response, varied by +/-50%% (default: 1.0)',
+        )
+        parser.add_argument(
+            '--failure-rate',
+            type=float,
+            default=0.0,
+            help='Share of requests answered with HTTP 503, to exercise retries (default: 0)',
+        )
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(('0.0.0.0', options['port']), MockLLMHandler)
+        server.daemon_threads = True
+        server.lock = threading.Lock()
+        server.in_flight = server.peak = server.served = 0
+        server.latency = options['latency']
+        server.failure_rate = options['failure_rate']
+        server.stdout = self.stdout
+
+        self.stdout.write(f"Mock LLM listening on http://localhost:{options['port']}/plan")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write(self.style.SUCCESS(f'Mock LLM stopped after {server.served} request(s), peak concurrency {server.peak}'))
@@ -0,0 +1,125 @@
+import random
+import socketserver
+import threading
+
+from django.core.management.base import BaseCommand
+
+
+class MockSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Just enough of SMTP for smtplib (and so django's SMTP EmailBackend) to
+    deliver through: no TLS and no AUTH, so use it with EMAIL_USE_TLS=False
+    and no EMAIL_HOST_USER.
+    """
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 mock-smtp ESMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode(errors='replace').strip().partition(' ')
+            command = command.upper()
+            if command == 'EHLO':
+                self.reply('250-mock-smtp')
+                self.reply('250 8BITMIME')
+            elif command in ('HELO', 'NOOP'):
+                self.reply('250 OK')
+            elif command in ('MAIL', 'RSET'):
+                recipients = []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                address = argument.partition(':')[2].strip().strip('<>')
+                if any(address.startswith(prefix) for prefix in server.refuse):
+                    self.reply(f'550 5.1.1 <{address}>: mailbox unavailable')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                if not recipients:
+                    self.reply('503 5.5.1 No valid recipients')
+                    continue
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                if random.random() < server.failure_rate:
+                    self.reply('451 4.3.0 Try again later')
+                else:
+                    with server.lock:
+                        server.messages += 1
+                    self.log(f"Accepted a message for {', '.join(recipients)}")
+                    self.reply('250 OK')
+                recipients = []
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 5.5.2 Command not implemented')
+
+    def log(self, message):
+        if self.server.stdout is not None:
+            server = self.server
+            self.server.stdout.write(
+                f"{self.client_address[0]} {message} (connections: {server.connections}, messages: {server.messages})"
+            )
+
+
+class MockSMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, refuse=(), failure_rate=0.0, stdout=None):
+        super().__init__(address, MockSMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = self.messages = 0
+        self.refuse = tuple(refuse)
+        self.failure_rate = failure_rate
+        self.stdout = stdout
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in SMTP server for testing the send_queued_mail sender'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=1025, help='Port to listen on (default: 1025)')
+        parser.add_argument(
+            '--refuse',
+            action='append',
+            default=[],
+            help='Answer 550 for recipients starting with this prefix; may be repeated (e.g. bounce@)',
+        )
+        parser.add_argument(
+            '--failure-rate',
+            type=float,
+            default=0.0,
+            help='Share of messages answered with 451, to exercise retries (default: 0)',
+        )
+
+    def handle(self, *args, **options):
+        server = MockSMTPServer(
+            ('0.0.0.0', options['port']),
+            refuse=options['refuse'],
+            failure_rate=options['failure_rate'],
+            stdout=self.stdout,
+        )
+
+        self.stdout.write(
+            f"Mock SMTP listening on localhost:{options['port']} "
+            f"(EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend EMAIL_USE_TLS=False)"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Mock SMTP stopped after {server.messages} message(s) over {server.connections} connection(s)'
+        ))
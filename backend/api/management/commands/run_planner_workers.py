@@ -0,0 +1,36 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.planner import run_planner_workers
+
+
+class Command(BaseCommand):
+    help = 'Process submitted planner requests with a pool of worker threads (run more processes to scale out)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=settings.PLANNER_WORKER_THREADS,
+            help=f'Worker threads in this process (default: {settings.PLANNER_WORKER_THREADS})',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.PLANNER_POLL_INTERVAL,
+            help=f'Seconds an idle worker waits before looking again (default: {settings.PLANNER_POLL_INTERVAL})',
+        )
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop_event.set())
+
+        self.stdout.write(
+            f"Running {options['threads']} planner workers "
+            f"(at most {settings.PLANNER_LLM_CONCURRENCY} concurrent LLM calls overall)"
+        )
+        completed = run_planner_workers(options['threads'], options['poll_interval'], stop_event)
+        self.stdout.write(self.style.SUCCESS(f'Planner workers stopped after completing {completed} request(s)'))
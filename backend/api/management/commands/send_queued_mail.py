@@ -0,0 +1,51 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.mail import MailSender, run_mail_sender
+
+
+class Command(BaseCommand):
+    help = 'Send queued outbound email (what is due now, or continuously with --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and send new mail as it is queued',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.EMAIL_QUEUE_BATCH_SIZE,
+            help=f'Messages claimed per batch (default: {settings.EMAIL_QUEUE_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.EMAIL_QUEUE_POLL_INTERVAL,
+            help=f'Seconds to wait when the queue is empty with --loop (default: {settings.EMAIL_QUEUE_POLL_INTERVAL})',
+        )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            sender = MailSender(batch_size=options['batch_size'])
+            try:
+                while sender.send_batch() == sender.batch_size:
+                    pass
+            finally:
+                sender.close()
+            self.stdout.write(
+                self.style.SUCCESS(f'Successfully sent {sender.sent} email(s) '
+                                   f'({sender.failed} failed for good, {sender.expired} expired)')
+            )
+            return
+
+        stop_event = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop_event.set())
+
+        self.stdout.write(f"Sending queued mail (polling every {options['poll_interval']}s when idle)")
+        sender = run_mail_sender(options['poll_interval'], stop_event, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Mail sender stopped after sending {sender.sent} email(s)'))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_outbound_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plannerrequest',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='plannerrequest',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='plannerrequest',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
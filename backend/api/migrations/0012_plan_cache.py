@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_planner_workers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('exam_date', models.DateField(blank=True, db_index=True, null=True)),
+                ('plan', models.JSONField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('exam', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.exam')),
+            ],
+            options={
+                'verbose_name': 'برنامه کش\u200cشده',
+                'verbose_name_plural': 'برنامه\u200cهای کش\u200cشده',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_plan_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plannerrequest',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revisions', to='api.plannerrequest'),
+        ),
+    ]
@@ -68,6 +68,45 @@ class EmailOTP(models.Model):
         return f"{self.email} - {self.code}"
 
 
+# ----------------------
+# Outbound email queue
+# ----------------------
+class OutboundEmail(models.Model):
+    """ایمیل‌های در صف ارسال؛ فرایند send_queued_mail آن‌ها را می‌فرستد (api.mail)"""
+
+    STATUS_CHOICES = [
+        ('queued', 'در صف'),
+        ('sent', 'ارسال شده'),
+        ('failed', 'خطا'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Also the claim lease: a claimed row is pushed forward until it is sent.
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # Mail that is useless after this (a login code past its TTL) is dropped unsent.
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{', '.join(self.to)} - {self.subject} ({self.status})"
+
+
 # ----------------------
 # Student Profile
 # ----------------------
@@ -84,6 +123,7 @@ class StudentProfile(models.Model):
     birthdate_jalali = models.CharField(max_length=20)
 
     avatar = models.ImageField(upload_to="avatars/", null=True, blank=True)
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)  # api.images
 
     def __str__(self):
         return self.name
@@ -148,6 +188,20 @@ class PlannerRequest(models.Model):
     
     # نتیجه برنامه (بعد از پردازش LLM)
     generated_plan = models.JSONField(null=True, blank=True)
+
+    # نسخه قبلی برنامه، برای درخواست‌هایی که ویرایش یک برنامه هستند (revise)
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='revisions'
+    )
+
+    # وضعیت worker ها (api.planner): تعداد تلاش، مهلت claim / زمان تلاش بعدی، آخرین خطا
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
     
     # اطلاعات اضافی برای LLM
     exam_code = models.CharField(max_length=100, blank=True, null=True)  # کد آزمون برای LLM
@@ -184,6 +238,26 @@ class PlannerRequest(models.Model):
         return timezone.now() > self.expires_at
 
 
+class PlanCacheEntry(models.Model):
+    """برنامه‌های تولیدشده، بر اساس hash ورودی‌های نرمال‌شده (api.plan_cache)"""
+
+    key = models.CharField(max_length=64, unique=True)  # sha256 ورودی‌ها
+    exam = models.ForeignKey('Exam', on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    exam_date = models.DateField(null=True, blank=True, db_index=True)
+    plan = models.JSONField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = 'برنامه کش‌شده'
+        verbose_name_plural = 'برنامه‌های کش‌شده'
+
+    def __str__(self):
+        return f"{self.key[:12]} ({self.exam_date}, {self.hits} hits)"
+
+
 # ----------------------
 # Exam Management Models
 # ----------------------
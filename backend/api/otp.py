@@ -0,0 +1,156 @@
+"""
+One-time login codes.
+
+The backend is chosen by OTP_BACKEND. The default keeps codes in the cache
+(a shared cache such as Redis in production, the local-memory cache in
+development): each email maps to an HMAC of its current code and an expiry,
+with a separate attempt counter, all expiring on their own. Sending and
+verifying a code therefore never write to the database; the EmailOTP table
+is only written when OTP_AUDIT is on.
+
+A code must be readable by whichever process verifies it, so outside DEBUG
+the cache backend refuses to start on a cache each process keeps to itself;
+use Redis (as docker-compose does) or DatabaseOTPBackend.
+"""
+import hashlib
+import hmac
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .models import EmailOTP
+
+VALID = 'valid'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+LOCKED = 'locked'
+
+_backend = None
+
+# Caches that don't share entries between processes.
+UNSHARED_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def generate_code():
+    return f"{secrets.randbelow(900000) + 100000}"
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+# ----------------------
+# Backends
+# ----------------------
+class BaseOTPBackend:
+    def issue(self, email):
+        """Create a new code for `email`, replacing any previous one, and return it."""
+        raise NotImplementedError
+
+    def verify(self, email, code):
+        """Check and consume a code; returns VALID, INVALID, EXPIRED or LOCKED."""
+        raise NotImplementedError
+
+
+class CacheOTPBackend(BaseOTPBackend):
+    prefix = 'otp:'
+
+    def __init__(self):
+        self.cache = caches[settings.OTP_CACHE_ALIAS]
+        self.ttl = settings.OTP_TTL
+        self.max_attempts = settings.OTP_MAX_ATTEMPTS
+
+    def _key(self, email, kind='code'):
+        digest = hashlib.sha256(normalize_email(email).encode()).hexdigest()
+        return f'{self.prefix}{kind}:{digest}'
+
+    def _hash(self, email, code):
+        message = f'{normalize_email(email)}:{code}'.encode()
+        return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+    def issue(self, email):
+        code = generate_code()
+        entry = {
+            'hash': self._hash(email, code),
+            'expires_at': time.time() + self.ttl,
+            'nonce': secrets.token_hex(8),
+        }
+        # Kept past its expiry so a late attempt can be told it expired.
+        self.cache.set_many({self._key(email): entry, self._key(email, 'attempts'): 0}, self.ttl * 2)
+        if settings.OTP_AUDIT:
+            EmailOTP.objects.create(email=email, code='')
+        return code
+
+    def verify(self, email, code):
+        key, attempts_key = self._key(email), self._key(email, 'attempts')
+        entry = self.cache.get(key)
+        if entry is None:
+            return INVALID
+        if time.time() > entry['expires_at']:
+            return EXPIRED
+
+        try:
+            attempts = self.cache.incr(attempts_key)
+        except ValueError:
+            self.cache.add(attempts_key, 0, self.ttl * 2)
+            attempts = self.cache.incr(attempts_key)
+        if attempts > self.max_attempts:
+            self.cache.delete(key)
+            return LOCKED
+        if not hmac.compare_digest(entry['hash'], self._hash(email, code)):
+            return INVALID
+
+        # Only the first of two concurrent requests with the right code wins.
+        if not self.cache.add(f"{key}:used:{entry['nonce']}", 1, self.ttl * 2):
+            return INVALID
+        self.cache.delete_many([key, attempts_key])
+        if settings.OTP_AUDIT:
+            EmailOTP.objects.filter(email=email, is_used=False).update(is_used=True)
+        return VALID
+
+
+class DatabaseOTPBackend(BaseOTPBackend):
+    """Plain codes in the EmailOTP table; expired rows are left to cleanup_otps."""
+
+    def issue(self, email):
+        EmailOTP.objects.filter(email=email, is_used=False).delete()
+        return EmailOTP.objects.create(email=email, code=generate_code()).code
+
+    def verify(self, email, code):
+        cutoff = time.time() - settings.OTP_TTL
+        otp = EmailOTP.objects.filter(email=email, code=code, is_used=False).order_by('-created_at').first()
+        if otp is None:
+            return INVALID
+        if otp.created_at.timestamp() < cutoff:
+            return EXPIRED
+        if not EmailOTP.objects.filter(pk=otp.pk, is_used=False).update(is_used=True):
+            return INVALID
+        return VALID
+
+
+def check_backend():
+    """Fail at startup rather than at login when codes would stay in one worker's memory."""
+    if settings.DEBUG or not issubclass(import_string(settings.OTP_BACKEND), CacheOTPBackend):
+        return
+    cache_backend = settings.CACHES[settings.OTP_CACHE_ALIAS]['BACKEND']
+    if cache_backend in UNSHARED_CACHES:
+        raise ImproperlyConfigured(
+            f'{settings.OTP_BACKEND} keeps codes in the {settings.OTP_CACHE_ALIAS!r} cache, but '
+            f'{cache_backend} is not shared between processes, so a code issued by one worker '
+            'cannot be verified by another. Set CACHE_BACKEND to a shared cache such as '
+            'django.core.cache.backends.redis.RedisCache, or OTP_BACKEND=api.otp.DatabaseOTPBackend.'
+        )
+
+
+def get_otp_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.OTP_BACKEND)()
+    return _backend
@@ -0,0 +1,127 @@
+"""
+Keyset (cursor) pagination
+"""
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest-first pagination keyed on (ordering_field, id).
+
+    Each page is a single indexed range scan, no matter how deep the caller
+    has scrolled, and the opaque next/previous cursors encode the boundary
+    row. The total count is included unless the caller passes ?count=false.
+
+    Usage:
+        class PostCursorPagination(KeysetPagination):
+            ordering_field = 'published_at'
+    """
+    ordering_field = 'created_at'
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = queryset.count() if self.include_count(request) else None
+
+        cursor = self.decode_cursor(request)
+        field = self.ordering_field
+        if cursor is None:
+            value, pk, backwards = None, None, False
+            page_qs = queryset.order_by(f'-{field}', '-pk')
+        else:
+            value, pk, backwards = cursor
+            if backwards:
+                page_qs = queryset.filter(
+                    Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk})
+                ).order_by(field, 'pk')
+            else:
+                page_qs = queryset.filter(
+                    Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk})
+                ).order_by(f'-{field}', '-pk')
+
+        rows = list(page_qs[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        body = {}
+        if self.count is not None:
+            body['count'] = self.count
+        body.update({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+        return Response(body)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def include_count(self, request):
+        return request.query_params.get(self.count_query_param, 'true').lower() not in ('0', 'false', 'no')
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], backwards=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], backwards=True)
+
+    def encode_cursor(self, row, backwards):
+        position = {
+            'v': getattr(row, self.ordering_field).isoformat(),
+            'id': row.pk,
+            'b': int(backwards),
+        }
+        token = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(token.encode()))
+            value = parse_datetime(position['v'])
+            pk = int(position['id'])
+            backwards = bool(position.get('b'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk, backwards
+
+
+def wants_cursor_pagination(request):
+    """Callers opt into keyset pagination with ?pagination=cursor or by sending a cursor."""
+    params = request.query_params
+    return params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in params
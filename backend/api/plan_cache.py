@@ -0,0 +1,183 @@
+"""
+Plan cache.
+
+Students of the same grade often submit the same choices for the same exam.
+A finished plan is stored under a hash of its normalized inputs: the exam,
+hours, period, target rank, grade and field, and form_data with everything
+that cannot change the plan dropped, serialized as sorted JSON. A later
+request with the same hash is completed from the cache when it is submitted,
+without reaching the workers. Since a plan is served to other students, the
+LLM is not told who asked for it (planner.shareable_payload). Revisions and
+requests whose exam date can't be read (their plan starts on the day they
+were made) are never cached.
+
+Entries expire after PLANNER_CACHE_TTL. Beyond PLANNER_CACHE_MAX_ENTRIES,
+the least recently used ones are dropped. Saving or deleting an Exam, its
+SyllabusDetail rows or a Book it uses drops the entries built for that exam
+(or for its date, when they were built without a syllabus). After bulk
+changes, run `manage.py plan_cache --clear`.
+
+Lookups are counted in the planner_plan_cache_* Prometheus metrics, and
+each entry keeps its own hit count.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from prometheus_client import Counter
+
+from .models import Book, Exam, PlanCacheEntry, SyllabusDetail
+from .plan_generator import find_exam, parse_exam_date, whole_number
+
+# Bump when the plan format or generation changes, so old entries stop matching.
+PLAN_CACHE_VERSION = '2'
+
+LOOKUPS = Counter('planner_plan_cache_lookups_total', 'Plan cache lookups', ['result'])
+EVICTIONS = Counter('planner_plan_cache_evictions_total', 'Plan cache entries removed', ['reason'])
+
+
+def _present(rows):
+    return [row for row in rows or [] if isinstance(row, dict) and row.get('has')]
+
+
+def _sorted_rows(rows):
+    return sorted((row for row in rows or [] if isinstance(row, dict)),
+                  key=lambda row: json.dumps(row, sort_keys=True, ensure_ascii=False))
+
+
+def normalize_constraints(form_data):
+    """form_data without the parts that cannot change the plan."""
+    form_data = form_data or {}
+    normalized = {
+        'subjects': {name: choice.get('level') for name, choice in (form_data.get('subjects') or {}).items()
+                     if isinstance(choice, dict) and choice.get('checked')},
+        'generals': {name: {'days': choice.get('days'), 'target': choice.get('target')}
+                     for name, choice in (form_data.get('generals') or {}).items()
+                     if isinstance(choice, dict) and whole_number(choice.get('days')) > 0},
+        'classes': _sorted_rows(form_data.get('classes')),
+        'commitments': _sorted_rows(form_data.get('commitments')),
+        'lightDay': form_data.get('lightDay') if form_data.get('lightEnabled') else None,
+    }
+    if form_data.get('hasExistingSchoolPlan'):
+        normalized['weeks'] = [_present(form_data.get('week1')), _present(form_data.get('week2'))]
+    else:
+        normalized['school'] = _present(form_data.get('school'))
+    # Anything the form grows later is kept as is rather than silently ignored.
+    known = {'subjects', 'generals', 'classes', 'commitments', 'lightDay', 'lightEnabled', 'school',
+             'hasExistingSchoolPlan', 'week1', 'week2', 'examProvider', 'examDate', 'dailyHours'}
+    normalized.update({key: value for key, value in form_data.items() if key not in known})
+    return normalized
+
+
+def cacheable(planner_request):
+    """Whether the plan for `planner_request` may be stored and served to others."""
+    return (settings.PLANNER_CACHE_ENABLED and planner_request.parent_id is None
+            and parse_exam_date(planner_request.exam_date) is not None)
+
+
+def cache_key(planner_request, payload):
+    """Hex sha256 of the canonical inputs of `planner_request` (`payload` from planner.llm_payload)."""
+    profile = payload['user_profile']
+    inputs = {
+        'version': PLAN_CACHE_VERSION,
+        'llm': settings.PLANNER_LLM_ENABLED,
+        'exam': payload['exam'],
+        'daily_hours': planner_request.daily_hours,
+        'profile': {'grade': profile['grade'], 'field': profile['field'], 'daily_hours': profile['daily_hours']},
+        'period_days': planner_request.period_days,
+        'target_rank': planner_request.target_rank,
+        'constraints': normalize_constraints(planner_request.form_data),
+    }
+    canonical = json.dumps(inputs, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def get(key):
+    """The cached plan for `key`, or None."""
+    if not settings.PLANNER_CACHE_ENABLED:
+        return None
+    now = timezone.now()
+    entry = PlanCacheEntry.objects.filter(key=key, expires_at__gt=now).values_list('pk', 'plan').first()
+    if entry is None:
+        LOOKUPS.labels('miss').inc()
+        return None
+    PlanCacheEntry.objects.filter(pk=entry[0]).update(hits=F('hits') + 1, last_used_at=now)
+    LOOKUPS.labels('hit').inc()
+    return entry[1]
+
+
+def put(key, planner_request, plan):
+    if not settings.PLANNER_CACHE_ENABLED:
+        return
+    exam_date = parse_exam_date(planner_request.exam_date)
+    now = timezone.now()
+    PlanCacheEntry.objects.update_or_create(key=key, defaults={
+        'exam': find_exam(planner_request.exam_provider, exam_date),
+        'exam_date': exam_date,
+        'plan': plan,
+        'last_used_at': now,
+        'expires_at': now + timedelta(seconds=settings.PLANNER_CACHE_TTL),
+    })
+    evict()
+
+
+def evict():
+    """Drop expired entries, then the least recently used beyond PLANNER_CACHE_MAX_ENTRIES."""
+    expired, _ = PlanCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+    EVICTIONS.labels('expired').inc(expired)
+    limit = settings.PLANNER_CACHE_MAX_ENTRIES
+    cutoff = PlanCacheEntry.objects.order_by('-last_used_at', '-pk').values_list('last_used_at', 'pk')[limit:limit + 1]
+    if cutoff:
+        last_used_at, pk = cutoff[0]
+        over, _ = PlanCacheEntry.objects.filter(
+            Q(last_used_at__lt=last_used_at) | Q(last_used_at=last_used_at, pk__lte=pk)
+        ).delete()
+        EVICTIONS.labels('size').inc(over)
+
+
+def invalidate(exam_ids=(), exam_dates=()):
+    """Drop the entries built for any of `exam_ids`, or without a syllabus for any of `exam_dates`."""
+    exam_ids, exam_dates = list(exam_ids), list(exam_dates)
+    if not exam_ids and not exam_dates:
+        return 0
+    deleted, _ = PlanCacheEntry.objects.filter(
+        Q(exam_id__in=exam_ids) | Q(exam__isnull=True, exam_date__in=exam_dates)
+    ).delete()
+    EVICTIONS.labels('invalidated').inc(deleted)
+    return deleted
+
+
+def stats():
+    entries = PlanCacheEntry.objects.all()
+    return {
+        'entries': entries.count(),
+        'expired': entries.filter(expires_at__lte=timezone.now()).count(),
+        'hits': entries.aggregate(total=Sum('hits'))['total'] or 0,
+    }
+
+
+# ----------------------
+# Syllabus changes
+# ----------------------
+def _exam_changed(sender, instance, **kwargs):
+    invalidate([instance.pk], [instance.exam_date])
+
+
+def _syllabus_changed(sender, instance, **kwargs):
+    invalidate([instance.exam_id])
+
+
+def _book_changed(sender, instance, **kwargs):
+    invalidate(SyllabusDetail.objects.filter(book_id=instance.pk).values_list('exam_id', flat=True).distinct())
+
+
+def connect_signals():
+    post_save.connect(_exam_changed, sender=Exam, dispatch_uid='plan-cache-exam-save')
+    post_delete.connect(_exam_changed, sender=Exam, dispatch_uid='plan-cache-exam-delete')
+    post_save.connect(_syllabus_changed, sender=SyllabusDetail, dispatch_uid='plan-cache-syllabus-save')
+    post_delete.connect(_syllabus_changed, sender=SyllabusDetail, dispatch_uid='plan-cache-syllabus-delete')
+    post_save.connect(_book_changed, sender=Book, dispatch_uid='plan-cache-book-save')
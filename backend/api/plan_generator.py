@@ -0,0 +1,464 @@
+"""
+Local study-plan generator.
+
+Builds a plan from the structured part of a PlannerRequest, without the LLM.
+The exam is found from `exam_provider` and the Jalali `exam_date`; its
+SyllabusDetail rows give the books, topics and page ranges to cover. The
+plan spans the `period_days` days before the exam. Each day's budget is
+`daily_hours`, limited by school, classes and commitments from `form_data`
+and halved on the light day.
+
+Scheduling is one vectorized pass. Every topic costs its pages times
+PLANNER_MINUTES_PER_PAGE, adjusted by the student's level in the subject.
+Topics of different subjects are interleaved so all subjects advance at the
+same pace. Costs are then scaled to the total budget and laid over the day
+boundaries, splitting topics where a day ends.
+
+The result uses the generated_plan format the LLM returns, so it is both the
+draft the LLM refines and the plan used when the LLM is off or unavailable.
+Equal inputs and syllabus always give the same plan.
+"""
+import re
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Exam, SyllabusDetail
+
+# Weekday names as the planner form writes them, indexed by date.weekday().
+WEEKDAYS = ['دوشنبه', 'سه‌شنبه', 'چهارشنبه', 'پنجشنبه', 'جمعه', 'شنبه', 'یکشنبه']
+LEVEL_FACTORS = {'weak': 1.4, 'mid': 1.0, 'strong': 0.75}
+# Subjects from "generals" (Persian, Arabic, ...) are lighter reading.
+GENERAL_FACTOR = 0.6
+DAY_MINUTES = 16 * 60  # waking time school, classes and study share
+LIGHT_DAY_FACTOR = 0.5
+PROVIDER_NAMES = {
+    'ghalamchi': ('قلم‌چی', 'قلمچی', 'ghalamchi', 'kanoon', 'کانون'),
+    'gaj': ('گاج', 'gaj'),
+}
+PAGE_RANGE_RE = re.compile(r'(\d+)\s*(?:[-–تا]+\s*(\d+))?')
+PERSIAN_DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+
+
+# ----------------------
+# Inputs
+# ----------------------
+def jalali_to_gregorian(jy, jm, jd):
+    jy += 1595
+    days = -355668 + 365 * jy + (jy // 33) * 8 + ((jy % 33) + 3) // 4 + jd
+    days += (jm - 1) * 31 if jm < 7 else (jm - 7) * 30 + 186
+    gy = 400 * (days // 146097)
+    days %= 146097
+    if days > 36524:
+        days -= 1
+        gy += 100 * (days // 36524)
+        days %= 36524
+        if days >= 365:
+            days += 1
+    gy += 4 * (days // 1461)
+    days %= 1461
+    if days > 365:
+        gy += (days - 1) // 365
+        days = (days - 1) % 365
+    gd = days + 1
+    leap = (gy % 4 == 0 and gy % 100 != 0) or gy % 400 == 0
+    for gm, length in enumerate([31, 29 if leap else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], 1):
+        if gd <= length:
+            return date(gy, gm, gd)
+        gd -= length
+
+
+def parse_exam_date(value):
+    """'1404-09-02' (Jalali, as the planner form sends it) or an ISO date; None if unreadable."""
+    try:
+        year, month, day = (int(part) for part in str(value).translate(PERSIAN_DIGITS).split('-'))
+        if year < 1700:
+            return jalali_to_gregorian(year, month, day)
+        return date(year, month, day)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_pages(pages):
+    """'12-20, 31-35' -> [(12, 20), (31, 35)]; a single number is one page."""
+    ranges = []
+    for start, end in PAGE_RANGE_RE.findall(str(pages or '').translate(PERSIAN_DIGITS)):
+        start = int(start)
+        end = int(end) if end else start
+        ranges.append((min(start, end), max(start, end)))
+    return ranges
+
+
+def find_exam(provider, exam_date):
+    """The Exam held on `exam_date` by `provider`; any single exam that day if titles don't say."""
+    if exam_date is None:
+        return None
+    exams = list(Exam.objects.filter(exam_date=exam_date).order_by('-exam_type', 'pk'))
+    names = PROVIDER_NAMES.get(provider, (provider,))
+    for exam in exams:
+        if any(name.lower() in exam.title.lower() for name in names if name):
+            return exam
+    return exams[0] if len(exams) == 1 else None
+
+
+def whole_number(value):
+    """A non-negative whole number from form input ('45', '۴۵', 45.0); 0 if unreadable."""
+    try:
+        return max(0, int(float(str(value).translate(PERSIAN_DIGITS))))
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+def subject_factors(form_data):
+    """{subject: time factor} for the subjects the student asked for."""
+    factors = {}
+    for name, choice in (form_data.get('subjects') or {}).items():
+        if isinstance(choice, dict) and choice.get('checked'):
+            factors[name] = LEVEL_FACTORS.get(choice.get('level'), 1.0)
+    for name, choice in (form_data.get('generals') or {}).items():
+        if isinstance(choice, dict) and whole_number(choice.get('days')) > 0:
+            factors.setdefault(name, GENERAL_FACTOR)
+    return factors
+
+
+def _minutes(start, end):
+    try:
+        (sh, sm), (eh, em) = (map(int, value.split(':')) for value in (start, end))
+    except (AttributeError, ValueError):
+        return 0
+    return max(0, (eh * 60 + em) - (sh * 60 + sm))
+
+
+def plan_dates(exam_date, period_days, fallback_start):
+    """The `period_days` dates before the exam (or from `fallback_start` when the date is unknown)."""
+    period_days = max(1, period_days or 14)
+    start = exam_date - timedelta(days=period_days) if exam_date else fallback_start
+    return [start + timedelta(days=i) for i in range(period_days)]
+
+
+def day_budgets(form_data, daily_hours, dates):
+    """Study minutes available on each of `dates`."""
+    busy = np.zeros(len(dates))
+    weekdays = [WEEKDAYS[d.weekday()] for d in dates]
+    week_rows = [form_data.get('school') or []]
+    if form_data.get('hasExistingSchoolPlan'):
+        week_rows = [form_data.get('week1') or [], form_data.get('week2') or []]
+    for i, weekday in enumerate(weekdays):
+        for row in week_rows[(i // 7) % len(week_rows)]:
+            if isinstance(row, dict) and row.get('day') == weekday and row.get('has'):
+                busy[i] += _minutes(row.get('start'), row.get('end'))
+    for row in form_data.get('classes') or []:
+        if isinstance(row, dict):
+            busy += np.array([_minutes(row.get('start'), row.get('end')) if row.get('day') == weekday else 0
+                              for weekday in weekdays])
+    busy += sum(whole_number(row.get('minutes')) for row in form_data.get('commitments') or []
+                if isinstance(row, dict))
+    budget = np.clip(np.minimum(daily_hours * 60, DAY_MINUTES - busy), 0, None)
+    if form_data.get('lightEnabled'):
+        light_day = form_data.get('lightDay')
+        budget *= np.where(np.array(weekdays) == light_day, LIGHT_DAY_FACTOR, 1.0)
+    return budget
+
+
+def load_topics(exam, factors):
+    """Syllabus topics of `exam` in reading order, limited to `factors` (all subjects if empty)."""
+    rows = SyllabusDetail.objects.filter(exam=exam).order_by('book__grade', 'book__name', 'pk').values_list(
+        'book__subject_category', 'book__name', 'topic_title', 'pages'
+    )
+    topics = []
+    for subject, book, topic, pages in rows:
+        if factors and subject not in factors:
+            continue
+        ranges = parse_pages(pages)
+        topics.append({
+            'subject': subject,
+            'book': book,
+            'topic': topic,
+            'ranges': ranges,
+            'pages': sum(end - start + 1 for start, end in ranges) or 1,
+            'factor': factors.get(subject, 1.0),
+        })
+    # Within a book, follow the page order rather than the row order.
+    books = {}
+    for topic in topics:
+        books.setdefault((topic['subject'], topic['book']), []).append(topic)
+    return [t for group in books.values() for t in sorted(group, key=lambda t: t['ranges'][:1])]
+
+
+# ----------------------
+# Scheduling
+# ----------------------
+def interleave(subjects, cost):
+    """Order topics so each subject advances in proportion to its own total cost."""
+    subjects = np.asarray(subjects)
+    order = np.argsort(subjects, kind='stable')
+    sorted_subjects, sorted_cost = subjects[order], cost[order]
+    cumulative = np.cumsum(sorted_cost)
+    starts = np.r_[0, np.flatnonzero(sorted_subjects[1:] != sorted_subjects[:-1]) + 1]
+    counts = np.diff(np.r_[starts, len(order)])
+    before = np.repeat(cumulative[starts] - sorted_cost[starts], counts)
+    totals = np.repeat(np.add.reduceat(sorted_cost, starts), counts)
+    progress = np.empty(len(order))
+    progress[order] = (cumulative - before - sorted_cost / 2) / totals
+    return np.lexsort((np.arange(len(order)), progress))
+
+
+def schedule(cost, budgets):
+    """
+    Lay topics (in order, `cost` minutes each) over days with `budgets`
+    minutes; returns (day, topic, minutes, start, end) arrays, one entry per
+    piece of a topic on a day, with start/end as fractions of the topic.
+    """
+    ends = np.cumsum(cost)
+    starts = ends - cost
+    day_ends = np.cumsum(budgets)
+    total = ends[-1]
+    points = np.unique(np.concatenate([[0.0], ends, day_ends[day_ends < total]]))
+    lengths = np.diff(points)
+    keep = lengths > 1e-9
+    left, right = points[:-1][keep], points[1:][keep]
+    middle = (left + right) / 2
+    topic = np.searchsorted(ends, middle)
+    day = np.minimum(np.searchsorted(day_ends, middle), len(budgets) - 1)
+    span = np.where(cost[topic] > 0, cost[topic], 1)
+    return day, topic, right - left, (left - starts[topic]) / span, (right - starts[topic]) / span
+
+
+def page_label(ranges, pages, start, end):
+    """Pages covered between fractions `start` and `end` of a topic, e.g. '14-19'."""
+    if not ranges:
+        return ''
+    first = int(np.floor(start * pages + 1e-6))
+    last = max(first, int(np.ceil(end * pages - 1e-6)) - 1)
+    offsets = np.cumsum([0] + [e - s + 1 for s, e in ranges])
+
+    def page(offset):
+        i = int(np.searchsorted(offsets, offset, side='right')) - 1
+        return ranges[i][0] + offset - offsets[i]
+
+    first_page, last_page = page(first), page(last)
+    return str(first_page) if first_page == last_page else f'{first_page}-{last_page}'
+
+
+def build_days(dates, budgets):
+    return [{'day': i + 1, 'date': d.isoformat(), 'weekday': WEEKDAYS[d.weekday()],
+             'minutes': int(round(budgets[i])), 'tasks': []} for i, d in enumerate(dates)]
+
+
+def topic_costs(topics, minutes_per_page):
+    return np.array([t['pages'] * t['factor'] for t in topics], dtype=float) * minutes_per_page
+
+
+def fill_days(days, topics, budgets, minutes_per_page, done=None):
+    """
+    Schedule `topics` into `days` (built by build_days), skipping the
+    fraction of each topic given in `done`; returns the load (needed /
+    available time).
+    """
+    done = np.zeros(len(topics)) if done is None else np.asarray(done, dtype=float)
+    left = np.flatnonzero(done < 1 - 1e-9)
+    if not len(left) or budgets.sum() <= 0:
+        return 0.0
+    remaining = 1 - done[left]
+    cost = topic_costs([topics[i] for i in left], minutes_per_page) * remaining
+    order = interleave([topics[i]['subject'] for i in left], cost)
+    needed = cost.sum()
+    scaled = cost[order] * (budgets.sum() / needed)
+    for d, t, minutes, start, end in zip(*schedule(scaled, budgets)):
+        k = left[order[t]]
+        topic, base, share = topics[k], done[k], remaining[order[t]]
+        days[d]['tasks'].append({
+            'subject': topic['subject'],
+            'book': topic['book'],
+            'topic': topic['topic'],
+            'pages': page_label(topic['ranges'], topic['pages'], base + start * share, base + end * share),
+            'minutes': int(round(minutes)),
+            'hours': round(minutes / 60, 2),
+        })
+    return float(needed / budgets.sum())
+
+
+def fill_days_by_subject(days, factors, budgets):
+    """Without a syllabus: share every day between the subjects by their factors."""
+    names = sorted(factors)
+    if not names:
+        return
+    weights = np.array([factors[name] for name in names])
+    share = np.outer(budgets, weights / weights.sum())
+    for d, row in enumerate(share):
+        days[d]['tasks'].extend(
+            {'subject': name, 'book': '', 'topic': '', 'pages': '', 'minutes': int(round(m)), 'hours': round(m / 60, 2)}
+            for name, m in zip(names, row) if m >= 1
+        )
+
+
+def plan_inputs(planner_request):
+    form_data = planner_request.form_data or {}
+    exam_date = parse_exam_date(planner_request.exam_date)
+    dates = plan_dates(exam_date, planner_request.period_days, planner_request.created_at.date())
+    factors = subject_factors(form_data)
+    exam = find_exam(planner_request.exam_provider, exam_date)
+    return {
+        'exam_date': exam_date,
+        'dates': dates,
+        'budgets': day_budgets(form_data, planner_request.daily_hours, dates),
+        'factors': factors,
+        'exam': exam,
+        'topics': load_topics(exam, factors) if exam else [],
+    }
+
+
+def assemble(planner_request, inputs, days, minutes_per_page):
+    topics, budgets, exam, exam_date = inputs['topics'], inputs['budgets'], inputs['exam'], inputs['exam_date']
+    total = budgets.sum()
+    load = topic_costs(topics, minutes_per_page).sum() / total if topics and total > 0 else 0.0
+    return {
+        'source': 'local',
+        'exam': {
+            'id': exam.pk if exam else None,
+            'title': exam.title if exam else '',
+            'date': exam_date.isoformat() if exam_date else planner_request.exam_date,
+        },
+        'summary': {
+            'topics': len(topics),
+            'pages': sum(t['pages'] for t in topics),
+            'minutes': int(round(total)),
+            # Above 1 the syllabus needs more time than the budget allows.
+            'load': round(float(load), 2),
+        },
+        'days': days,
+    }
+
+
+def generate_plan(planner_request, minutes_per_page=None):
+    """The plan for `planner_request` in the generated_plan format, with "source": "local"."""
+    minutes_per_page = minutes_per_page or settings.PLANNER_MINUTES_PER_PAGE
+    inputs = plan_inputs(planner_request)
+    days = build_days(inputs['dates'], inputs['budgets'])
+    if inputs['topics']:
+        fill_days(days, inputs['topics'], inputs['budgets'], minutes_per_page)
+    else:
+        fill_days_by_subject(days, inputs['factors'], inputs['budgets'])
+    return assemble(planner_request, inputs, days, minutes_per_page)
+
+
+# ----------------------
+# Revisions
+# ----------------------
+def _task_minutes(task):
+    return task.get('minutes', round((task.get('hours') or 0) * 60))
+
+
+def page_fraction(topic, label):
+    """Share of `topic` read up to the last page in `label` ('14-19'); a task without pages completes it."""
+    pages = parse_pages(label)
+    if not topic['ranges'] or not pages:
+        return 1.0
+    last, offset = pages[-1][1], 0
+    for start, end in topic['ranges']:
+        if start <= last <= end:
+            return (offset + last - start + 1) / topic['pages']
+        offset += end - start + 1
+    return 0.0
+
+
+def covered(days, topics):
+    """Fraction of each of `topics` already scheduled in `days`."""
+    index = {(t['subject'], t['book'], t['topic']): k for k, t in enumerate(topics)}
+    done = np.zeros(len(topics))
+    for day in days:
+        for task in day['tasks']:
+            k = index.get((task.get('subject'), task.get('book'), task.get('topic')))
+            if k is not None:
+                done[k] = max(done[k], page_fraction(topics[k], task.get('pages')))
+    return done
+
+
+def revise_plan(previous_plan, planner_request, previous_request, today=None, minutes_per_page=None):
+    """
+    Rework `previous_plan` (made for `previous_request`) for the changed
+    inputs of `planner_request`, touching as little of it as possible; days
+    before today are never changed. Returns (plan, revision), where revision
+    names the regenerated days and subjects.
+
+    - When day budgets changed (hours, school, classes, commitments, light
+      day), the syllabus not covered before the first changed day is
+      rescheduled from that day on, for every subject.
+    - When only subjects changed (added, dropped or a different level), the
+      other subjects keep their tasks, with minutes rescaled to their new
+      share of each day, and only the changed subjects are laid out again.
+    - A different exam, exam date or period means a new plan altogether.
+    """
+    minutes_per_page = minutes_per_page or settings.PLANNER_MINUTES_PER_PAGE
+    inputs = plan_inputs(planner_request)
+    dates, budgets, topics, factors = inputs['dates'], inputs['budgets'], inputs['topics'], inputs['factors']
+    old_days = (previous_plan or {}).get('days') or []
+    old_exam = ((previous_plan or {}).get('exam') or {}).get('id')
+    if [day.get('date') for day in old_days] != [d.isoformat() for d in dates] or \
+            old_exam != (inputs['exam'].pk if inputs['exam'] else None):
+        plan = generate_plan(planner_request, minutes_per_page)
+        return plan, {'full': True, 'days': [day['day'] for day in plan['days']], 'subjects': sorted(factors)}
+
+    today = today or timezone.localdate()
+    first_open = next((i for i, d in enumerate(dates) if d >= today), len(dates))
+    changed_days = [i for i, day in enumerate(old_days[first_open:], first_open)
+                    if int(round(budgets[i])) != day.get('minutes')]
+    old_factors = subject_factors(previous_request.form_data or {})
+    changed_subjects = sorted(name for name in set(old_factors) | set(factors)
+                              if old_factors.get(name) != factors.get(name))
+
+    days = [{**day, 'tasks': [dict(task) for task in day['tasks']]} for day in old_days]
+    if changed_days:
+        # Every subject moves: content shifts with the changed budgets.
+        start = first_open if changed_subjects else changed_days[0]
+        subjects = None
+        regenerated = sorted(factors)
+    elif changed_subjects:
+        start, subjects = first_open, set(changed_subjects)
+        regenerated = changed_subjects
+    else:
+        start, subjects, regenerated = len(days), None, []
+    kept, open_days, open_budgets = days[:start], days[start:], budgets[start:]
+    for day, budget in zip(open_days, open_budgets):
+        day['minutes'] = int(round(budget))
+
+    if open_days and subjects is None:
+        for day in open_days:
+            day['tasks'] = []
+        if topics:
+            fill_days(open_days, topics, open_budgets, minutes_per_page, covered(kept, topics))
+        else:
+            fill_days_by_subject(open_days, factors, open_budgets)
+    elif open_days:
+        pool = [t for t in topics if t['subject'] in subjects]
+        others = [t for t in topics if t['subject'] not in subjects]
+        if topics:
+            changed_cost = (topic_costs(pool, minutes_per_page) * (1 - covered(kept, pool))).sum()
+            other_cost = (topic_costs(others, minutes_per_page) * (1 - covered(kept, others))).sum()
+        else:
+            changed_cost = sum(f for name, f in factors.items() if name in subjects)
+            other_cost = sum(f for name, f in factors.items() if name not in subjects)
+        share = changed_cost / (changed_cost + other_cost) if changed_cost + other_cost > 0 else 0.0
+        free = np.zeros(len(open_days))
+        for i, (day, budget) in enumerate(zip(open_days, open_budgets)):
+            day['tasks'] = [task for task in day['tasks'] if task.get('subject') not in subjects]
+            used = sum(_task_minutes(task) for task in day['tasks'])
+            scale = budget * (1 - share) / used if used else 0.0
+            for task in day['tasks']:
+                minutes = _task_minutes(task) * scale
+                task['minutes'], task['hours'] = int(round(minutes)), round(minutes / 60, 2)
+            free[i] = max(0.0, budget - used * scale)
+        if topics:
+            fill_days(open_days, pool, free, minutes_per_page, covered(kept, pool))
+        else:
+            fill_days_by_subject(open_days, {n: f for n, f in factors.items() if n in subjects}, free)
+
+    plan = assemble(planner_request, inputs, days, minutes_per_page)
+    revision = {
+        'full': False,
+        'days': [day['day'] for day in open_days],
+        'subjects': regenerated if open_days else [],
+    }
+    return plan, revision
@@ -0,0 +1,411 @@
+"""
+Planner request processing.
+
+`submit_planner_request` only marks a request pending. Worker processes
+(`manage.py run_planner_workers`) each run a few threads that claim pending
+requests with SELECT ... FOR UPDATE SKIP LOCKED, so any number of processes
+can share the queue and no request is handed to two workers. A claim moves
+the request to "processing" and leases it until `locked_until`; a request
+whose worker died is claimed again once the lease runs out, and every claim
+bumps `attempts`, which the final write checks, so a worker that lost its
+lease cannot overwrite the newer result.
+
+Each plan is drafted locally first (api.plan_generator), which takes
+milliseconds. The LLM client named by PLANNER_LLM_CLIENT then refines the
+draft, and its tasks are merged onto the draft's days, so dates and budgets
+always come from the draft; when the LLM is disabled (PLANNER_LLM_ENABLED)
+or fails, the draft is stored as the plan, so requests complete regardless
+of the LLM. LLM calls
+are capped at PLANNER_LLM_CONCURRENCY across all workers (slots in the
+shared cache), time out after PLANNER_LLM_TIMEOUT and are retried with
+backoff on timeouts, rate limits and server errors.
+
+A revision (a request with a `parent`, made by the revise endpoint) starts
+from the parent's plan instead: api.plan_generator.revise_plan regenerates
+only the days and subjects the changed inputs affect, and only those days
+are sent to the LLM and merged back into the plan.
+"""
+import json
+import logging
+import random
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import plan_cache
+from .models import PlannerRequest, StudentProfile
+from .plan_generator import generate_plan, revise_plan
+
+logger = logging.getLogger('api')
+
+_client = None
+
+
+def llm_payload(planner_request, profile=None):
+    """The data a plan is generated from (also served by get_planner_for_llm)."""
+    if profile is None:
+        profile = StudentProfile.objects.filter(user_id=planner_request.user_id).first()
+    exam_code = f"{planner_request.exam_provider}_{planner_request.exam_date}"
+    return {
+        'request_id': planner_request.id,
+        'user_id': planner_request.user_id,
+        'user_profile': {
+            'name': profile.name if profile else '',
+            'grade': profile.grade if profile else '',
+            'field': profile.field if profile else '',
+            'daily_hours': (profile.daily_hours if profile else 0) or planner_request.daily_hours,
+        },
+        'exam': {
+            'provider': planner_request.exam_provider,
+            'date': planner_request.exam_date,
+            'code': planner_request.exam_code or exam_code,
+        },
+        'constraints': planner_request.form_data,
+        'target_rank': planner_request.target_rank,
+        'period_days': planner_request.period_days,
+    }
+
+
+def shareable_payload(payload):
+    """`payload` without who it is for, for plans that are cached and served to other students."""
+    shared = {key: value for key, value in payload.items() if key not in ('request_id', 'user_id')}
+    shared['user_profile'] = {key: value for key, value in payload['user_profile'].items() if key != 'name'}
+    return shared
+
+
+def merge_refined(draft, refined, days=None):
+    """
+    `draft` with the LLM's version of its days (those numbered in `days`, or
+    all), matched by "day". Each day keeps the draft's date, weekday and
+    minutes, and the plan keeps the draft's exam and summary: revise_plan
+    relies on them, whatever the LLM returned.
+    """
+    by_day = {day.get('day'): day for day in refined['days']
+              if isinstance(day, dict) and isinstance(day.get('tasks'), list)}
+    merged = []
+    for day in draft['days']:
+        new = by_day.get(day['day']) if days is None or day['day'] in days else None
+        skeleton = {key: day[key] for key in ('day', 'date', 'weekday', 'minutes') if key in day}
+        merged.append(day if new is None else {**new, **skeleton})
+    return {**refined, **draft, 'source': refined.get('source', 'llm'), 'days': merged}
+
+
+def validate_plan(plan):
+    """A generated plan is {"days": [{"day": n, "tasks": [...]}, ...], ...}."""
+    if not isinstance(plan, dict) or not isinstance(plan.get('days'), list):
+        raise LLMError('LLM response is not a plan (expected an object with a "days" list)')
+    return plan
+
+
+# ----------------------
+# LLM clients
+# ----------------------
+class LLMError(Exception):
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class BaseLLMClient:
+    def generate(self, payload, timeout):
+        """Return the plan for `payload` (see llm_payload); raise LLMError on failure."""
+        raise NotImplementedError
+
+
+class HTTPLLMClient(BaseLLMClient):
+    """
+    POSTs the payload as JSON to PLANNER_LLM_URL and expects the plan back,
+    either as the response body or under "plan". `run_mock_llm` serves this
+    protocol locally.
+    """
+
+    def __init__(self):
+        self.url = settings.PLANNER_LLM_URL
+        self.api_key = settings.PLANNER_LLM_API_KEY
+
+    def generate(self, payload, timeout):
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+        request = urllib.request.Request(
+            self.url, data=json.dumps(payload).encode(), headers=headers, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                body = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise LLMError(f'LLM returned HTTP {e.code}', retryable=e.code == 429 or e.code >= 500)
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+            raise LLMError(f'LLM unreachable: {e}', retryable=True)
+        except ValueError as e:
+            raise LLMError(f'LLM returned invalid JSON: {e}', retryable=True)
+        if isinstance(body, dict) and 'plan' in body:
+            body = body['plan']
+        return validate_plan(body)
+
+
+def get_llm_client():
+    global _client
+    if _client is None:
+        _client = import_string(settings.PLANNER_LLM_CLIENT)()
+    return _client
+
+
+# ----------------------
+# Concurrency limit
+# ----------------------
+class LLMSlots:
+    """
+    At most `size` LLM calls at a time across every worker process: a call
+    holds one of `size` cache keys, taken with cache.add and expiring on its
+    own if the holder dies. Needs a cache shared by the workers (Redis in
+    production); with the local-memory cache the limit is per process.
+    """
+
+    prefix = 'planner:llm-slot:'
+
+    def __init__(self, size=None, lease=None):
+        self.size = size or settings.PLANNER_LLM_CONCURRENCY
+        self.lease = lease or settings.PLANNER_LLM_TIMEOUT + 30
+
+    def acquire(self, stop_event=None, wait=0.2):
+        """Take a free slot and return its release token; None if stopped while waiting."""
+        token = secrets.token_hex(8)
+        while stop_event is None or not stop_event.is_set():
+            for slot in random.sample(range(self.size), self.size):
+                key = f'{self.prefix}{slot}'
+                if cache.add(key, token, self.lease):
+                    return key, token
+            if stop_event is not None:
+                stop_event.wait(wait)
+            else:
+                time.sleep(wait)
+        return None
+
+    def release(self, held):
+        key, token = held
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def call_llm(payload, client=None, slots=None, stop_event=None, request_id=None):
+    """Generate a plan, holding an LLM slot per call and retrying transient failures."""
+    client = client or get_llm_client()
+    slots = slots or LLMSlots()
+    retries = settings.PLANNER_LLM_RETRIES
+    for attempt in range(retries + 1):
+        held = slots.acquire(stop_event)
+        if held is None:
+            raise LLMError('Worker stopped while waiting for an LLM slot', retryable=True)
+        try:
+            return client.generate(payload, timeout=settings.PLANNER_LLM_TIMEOUT)
+        except LLMError as e:
+            if not e.retryable or attempt == retries:
+                raise
+            logger.warning(f"LLM call for planner request {request_id} failed, retrying: {str(e)}")
+        finally:
+            slots.release(held)
+        delay = settings.PLANNER_LLM_RETRY_DELAY * 2 ** attempt
+        time.sleep(delay + random.uniform(0, delay / 2))
+
+
+# ----------------------
+# Workers
+# ----------------------
+def claim_request():
+    """Take the oldest claimable request and mark it processing; None when there is none."""
+    now = timezone.now()
+    with transaction.atomic():
+        planner_request = (
+            PlannerRequest.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status='pending', locked_until__isnull=True)
+                | Q(status__in=['pending', 'processing'], locked_until__lte=now)
+            )
+            .order_by('created_at')
+            .first()
+        )
+        if planner_request is None:
+            return None
+        # Conditional on `attempts` as well, for databases without SKIP LOCKED
+        # (SQLite in development), where two workers can read the same row.
+        claimed = PlannerRequest.objects.filter(pk=planner_request.pk, attempts=planner_request.attempts).update(
+            status='processing',
+            attempts=planner_request.attempts + 1,
+            locked_until=now + timedelta(seconds=settings.PLANNER_LEASE),
+            updated_at=now,
+        )
+        if not claimed:
+            return None
+    planner_request.status = 'processing'
+    planner_request.attempts += 1
+    return planner_request
+
+
+def _finish(planner_request, **fields):
+    """Write the outcome unless the request was claimed again meanwhile."""
+    updated = PlannerRequest.objects.filter(
+        pk=planner_request.pk, status='processing', attempts=planner_request.attempts
+    ).update(updated_at=timezone.now(), **fields)
+    if not updated:
+        logger.warning(f"Planner request {planner_request.pk} was reclaimed; dropping this result")
+    return bool(updated)
+
+
+def _stopping(stop_event):
+    # An LLM call cut short by shutdown says nothing about the LLM: let
+    # process_request hand the request back rather than store the draft.
+    return stop_event is not None and stop_event.is_set()
+
+
+def cached_plan(planner_request):
+    """The plan of an earlier request with the same inputs, or None (always for uncacheable requests)."""
+    if not plan_cache.cacheable(planner_request):
+        return None
+    return plan_cache.get(plan_cache.cache_key(planner_request, llm_payload(planner_request)))
+
+
+def build_revision(planner_request, client=None, slots=None, stop_event=None):
+    """
+    (plan, llm_error) for a revision: the parent's plan reworked locally
+    where the inputs changed, with only the regenerated days sent to the
+    LLM for refinement. Revisions depend on their parent, so they are not
+    cached.
+    """
+    parent = planner_request.parent
+    draft, revision = revise_plan(parent.generated_plan, planner_request, parent)
+    draft['revision'] = {'parent': parent.pk, **revision}
+    if not revision['days'] or not settings.PLANNER_LLM_ENABLED:
+        return draft, ''
+
+    regenerated = set(revision['days'])
+    payload = llm_payload(planner_request)
+    payload['draft_plan'] = {**draft, 'days': [day for day in draft['days'] if day['day'] in regenerated]}
+    try:
+        refined = call_llm(payload, client, slots, stop_event, planner_request.pk)
+    except Exception as e:
+        if _stopping(stop_event):
+            raise
+        logger.warning(f"LLM failed for planner revision {planner_request.pk}, keeping the local plan: {str(e)}")
+        return draft, f"{type(e).__name__}: {e}"
+    return merge_refined(draft, refined, regenerated), ''
+
+
+def build_plan(planner_request, client=None, slots=None, stop_event=None):
+    """
+    Return (plan, llm_error) for a request: a cached plan for the same
+    inputs, else the local draft refined by the LLM, or the draft alone when
+    the LLM is disabled or fails. Only plans made as configured are cached,
+    and only for cacheable requests, whose LLM payload is anonymous.
+    """
+    if planner_request.parent_id is not None and planner_request.parent.generated_plan:
+        return build_revision(planner_request, client, slots, stop_event)
+
+    payload = llm_payload(planner_request)
+    shared = plan_cache.cacheable(planner_request)
+    if shared:
+        key = plan_cache.cache_key(planner_request, payload)
+        plan = plan_cache.get(key)
+        if plan is not None:
+            return plan, ''
+        payload = shareable_payload(payload)
+
+    try:
+        draft = generate_plan(planner_request)
+    except Exception as e:
+        logger.error(f"Local plan for planner request {planner_request.pk} failed: {str(e)}")
+        draft = None
+    if draft is not None and not settings.PLANNER_LLM_ENABLED:
+        if shared:
+            plan_cache.put(key, planner_request, draft)
+        return draft, ''
+
+    if draft is not None:
+        payload['draft_plan'] = draft
+    try:
+        plan = call_llm(payload, client, slots, stop_event, planner_request.pk)
+    except Exception as e:
+        if draft is None or _stopping(stop_event):
+            raise
+        logger.warning(f"LLM failed for planner request {planner_request.pk}, keeping the local plan: {str(e)}")
+        return draft, f"{type(e).__name__}: {e}"
+    if draft is not None:
+        plan = merge_refined(draft, plan)
+    if shared:
+        plan_cache.put(key, planner_request, plan)
+    return plan, ''
+
+
+def process_request(planner_request, client=None, slots=None, stop_event=None):
+    """Generate and store the plan for a claimed request; returns True when completed."""
+    try:
+        plan, llm_error = build_plan(planner_request, client, slots, stop_event)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if stop_event is not None and stop_event.is_set():
+            # Shutting down: hand the request back without counting the attempt.
+            _finish(planner_request, status='pending', locked_until=None, attempts=planner_request.attempts - 1)
+        elif planner_request.attempts >= settings.PLANNER_MAX_ATTEMPTS:
+            logger.error(f"Planner request {planner_request.pk} failed: {error}")
+            _finish(planner_request, status='failed', locked_until=None, last_error=error)
+        else:
+            retry_at = timezone.now() + timedelta(seconds=settings.PLANNER_RETRY_DELAY * planner_request.attempts)
+            logger.warning(f"Planner request {planner_request.pk} failed, will retry: {error}")
+            _finish(planner_request, status='pending', locked_until=retry_at, last_error=error)
+        return False
+    return _finish(planner_request, status='completed', generated_plan=plan, locked_until=None, last_error=llm_error)
+
+
+def worker_loop(poll_interval, stop_event, client=None, slots=None):
+    """One worker thread: claim and process requests until `stop_event` is set."""
+    processed = 0
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                planner_request = claim_request()
+            except Exception as e:
+                logger.error(f"Claiming planner requests failed: {str(e)}")
+                planner_request = None
+            if planner_request is None:
+                stop_event.wait(poll_interval)
+                continue
+            try:
+                if process_request(planner_request, client, slots, stop_event):
+                    processed += 1
+            except Exception as e:
+                # The lease runs out and another worker picks the request up.
+                logger.error(f"Processing planner request {planner_request.pk} failed: {str(e)}")
+    finally:
+        connection.close()
+    return processed
+
+
+def run_planner_workers(threads, poll_interval, stop_event=None, client=None):
+    """Run `threads` worker threads until `stop_event` is set; returns the number of plans completed."""
+    stop_event = stop_event or threading.Event()
+    results = []
+    workers = [
+        threading.Thread(
+            target=lambda: results.append(worker_loop(poll_interval, stop_event, client)),
+            name=f'planner-worker-{i}',
+            daemon=True,
+        )
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        while worker.is_alive():
+            worker.join(1)
+    return sum(results)
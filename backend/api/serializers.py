@@ -1,11 +1,31 @@
 from rest_framework import serializers
+from .images import srcset, variants_field
 from .models import StudentProfile, Notification, PlannerRequest
 
 
+class SrcsetField(serializers.Field):
+    """Responsive variants of an image field (see api.images); null until generated."""
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return srcset(
+            getattr(instance, self.image_field),
+            getattr(instance, variants_field(self.image_field)),
+            self.context.get('request'),
+        )
+
+
 class StudentProfileSerializer(serializers.ModelSerializer):
+    avatar_srcset = SrcsetField('avatar')
+
     class Meta:
         model = StudentProfile
-        fields = "__all__"
+        exclude = ["avatar_variants"]
         read_only_fields = ["user"]
 
 
@@ -29,8 +49,9 @@ class PlannerRequestSerializer(serializers.ModelSerializer):
             'exam_code',
             'target_rank',
             'period_days',
+            'parent',
             'created_at',
             'updated_at',
             'expires_at',
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'expires_at', 'status', 'generated_plan']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'expires_at', 'status', 'generated_plan', 'parent']
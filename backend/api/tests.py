@@ -1,3 +1,669 @@
-from django.test import TestCase
-
-# Create your tests here.
+import copy
+import json
+import smtplib
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, timedelta
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import images, otp, planner
+from .mail import MailSender, queue_mail
+from .management.commands.run_mock_smtp import MockSMTPServer
+from .models import Book, EmailOTP, Exam, OutboundEmail, PlanCacheEntry, PlannerRequest, StudentProfile, SyllabusDetail
+from .plan_generator import (
+    day_budgets, generate_plan, jalali_to_gregorian, page_label, parse_pages, revise_plan, subject_factors,
+)
+from .serializers import StudentProfileSerializer
+
+REDIS_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                           'LOCATION': 'redis://localhost:6379/0'}}
+
+
+@override_settings(OTP_TTL=900, OTP_MAX_ATTEMPTS=3, OTP_AUDIT=False)
+class CacheOTPBackendTests(TestCase):
+    email = 'student@example.com'
+
+    def setUp(self):
+        cache.clear()
+        self.backend = otp.CacheOTPBackend()
+        self.code = self.backend.issue(self.email)
+        self.wrong = '100000' if self.code != '100000' else '100001'
+
+    def test_code_is_single_use(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.verify(' Student@Example.com ', self.code), otp.VALID)
+        self.assertEqual(self.backend.verify(self.email, self.code), otp.INVALID)
+        self.assertFalse(EmailOTP.objects.exists())
+
+    def test_wrong_codes_lock_the_code(self):
+        for _ in range(3):
+            self.assertEqual(self.backend.verify(self.email, self.wrong), otp.INVALID)
+        self.assertEqual(self.backend.verify(self.email, self.code), otp.LOCKED)
+        # The locked code is dropped; only a new one works.
+        self.assertEqual(self.backend.verify(self.email, self.code), otp.INVALID)
+        code = self.backend.issue(self.email)
+        self.assertEqual(self.backend.verify(self.email, code), otp.VALID)
+
+    def test_new_code_resets_attempts(self):
+        for _ in range(3):
+            self.backend.verify(self.email, self.wrong)
+        code = self.backend.issue(self.email)
+        self.assertEqual(self.backend.verify(self.email, self.code), otp.INVALID)
+        self.assertEqual(self.backend.verify(self.email, code), otp.VALID)
+
+    def test_expired_code(self):
+        with mock.patch('api.otp.time.time', return_value=time.time() + 901):
+            self.assertEqual(self.backend.verify(self.email, self.code), otp.EXPIRED)
+
+    def test_codes_are_per_email(self):
+        self.assertEqual(self.backend.verify('other@example.com', self.code), otp.INVALID)
+        self.assertEqual(self.backend.verify(self.email, self.code), otp.VALID)
+
+
+@override_settings(OTP_TTL=900)
+class DatabaseOTPBackendTests(TestCase):
+    email = 'student@example.com'
+
+    def setUp(self):
+        self.backend = otp.DatabaseOTPBackend()
+
+    def test_code_is_single_use(self):
+        code = self.backend.issue(self.email)
+        self.assertEqual(self.backend.verify(self.email, code), otp.VALID)
+        self.assertEqual(self.backend.verify(self.email, code), otp.INVALID)
+
+    def test_new_code_replaces_the_old_one(self):
+        old = self.backend.issue(self.email)
+        code = self.backend.issue(self.email)
+        if old != code:
+            self.assertEqual(self.backend.verify(self.email, old), otp.INVALID)
+        self.assertEqual(self.backend.verify(self.email, code), otp.VALID)
+
+    def test_expired_code(self):
+        code = self.backend.issue(self.email)
+        EmailOTP.objects.update(created_at=EmailOTP.objects.get().created_at - timedelta(seconds=901))
+        self.assertEqual(self.backend.verify(self.email, code), otp.EXPIRED)
+
+
+@override_settings(OTP_BACKEND='api.otp.CacheOTPBackend', OTP_CACHE_ALIAS='default')
+class CheckBackendTests(TestCase):
+    @override_settings(DEBUG=False)
+    def test_cache_backend_needs_a_shared_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            otp.check_backend()
+
+    @override_settings(DEBUG=False, CACHES=REDIS_CACHE)
+    def test_shared_cache(self):
+        otp.check_backend()
+
+    @override_settings(DEBUG=False, OTP_BACKEND='api.otp.DatabaseOTPBackend')
+    def test_database_backend(self):
+        otp.check_backend()
+
+    @override_settings(DEBUG=True)
+    def test_local_memory_is_fine_in_development(self):
+        otp.check_backend()
+
+
+class RefusingBackend(BaseEmailBackend):
+    def __init__(self, code=451, **kwargs):
+        super().__init__(**kwargs)
+        self.code = code
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPDataError(self.code, 'refused')
+
+
+@override_settings(EMAIL_QUEUE_RETRY_DELAY=30, EMAIL_QUEUE_MAX_ATTEMPTS=5)
+class MailExpiryTests(TestCase):
+    def queue(self, ttl=None):
+        return queue_mail('Your Login Code', 'Your login code is: 123456', ['student@example.com'], ttl=ttl)
+
+    def test_mail_is_sent_before_it_expires(self):
+        self.queue(ttl=900)
+        sender = MailSender()
+        self.assertEqual(sender.send_batch(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(OutboundEmail.objects.get().status, 'sent')
+
+    def test_expired_mail_is_dropped(self):
+        queued = self.queue(ttl=900)
+        OutboundEmail.objects.filter(pk=queued.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        sender = MailSender()
+        sender.send_batch()
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual((sender.sent, sender.expired), (0, 1))
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_no_retry_past_expiry(self):
+        self.queue(ttl=20)
+        sender = MailSender(connection=RefusingBackend())
+        sender.send_batch()
+        self.assertEqual(sender.expired, 1)
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_mail_without_ttl_is_retried(self):
+        self.queue()
+        sender = MailSender(connection=RefusingBackend())
+        sender.send_batch()
+        queued = OutboundEmail.objects.get()
+        self.assertEqual((queued.status, queued.attempts), ('queued', 1))
+        self.assertGreater(queued.next_attempt_at, timezone.now() + timedelta(seconds=25))
+
+    def test_permanent_refusal_is_not_retried(self):
+        self.queue(ttl=900)
+        sender = MailSender(connection=RefusingBackend(code=550))
+        sender.send_batch()
+        queued = OutboundEmail.objects.get()
+        self.assertEqual((queued.status, queued.attempts, sender.failed), ('failed', 1, 1))
+        self.assertIn('550', queued.last_error)
+
+    def test_outcome_is_not_written_after_the_claim_is_lost(self):
+        queued = self.queue()
+        sender = MailSender()
+        [claimed] = sender.claim()
+        # The lease ran out and another sender claimed the row in the meantime.
+        OutboundEmail.objects.filter(pk=queued.pk).update(next_attempt_at=timezone.now() + timedelta(minutes=5))
+        with self.assertLogs('api', 'WARNING') as logs:
+            self.assertFalse(sender._record(claimed, status='sent', sent_at=timezone.now(), attempts=1))
+            sender._failed(claimed, smtplib.SMTPDataError(550, 'refused'))
+        self.assertEqual(len(logs.records), 2)
+        sender._expired(claimed)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('queued', 0))
+        self.assertEqual((sender.sent, sender.failed, sender.expired), (0, 0, 0))
+
+
+class MockSMTPTests(TestCase):
+    """Batches go through the real SMTP backend to run_mock_smtp's server, over one connection."""
+
+    def setUp(self):
+        self.server = MockSMTPServer(('127.0.0.1', 0), refuse=['bounce@'])
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        settings = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=self.server.server_address[1], EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_TIMEOUT=5,
+            EMAIL_QUEUE_BATCH_SIZE=10,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_batch_reuses_one_connection(self):
+        for i in range(5):
+            queue_mail('Hi', 'Body', [f'student{i}@example.com'])
+        queue_mail('Hi', 'Body', ['bounce@example.com'])
+        sender = MailSender()
+        try:
+            self.assertEqual(sender.send_batch(), 6)
+        finally:
+            sender.close()
+        self.assertEqual((self.server.connections, self.server.messages), (1, 5))
+        self.assertEqual((sender.sent, sender.failed), (5, 1))
+        self.assertEqual(OutboundEmail.objects.get(status='failed').to, ['bounce@example.com'])
+
+
+PLANNER_FORM = {
+    'examProvider': 'gaj', 'examDate': '1404-09-16', 'dailyHours': 6,
+    'school': [{'day': 'شنبه', 'has': True, 'start': '07:00', 'end': '17:00'}],
+    'subjects': {'ریاضی': {'checked': True, 'level': 'weak'}, 'فیزیک': {'checked': True, 'level': 'strong'},
+                 'زیست': {'checked': False, 'level': 'mid'}},
+    'commitments': [{'text': 'کلاس زبان', 'minutes': 30}],
+    'lightEnabled': True, 'lightDay': 'جمعه', 'generals': {},
+}
+
+
+class PlannerDataMixin:
+    """A Gaj exam on 1404-09-16 (2025-12-07) with 30 topics in each of math, physics and biology."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='student@example.com', password='x')
+        cls.exam = Exam.objects.create(exam_date=date(2025, 12, 7), title='آزمون گاج ۱۶ آذر', exam_type='Main')
+        Exam.objects.create(exam_date=date(2025, 12, 7), title='آزمون قلم‌چی', exam_type='Main')
+        books = [Book.objects.create(name=f'{subject} ۳', grade=12, subject_category=subject)
+                 for subject in ('ریاضی', 'فیزیک', 'زیست')]
+        for i in range(30):
+            SyllabusDetail.objects.create(exam=cls.exam, book=books[0], topic_title=f'm{i}',
+                                          pages=f'{10 + i * 3}-{12 + i * 3}')
+            SyllabusDetail.objects.create(exam=cls.exam, book=books[1], topic_title=f'p{i}',
+                                          pages=f'{5 + i * 2}-{6 + i * 2}')
+            SyllabusDetail.objects.create(exam=cls.exam, book=books[2], topic_title=f'b{i}', pages=str(i + 1))
+
+    def make_request(self, form_data=None, **fields):
+        values = {'user': self.user, 'exam_provider': 'gaj', 'exam_date': '1404-09-16', 'daily_hours': 6,
+                  'period_days': 14, 'status': 'pending', **fields}
+        return PlannerRequest.objects.create(
+            form_data=PLANNER_FORM if form_data is None else form_data,
+            expires_at=timezone.now() + timedelta(days=60), **values,
+        )
+
+
+class PlanGeneratorTests(PlannerDataMixin, TestCase):
+    def test_dates_and_pages(self):
+        self.assertEqual(jalali_to_gregorian(1404, 9, 2), date(2025, 11, 23))
+        self.assertEqual(jalali_to_gregorian(1399, 12, 30), date(2021, 3, 20))
+        self.assertEqual(parse_pages('12-20, 31-35'), [(12, 20), (31, 35)])
+        self.assertEqual(parse_pages('۱۲ تا ۱۵'), [(12, 15)])
+        self.assertEqual(page_label([(10, 14), (20, 24)], 10, 0.3, 0.7), '13-21')
+
+    def test_day_budgets(self):
+        plan = generate_plan(self.make_request())
+        days = plan['days']
+        self.assertEqual((len(days), days[0]['date'], days[-1]['date']), (14, '2025-11-23', '2025-12-06'))
+        for day in days:
+            if day['weekday'] == 'شنبه':  # school and the commitment
+                self.assertEqual(day['minutes'], 16 * 60 - 600 - 30)
+            elif day['weekday'] == 'جمعه':  # the light day
+                self.assertEqual(day['minutes'], 180)
+            else:
+                self.assertEqual(day['minutes'], 360)
+            self.assertLessEqual(abs(sum(task['minutes'] for task in day['tasks']) - day['minutes']),
+                                 len(day['tasks']))
+
+    def test_topics_are_scheduled_in_order_and_interleaved(self):
+        plan = generate_plan(self.make_request())
+        tasks = [task for day in plan['days'] for task in day['tasks']]
+        self.assertEqual({task['subject'] for task in tasks}, {'ریاضی', 'فیزیک'})
+        for subject, prefix in (('ریاضی', 'm'), ('فیزیک', 'p')):
+            topics = list(dict.fromkeys(task['topic'] for task in tasks if task['subject'] == subject))
+            self.assertEqual(topics, [f'{prefix}{i}' for i in range(30)])
+        for day in (plan['days'][0], plan['days'][-1]):
+            self.assertEqual({task['subject'] for task in day['tasks']}, {'ریاضی', 'فیزیک'})
+        self.assertEqual(plan['summary']['topics'], 60)
+        self.assertTrue(tasks[0]['pages'].startswith(('5', '10')))
+
+    def test_same_inputs_same_plan(self):
+        with self.assertNumQueries(3):  # exams, syllabus, and nothing per topic
+            plan = generate_plan(self.make_request())
+        self.assertEqual(generate_plan(self.make_request()), plan)
+
+    def test_without_syllabus(self):
+        plan = generate_plan(self.make_request(exam_provider='sanjesh', exam_date='1404-10-01'))
+        self.assertIsNone(plan['exam']['id'])
+        self.assertEqual({task['subject'] for task in plan['days'][0]['tasks']}, {'ریاضی', 'فیزیک'})
+
+    def test_malformed_form_input(self):
+        form = {**PLANNER_FORM, 'commitments': [{'minutes': 'نیم ساعت'}, {'minutes': '۳۰'}, 'x', {'minutes': None}],
+                'classes': ['x', {'day': 'شنبه', 'start': 'صبح', 'end': '10:00'}],
+                'generals': {'ادبیات': {'days': '2'}, 'عربی': {'days': 'x'}}}
+        dates = [date(2025, 11, 29)]  # a Saturday
+        self.assertEqual(list(day_budgets(form, 6, dates)), [16 * 60 - 600 - 30])
+        self.assertEqual(sorted(subject_factors(form)), ['ادبیات', 'ریاضی', 'فیزیک'])
+        self.assertEqual(len(generate_plan(self.make_request(form))['days']), 14)
+
+
+class StoppingClient(planner.BaseLLMClient):
+    """Stops the worker in the middle of its LLM call, as a SIGTERM would."""
+
+    def __init__(self, stop_event):
+        self.stop_event = stop_event
+
+    def generate(self, payload, timeout):
+        self.stop_event.set()
+        raise planner.LLMError('LLM unreachable: interrupted', retryable=True)
+
+
+@override_settings(PLANNER_LLM_ENABLED=True, PLANNER_CACHE_ENABLED=False, PLANNER_LLM_RETRY_DELAY=0)
+class PlannerShutdownTests(PlannerDataMixin, TestCase):
+    def test_stopped_worker_hands_the_request_back(self):
+        self.make_request()
+        planner_request = planner.claim_request()
+        stop_event = threading.Event()
+        completed = planner.process_request(planner_request, StoppingClient(stop_event), stop_event=stop_event)
+        self.assertFalse(completed)
+        planner_request.refresh_from_db()
+        self.assertEqual((planner_request.status, planner_request.attempts), ('pending', 0))
+        self.assertIsNone(planner_request.locked_until)
+        self.assertIsNone(planner_request.generated_plan)
+
+
+class RecordingClient(planner.BaseLLMClient):
+    def __init__(self):
+        self.payloads = []
+
+    def generate(self, payload, timeout):
+        self.payloads.append(payload)
+        return {**payload['draft_plan'], 'source': 'llm'}
+
+
+@override_settings(PLANNER_LLM_ENABLED=True, PLANNER_CACHE_ENABLED=True)
+class PlanCacheTests(PlannerDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        StudentProfile.objects.create(user=cls.user, name='سارا احمدی', grade='12', field='riazi',
+                                      phone='09120000000', birthdate_jalali='1386-01-01')
+
+    def test_cached_plans_are_made_without_the_student(self):
+        client = RecordingClient()
+        plan, _ = planner.build_plan(self.make_request(), client)
+        payload = client.payloads[0]
+        self.assertNotIn('request_id', payload)
+        self.assertNotIn('user_id', payload)
+        self.assertNotIn('name', payload['user_profile'])
+        self.assertEqual(payload['user_profile']['grade'], '12')
+        self.assertNotIn('سارا', json.dumps(payload, ensure_ascii=False))
+
+        # Another student with the same inputs gets the stored plan.
+        other = get_user_model().objects.create_user(email='other@example.com', password='x')
+        StudentProfile.objects.create(user=other, name='علی رضایی', grade='12', field='riazi',
+                                      phone='09120000001', birthdate_jalali='1386-02-02')
+        self.assertEqual(planner.cached_plan(self.make_request(user=other)), plan)
+        self.assertEqual(len(client.payloads), 1)
+
+    def test_unreadable_exam_date_is_not_cached(self):
+        client = RecordingClient()
+        planner_request = self.make_request(exam_date='نامشخص')
+        planner.build_plan(planner_request, client)
+        self.assertFalse(PlanCacheEntry.objects.exists())
+        self.assertIsNone(planner.cached_plan(self.make_request(exam_date='نامشخص')))
+        # Not shared, so the LLM may know whose plan it is.
+        self.assertEqual(client.payloads[0]['request_id'], planner_request.pk)
+
+
+class BareDaysClient(planner.BaseLLMClient):
+    """An LLM that answers with only the day numbers and tasks of the days it was sent."""
+
+    def __init__(self):
+        self.days = []
+
+    def generate(self, payload, timeout):
+        days = payload['draft_plan']['days']
+        self.days.append([day['day'] for day in days])
+        return {'days': [{'day': day['day'], 'tasks': day['tasks'], 'note': 'مرور'} for day in days]}
+
+
+@override_settings(PLANNER_LLM_ENABLED=True, PLANNER_CACHE_ENABLED=False)
+class RevisePlanTests(PlannerDataMixin, TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def complete(self, planner_request, client=None):
+        planner.process_request(planner.claim_request(), client or BareDaysClient())
+        planner_request.refresh_from_db()
+        self.assertEqual(planner_request.status, 'completed')
+        return planner_request
+
+    def test_llm_days_keep_the_draft_dates_and_budgets(self):
+        original = self.complete(self.make_request())
+        draft = generate_plan(original)
+        days = original.generated_plan['days']
+        self.assertEqual([(d['date'], d['minutes']) for d in days], [(d['date'], d['minutes']) for d in draft['days']])
+        self.assertEqual(days[0]['note'], 'مرور')
+        self.assertEqual(original.generated_plan['exam'], draft['exam'])
+
+    def test_hours_change_regenerates_from_today(self):
+        original = self.complete(self.make_request())
+        today = date.fromisoformat(original.generated_plan['days'][9]['date'])
+        response = self.api.post(f'/api/planner/{original.pk}/revise/', {'form_data': {'dailyHours': 4}}, format='json')
+        self.assertEqual(response.status_code, 201)
+        revision = PlannerRequest.objects.get(pk=response.json()['data']['id'])
+        self.assertEqual((revision.parent_id, revision.daily_hours), (original.pk, 4))
+
+        client = BareDaysClient()
+        with mock.patch('api.plan_generator.timezone.localdate', return_value=today):
+            revision = self.complete(revision, client)
+        self.assertEqual(client.days, [[10, 11, 12, 13, 14]])
+        plan = revision.generated_plan
+        self.assertFalse(plan['revision']['full'])
+        self.assertEqual(plan['days'][:9], original.generated_plan['days'][:9])
+        self.assertTrue(all(day['minutes'] <= 240 for day in plan['days'][9:]))
+
+    def test_subject_change_keeps_other_subjects(self):
+        original = self.make_request(status='completed')
+        original.generated_plan = generate_plan(original)
+        form = copy.deepcopy(PLANNER_FORM)
+        form['subjects']['فیزیک']['level'] = 'weak'
+        revision = self.make_request(form, parent=original)
+        plan, info = revise_plan(original.generated_plan, revision, original, today=date(2025, 11, 1))
+        self.assertEqual((info['full'], info['subjects']), (False, ['فیزیک']))
+
+        def tasks(days, subject):
+            return [[(task['topic'], task['pages']) for task in day['tasks'] if task['subject'] == subject]
+                    for day in days]
+
+        self.assertEqual(tasks(plan['days'], 'ریاضی'), tasks(original.generated_plan['days'], 'ریاضی'))
+        physics = [topic for day in tasks(plan['days'], 'فیزیک') for topic, _ in day]
+        self.assertEqual(list(dict.fromkeys(physics)), [f'p{i}' for i in range(30)])
+
+    def test_new_exam_date_is_a_new_plan(self):
+        original = self.make_request(status='completed')
+        original.generated_plan = generate_plan(original)
+        revision = self.make_request(parent=original, exam_date='1404-09-30')
+        plan, info = revise_plan(original.generated_plan, revision, original)
+        self.assertTrue(info['full'])
+        self.assertEqual(plan, generate_plan(revision))
+
+    def test_form_data_must_be_an_object(self):
+        original = self.make_request(status='completed', generated_plan={'days': []})
+        for form_data in (['dailyHours', 4], 'dailyHours=4', 4):
+            response = self.api.post(f'/api/planner/{original.pk}/revise/', {'form_data': form_data}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(PlannerRequest.objects.filter(parent=original).exists())
+
+
+@override_settings(PLANNER_LEASE=600)
+class ClaimTests(PlannerDataMixin, TestCase):
+    def test_planner_claims_oldest_pending_once(self):
+        first, second = self.make_request(), self.make_request()
+        self.make_request(status='draft')
+        claimed = [planner.claim_request(), planner.claim_request(), planner.claim_request()]
+        self.assertEqual([r.pk if r else None for r in claimed], [first.pk, second.pk, None])
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts), ('processing', 1))
+        self.assertGreater(first.locked_until, timezone.now() + timedelta(seconds=590))
+
+    def test_expired_lease_is_claimed_again_and_fences_the_old_worker(self):
+        self.make_request()
+        stale = planner.claim_request()
+        PlannerRequest.objects.filter(pk=stale.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        fresh = planner.claim_request()
+        self.assertEqual((fresh.pk, fresh.attempts), (stale.pk, 2))
+        self.assertFalse(planner._finish(stale, status='completed', generated_plan={'days': []}))
+        self.assertTrue(planner._finish(fresh, status='completed', generated_plan={'days': []}))
+
+    @override_settings(EMAIL_QUEUE_BATCH_SIZE=2, EMAIL_QUEUE_LEASE=300)
+    def test_mail_claims_due_rows_in_batches_with_a_lease(self):
+        for i in range(3):
+            queue_mail('Hi', 'Body', [f'student{i}@example.com'])
+        later = queue_mail('Later', 'Body', ['later@example.com'])
+        OutboundEmail.objects.filter(pk=later.pk).update(next_attempt_at=timezone.now() + timedelta(hours=1))
+        sender = MailSender()
+        self.assertEqual(len(sender.claim()), 2)
+        self.assertEqual(len(sender.claim()), 1)
+        self.assertEqual(sender.claim(), [])
+        leased = OutboundEmail.objects.filter(subject='Hi')
+        self.assertTrue(all(row.next_attempt_at > timezone.now() + timedelta(seconds=290) for row in leased))
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class SkipLockedClaimTests(TransactionTestCase):
+    """A row locked by one worker's open transaction is skipped, not waited for, by the next."""
+
+    def hold_lock(self, queryset, run):
+        locked, release = threading.Event(), threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    list(queryset.select_for_update())
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        self.assertTrue(locked.wait(10))
+        try:
+            return run()
+        finally:
+            release.set()
+            thread.join()
+
+    def test_planner_workers_skip_locked_requests(self):
+        user = get_user_model().objects.create_user(email='student@example.com', password='x')
+        first, second = (PlannerRequest.objects.create(
+            user=user, exam_provider='gaj', exam_date='1404-09-16', status='pending',
+            expires_at=timezone.now() + timedelta(days=60)) for _ in range(2))
+        claimed = self.hold_lock(PlannerRequest.objects.filter(pk=first.pk), planner.claim_request)
+        self.assertEqual(claimed.pk, second.pk)
+
+    def test_mail_senders_skip_locked_rows(self):
+        first = queue_mail('Hi', 'Body', ['first@example.com'])
+        second = queue_mail('Hi', 'Body', ['second@example.com'])
+        claimed = self.hold_lock(OutboundEmail.objects.filter(pk=first.pk), MailSender().claim)
+        self.assertEqual([mail.pk for mail in claimed], [second.pk])
+
+
+def image_bytes(width, height, mode='RGB', color=(200, 10, 10)):
+    buffer = BytesIO()
+    Image.new(mode, (width, height), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ImageDataMixin:
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, IMAGE_DERIVATIVE_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def make_profile(self, email='student@example.com'):
+        user = get_user_model().objects.create_user(email=email, password='x')
+        return StudentProfile.objects.create(user=user, name='سارا احمدی', grade='12', field='riazi',
+                                             phone='09120000000', birthdate_jalali='1386-01-01')
+
+    def upload(self, profile, data, name='avatar.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.avatar.save(name, ContentFile(data))
+        profile.refresh_from_db()
+        return profile.avatar_variants
+
+    def stored(self, variants):
+        return [default_storage.exists(item['name']) for item in variants['images']]
+
+
+class ImageRenderingTests(SimpleTestCase):
+    def test_widths_formats_and_placeholder(self):
+        rendered = images.render_derivatives(image_bytes(300, 150), [64, 128, 256, 512], 80)
+        self.assertEqual((rendered['width'], rendered['height']), (300, 150))
+        # 512 would upscale and collapses onto the original width.
+        self.assertEqual(sorted({item['width'] for item in rendered['files']}), [64, 128, 256, 300])
+        self.assertEqual({item['format'] for item in rendered['files']}, {'jpg', 'webp'})
+        for item in rendered['files']:
+            with Image.open(BytesIO(item['data'])) as image:
+                self.assertEqual(image.width, item['width'])
+            self.assertTrue(item['name'].startswith(f"derivatives/{rendered['hash'][:2]}/{rendered['hash']}-"))
+        self.assertTrue(rendered['placeholder'].startswith('data:image/webp;base64,'))
+
+    def test_transparent_images_fall_back_to_png(self):
+        rendered = images.render_derivatives(image_bytes(100, 100, 'RGBA', (0, 0, 0, 0)), [64], 80)
+        self.assertEqual({item['format'] for item in rendered['files']}, {'png', 'webp'})
+
+    def test_names_follow_the_bytes(self):
+        first = images.render_derivatives(image_bytes(100, 100), [64], 80)
+        self.assertEqual(images.render_derivatives(image_bytes(100, 100), [64], 80)['hash'], first['hash'])
+        self.assertNotEqual(images.render_derivatives(image_bytes(100, 101), [64], 80)['hash'], first['hash'])
+
+
+class ImageStorageTests(ImageDataMixin, TestCase):
+    def test_upload_records_stored_derivatives(self):
+        profile = self.make_profile()
+        variants = self.upload(profile, image_bytes(300, 150))
+        self.assertEqual(variants['source'], profile.avatar.name)
+        self.assertEqual(sorted(item['width'] for item in variants['images']), [64, 64, 128, 128, 256, 256])
+        self.assertTrue(all(self.stored(variants)))
+
+    def test_replaced_image_derivatives_are_deleted(self):
+        profile = self.make_profile()
+        old = self.upload(profile, image_bytes(300, 150))
+        new = self.upload(profile, image_bytes(300, 150, color=(10, 200, 10)))
+        self.assertFalse(any(self.stored(old)))
+        self.assertTrue(all(self.stored(new)))
+
+    def test_shared_derivatives_are_kept(self):
+        profile, other = self.make_profile(), self.make_profile('other@example.com')
+        shared = self.upload(profile, image_bytes(300, 150))
+        self.upload(other, image_bytes(300, 150))
+        self.upload(profile, image_bytes(300, 150, color=(10, 200, 10)))
+        self.assertTrue(all(self.stored(shared)))
+
+    def test_removed_image_derivatives_are_deleted(self):
+        profile = self.make_profile()
+        old = self.upload(profile, image_bytes(300, 150))
+        profile.avatar = None
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        profile.refresh_from_db()
+        self.assertEqual(profile.avatar_variants, {})
+        self.assertFalse(any(self.stored(old)))
+
+    def test_srcset_field(self):
+        profile = self.make_profile()
+        self.upload(profile, image_bytes(300, 150))
+        request = APIRequestFactory().get('/')
+        data = StudentProfileSerializer(profile, context={'request': request}).data['avatar_srcset']
+        self.assertEqual(data['srcset'].count('http://testserver/media/derivatives/'), 3)
+        self.assertTrue(data['srcset'].endswith('256w'))
+        self.assertIn('128w', data['webp_srcset'])
+        self.assertEqual((data['width'], data['height']), (300, 150))
+
+        # Variants made from an earlier upload are not served.
+        StudentProfile.objects.filter(pk=profile.pk).update(avatar='avatars/other.png')
+        profile.refresh_from_db()
+        self.assertIsNone(StudentProfileSerializer(profile).data['avatar_srcset'])
+
+
+class ImageStoringThreadTests(ImageDataMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        # Set the avatar behind the signal's back; the tests hand results over themselves.
+        self.profile = self.make_profile()
+        name = default_storage.save('avatars/avatar.png', ContentFile(image_bytes(300, 150)))
+        StudentProfile.objects.filter(pk=self.profile.pk).update(avatar=name)
+        self.profile.refresh_from_db()
+
+    def finish(self, profile, future):
+        images._finish(StudentProfile, profile.pk, 'avatar', profile.avatar.name, future)
+        images._results.join()
+
+    def test_results_are_stored_off_the_callback_thread(self):
+        profile = self.profile
+        future = Future()
+        future.set_result(images.render_derivatives(image_bytes(300, 150), [64], 80))
+        self.finish(profile, future)
+        profile.refresh_from_db()
+        self.assertEqual(profile.avatar_variants['source'], profile.avatar.name)
+        self.assertNotEqual(images._storer.ident, threading.get_ident())
+
+    def test_failed_render_is_logged(self):
+        profile = self.profile
+        future = Future()
+        future.set_exception(OSError('cannot identify image file'))
+        with self.assertLogs('api', 'ERROR'):
+            self.finish(profile, future)
+        profile.refresh_from_db()
+        self.assertEqual(profile.avatar_variants, {})
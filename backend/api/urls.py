@@ -4,7 +4,7 @@ from .views import (
     health_check, send_otp, verify_otp, get_profile, update_profile, 
     upload_avatar, register, list_notifications, send_test_notification,
     create_planner_request, get_planner_request, list_planner_requests,
-    get_planner_for_llm, submit_planner_request
+    get_planner_for_llm, submit_planner_request, revise_planner_request
 )
 from django.conf import settings
 from django.conf.urls.static import static
@@ -23,6 +23,7 @@ urlpatterns = [
     path('planner/create/', create_planner_request),
     path('planner/<int:request_id>/', get_planner_request),
     path('planner/<int:request_id>/submit/', submit_planner_request),
+    path('planner/<int:request_id>/revise/', revise_planner_request),
     path('planner/list/', list_planner_requests),
     path('planner/<int:request_id>/llm-data/', get_planner_for_llm),
 ]
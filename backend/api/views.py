@@ -2,9 +2,8 @@ from django.shortcuts import render
 from django_ratelimit.decorators import ratelimit
 from django.core.paginator import Paginator
 from django.db import transaction
-from django.utils import timezone
-from datetime import timedelta
 import logging
+import os
 
 logger = logging.getLogger('api')
 
@@ -23,11 +22,9 @@ def health_check(request):
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from django.core.mail import send_mail
-from django.utils import timezone
-from .models import EmailOTP
 from django.conf import settings
-import random
+from . import otp as otp_store
+from .mail import queue_mail
 
 
 @api_view(['POST'])
@@ -50,20 +47,9 @@ def send_otp(request):
         if '@' not in email or '.' not in email.split('@')[1]:
             return Response({"error": "Invalid email format"}, status=400)
 
-        # Clean up old OTPs (older than 15 minutes)
-        EmailOTP.objects.filter(
-            created_at__lt=timezone.now() - timedelta(minutes=15)
-        ).delete()
-
-        # حذف OTP های استفاده نشده قبلی برای همین ایمیل
-        EmailOTP.objects.filter(email=email, is_used=False).delete()
-
-        # ایجاد OTP جدید
-        otp_code = str(random.randint(100000, 999999))
-        otp = EmailOTP.objects.create(
-            email=email,
-            code=otp_code
-        )
+        # ایجاد OTP جدید (کد قبلی همین ایمیل باطل می‌شود)
+        otp_code = otp_store.get_otp_backend().issue(email)
+        valid_minutes = settings.OTP_TTL // 60
 
         logger.info(f"OTP generated for email: {email}")
         
@@ -72,26 +58,26 @@ def send_otp(request):
         print(f"🔐 OTP CODE FOR LOGIN")
         print(f"{'='*60}")
         print(f"📧 Email: {email}")
-        print(f"🔑 Code: {otp.code}")
-        print(f"⏰ Valid for: 15 minutes")
+        print(f"🔑 Code: {otp_code}")
+        print(f"⏰ Valid for: {valid_minutes} minutes")
         print(f"{'='*60}\n")
-        logger.info(f"OTP Code: {otp.code} for email: {email}")
+        logger.info(f"OTP Code: {otp_code} for email: {email}")
 
-        # ارسال ایمیل (در development اگر fail شود، خطا نمی‌دهد)
+        # ارسال ایمیل از طریق صف (پردازه send_queued_mail آن را ارسال می‌کند)
         email_sent = False
         if settings.EMAIL_BACKEND != 'django.core.mail.backends.console.EmailBackend':
             try:
-                send_mail(
+                queue_mail(
                     subject="Your Login Code",
-                    message=f"Your login code is: {otp.code}\n\nThis code is valid for 15 minutes.",
+                    message=f"Your login code is: {otp_code}\n\nThis code is valid for {valid_minutes} minutes.",
                     from_email=settings.DEFAULT_FROM_EMAIL,
                     recipient_list=[email],
-                    fail_silently=True  # در development fail silently
+                    ttl=settings.OTP_TTL,
                 )
                 email_sent = True
-                logger.info(f"OTP email sent successfully to: {email}")
+                logger.info(f"OTP email queued for: {email}")
             except Exception as e:
-                logger.warning(f"Failed to send OTP email to {email}: {str(e)} (Code is still available in terminal)")
+                logger.warning(f"Failed to queue OTP email to {email}: {str(e)} (Code is still available in terminal)")
         else:
             # اگر console backend است، در console نمایش می‌دهد
             email_sent = True
@@ -133,36 +119,20 @@ def verify_otp(request):
         if not code.isdigit() or len(code) != 6:
             return Response({"error": "Code must be a 6-digit number"}, status=400)
 
-        # جستجوی OTP معتبر
-        otp = EmailOTP.objects.filter(
-            email=email, 
-            code=code, 
-            is_used=False,
-            created_at__gte=timezone.now() - timedelta(minutes=15)
-        ).first()
-
-        if not otp:
-            logger.warning(f"Invalid OTP attempt for email: {email}, code: {code}")
-            # بررسی اینکه آیا OTP منقضی شده یا استفاده شده
-            expired_otp = EmailOTP.objects.filter(
-                email=email,
-                code=code,
-                created_at__lt=timezone.now() - timedelta(minutes=15)
-            ).exists()
-            
-            if expired_otp:
+        # بررسی و مصرف کد (یک‌بارمصرف)
+        result = otp_store.get_otp_backend().verify(email, code)
+
+        if result != otp_store.VALID:
+            logger.warning(f"Invalid OTP attempt for email: {email} ({result})")
+            if result == otp_store.EXPIRED:
                 return Response({"error": "Code has expired. Please request a new code."}, status=400)
-            else:
-                return Response({"error": "Invalid code. Please check and try again."}, status=400)
+            if result == otp_store.LOCKED:
+                return Response({"error": "Too many attempts. Please request a new code."}, status=429)
+            return Response({"error": "Invalid code. Please check and try again."}, status=400)
 
-        # استفاده از transaction برای اطمینان از atomicity
-        with transaction.atomic():
-            otp.is_used = True
-            otp.save()
+        # ایجاد یا دریافت کاربر
+        user, created = User.objects.get_or_create(email=email)
 
-            # ایجاد یا دریافت کاربر
-            user, created = User.objects.get_or_create(email=email)
-            
         if created:
             logger.info(f"New user created via OTP: {email}")
         else:
@@ -192,6 +162,7 @@ def verify_otp(request):
 
 
 from .models import StudentProfile, Notification
+from .pagination import KeysetPagination, wants_cursor_pagination
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -319,6 +290,15 @@ def upload_avatar(request):
 def list_notifications(request):
     from .serializers import NotificationSerializer
     
+    qs = Notification.objects.filter(user=request.user).select_related('user')
+
+    # Cursor mode برای infinite scroll: بدون OFFSET و با count اختیاری
+    if wants_cursor_pagination(request):
+        cursor_paginator = KeysetPagination()
+        notifications = cursor_paginator.paginate_queryset(qs, request)
+        serializer = NotificationSerializer(notifications, many=True)
+        return cursor_paginator.get_paginated_response(serializer.data)
+
     # Pagination
     page = int(request.GET.get('page', 1))
     page_size = int(request.GET.get('page_size', 20))
@@ -326,7 +306,6 @@ def list_notifications(request):
     if page_size > 100:
         page_size = 100  # Max limit
     
-    qs = Notification.objects.filter(user=request.user).select_related('user')
     paginator = Paginator(qs, page_size)
     
     try:
@@ -360,6 +339,7 @@ def send_test_notification(request):
 # ----------------------
 from .models import PlannerRequest
 from .serializers import PlannerRequestSerializer
+from . import planner
 from rest_framework import status
 
 
@@ -416,13 +396,16 @@ def submit_planner_request(request, request_id):
                 'error': 'Request is already submitted or processed'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # به‌روزرسانی وضعیت به pending برای پردازش
-        planner_request.status = 'pending'
+        # اگر برنامه‌ای با همین ورودی‌ها قبلا ساخته شده، همان را برمی‌گردانیم؛
+        # وگرنه pending می‌شود تا worker ها (run_planner_workers) آن را بسازند
+        cached = planner.cached_plan(planner_request)
+        if cached is not None:
+            planner_request.status = 'completed'
+            planner_request.generated_plan = cached
+        else:
+            planner_request.status = 'pending'
         planner_request.save()
         
-        # در اینجا می‌توانید event به Inngest یا queue بفرستید
-        # برای پردازش با LLM
-        
         serializer = PlannerRequestSerializer(planner_request)
         return Response({
             'message': 'Planner request submitted successfully',
@@ -441,6 +424,61 @@ def submit_planner_request(request, request_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def revise_planner_request(request, request_id):
+    """ویرایش یک برنامه تکمیل‌شده: فقط روزها و درس‌هایی که تغییر کرده‌اند دوباره ساخته می‌شوند"""
+    try:
+        original = PlannerRequest.objects.get(
+            id=request_id,
+            user=request.user
+        )
+        
+        if original.status != 'completed' or not original.generated_plan:
+            return Response({
+                'error': 'Only completed requests can be revised'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # فیلدهای ارسال‌شده جایگزین form_data قبلی می‌شوند
+        changes = request.data.get('form_data', {}) if isinstance(request.data, dict) else None
+        if not isinstance(changes, dict):
+            return Response({
+                'error': 'form_data must be an object'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        form_data = {**original.form_data, **changes}
+        
+        # نسخه جدید به نسخه قبلی لینک می‌شود و مستقیم برای پردازش ارسال می‌شود
+        revision = PlannerRequest.objects.create(
+            user=request.user,
+            parent=original,
+            exam_provider=form_data.get('examProvider') or original.exam_provider,
+            exam_date=form_data.get('examDate') or original.exam_date,
+            daily_hours=form_data.get('dailyHours', original.daily_hours),
+            form_data=form_data,
+            exam_code=original.exam_code,
+            target_rank=request.data.get('target_rank', original.target_rank),
+            period_days=request.data.get('period_days', original.period_days),
+            status='pending',
+        )
+        
+        serializer = PlannerRequestSerializer(revision)
+        return Response({
+            'message': 'Planner revision submitted successfully',
+            'data': serializer.data
+        }, status=status.HTTP_201_CREATED)
+        
+    except PlannerRequest.DoesNotExist:
+        return Response({
+            'error': 'Planner request not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        logger.error(f"Error revising planner request: {str(e)}")
+        return Response({
+            'error': 'Failed to revise planner request',
+            'message': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_planner_request(request, request_id):
@@ -502,28 +540,8 @@ def get_planner_for_llm(request, request_id):
         # دریافت پروفایل کاربر
         profile, _ = StudentProfile.objects.get_or_create(user=request.user)
         
-        # ساخت exam_code از provider و date
-        exam_code = f"{planner_request.exam_provider}_{planner_request.exam_date}"
-        
-        # ساخت داده‌های کامل برای LLM
-        llm_data = {
-            'request_id': planner_request.id,
-            'user_id': request.user.id,
-            'user_profile': {
-                'name': profile.name,
-                'grade': profile.grade,
-                'field': profile.field,
-                'daily_hours': profile.daily_hours or planner_request.daily_hours,
-            },
-            'exam': {
-                'provider': planner_request.exam_provider,
-                'date': planner_request.exam_date,
-                'code': planner_request.exam_code or exam_code,
-            },
-            'constraints': planner_request.form_data,
-            'target_rank': planner_request.target_rank,
-            'period_days': planner_request.period_days,
-        }
+        # ساخت داده‌های کامل برای LLM (همان داده‌ای که worker ها می‌فرستند)
+        llm_data = planner.llm_payload(planner_request, profile)
         
         return Response(llm_data)
         
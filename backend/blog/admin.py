@@ -0,0 +1,19 @@
+from django.contrib import admin
+from .models import Post
+from .visitors import visitor_stats
+
+
+# ----------------------
+# Post Admin
+# ----------------------
+@admin.register(Post)
+class PostAdmin(admin.ModelAdmin):
+    list_display = ('title', 'author', 'status', 'published_at', 'view_count', 'unique_visitors')
+    list_filter = ('status', 'category', 'published_at')
+    search_fields = ('title', 'excerpt')
+    ordering = ('-published_at',)
+    readonly_fields = ('view_count', 'unique_visitors', 'unique_visitors_last_30_days')
+
+    @admin.display(description='بازدیدکنندگان یکتا (۳۰ روز اخیر، تخمینی)')
+    def unique_visitors_last_30_days(self, obj):
+        return visitor_stats(obj, 30)['period_unique_visitors'] if obj.pk else 0
@@ -0,0 +1,87 @@
+"""
+Versioned response cache for the public blog API.
+
+Every cached response is keyed on the request path, its query parameters and
+the current version of each scope it depends on ("post", "tag",
+"post:<slug>", ...). Signal handlers bump the versions of the scopes a change
+touches, so stale entries simply stop being addressed and expire on their
+own; nothing is ever flushed wholesale.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+VERSION_PREFIX = 'blog:version:'
+RESPONSE_PREFIX = 'blog:response:'
+
+# Anything rendered through PostListSerializer depends on all of these.
+LISTING_SCOPES = ('post', 'author', 'category', 'tag', 'comment')
+
+
+def _initial_version():
+    # Seeding from the clock means a version evicted from the cache comes back
+    # as a value no earlier response was stored under.
+    return time.time_ns()
+
+
+def _version_key(scope):
+    # Object scopes carry unicode slugs; hash them into a backend-safe key.
+    return VERSION_PREFIX + hashlib.md5(scope.encode()).hexdigest()
+
+
+def get_versions(scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), timeout=None)
+
+
+def response_cache_key(request, scopes):
+    query = sorted(request.query_params.lists())
+    versions = get_versions(scopes)
+    raw = f"{request.path}?{query}|{list(zip(scopes, versions))}"
+    return RESPONSE_PREFIX + hashlib.md5(raw.encode()).hexdigest()
+
+
+def cached_response(request, scopes, build):
+    """Return the cached response for `request`, or call `build()` and cache it."""
+    key = response_cache_key(request, scopes)
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+
+    response = build()
+    if response.status_code == 200:
+        cache.set(key, response.data, settings.BLOG_CACHE_TIMEOUT)
+    return response
+
+
+def cache_response(*scopes):
+    """
+    Cache a viewset method's response.
+
+    Scopes may reference URL kwargs, e.g. ``cache_response('post:{slug}')``.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            resolved = [scope.format(**kwargs) for scope in scopes]
+            return cached_response(request, resolved, lambda: method(self, request, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,40 @@
+from collections import defaultdict
+
+from .models import Category
+
+TREE_FIELDS = ('id', 'name', 'slug', 'grade', 'field', 'parent_id', 'published_post_count')
+
+
+def build_category_tree():
+    """
+    The whole category hierarchy from one query, as nested dicts.
+
+    `post_count` is the category's own published posts and
+    `total_post_count` adds every descendant's, summed bottom-up in memory.
+    """
+    nodes = {}
+    children = defaultdict(list)
+    for row in Category.objects.order_by('name').values(*TREE_FIELDS):
+        parent_id = row.pop('parent_id')
+        node = {**row, 'post_count': row.pop('published_post_count'), 'children': []}
+        nodes[node['id']] = node
+        children[parent_id].append(node)
+
+    # A parent that no longer exists makes its children roots; categories
+    # caught in a parent cycle are never reached from a root and are left out.
+    roots = [node for parent_id, group in children.items()
+             if parent_id is None or parent_id not in nodes for node in group]
+    roots.sort(key=lambda node: node['name'])
+
+    order, stack = [], list(roots)
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        node['children'] = children.get(node['id'], [])
+        stack.extend(node['children'])
+
+    for node in reversed(order):
+        node['total_post_count'] = node['post_count'] + sum(
+            child['total_post_count'] for child in node['children']
+        )
+    return roots
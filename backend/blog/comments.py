@@ -0,0 +1,24 @@
+from collections import defaultdict
+
+from .models import Comment
+
+
+class CommentTree:
+    """
+    All approved comments of a post, fetched in one query and linked in memory.
+
+    Serializers walk the tree instead of asking every comment for its
+    replies, so a deep thread costs the same single query as a flat one.
+    """
+
+    def __init__(self, post):
+        self.children = defaultdict(list)
+        comments = Comment.objects.filter(post=post, is_approved=True).select_related('user')
+        for comment in comments:
+            self.children[comment.parent_id].append(comment)
+
+    def roots(self):
+        return self.children.get(None, [])
+
+    def replies(self, comment_id):
+        return self.children.get(comment_id, [])
@@ -0,0 +1,137 @@
+"""
+Post content compilation.
+
+`Post.content` is Markdown or HTML (the editor produces both). On save it is
+compiled once into sanitized HTML with stable ids on its h2-h4 headings, the
+matching table of contents, and a word count for the reading time, so
+clients render the stored result instead of doing this themselves. A hash of
+the source (and of COMPILER_VERSION, bumped whenever the output changes) is
+kept next to the result, so unchanged content is never recompiled.
+"""
+import hashlib
+import html
+import math
+import re
+
+import markdown
+import nh3
+
+from .search import ZWNJ
+
+COMPILER_VERSION = '2'
+WORDS_PER_MINUTE = 200
+EXCERPT_LENGTH = 300
+
+ALLOWED_ATTRIBUTES = {
+    **{tag: set(attributes) for tag, attributes in nh3.ALLOWED_ATTRIBUTES.items()},
+    '*': {'dir', 'lang'},
+}
+MARKDOWN_EXTENSIONS = ['extra', 'sane_lists']
+
+# Zero-width space and BOM sneak in from pasted text. ZWNJ stays: it is part
+# of Persian spelling.
+INVISIBLE_RE = re.compile('[\u200b\ufeff]')
+HEADING_RE = re.compile(r'<h([2-4])(\s[^>]*)?>(.*?)</h\1>', re.DOTALL)
+BLOCK_TAG_RE = re.compile(
+    r'</?(?:p|div|h[1-6]|ul|ol|li|dl|dt|dd|blockquote|pre|table|tr|td|th|figure|figcaption|br|hr|img)\b[^>]*>',
+    re.IGNORECASE,
+)
+TAG_RE = re.compile(r'<[^>]+>')
+# A Persian word may be written in parts joined by ZWNJ ("می‌شود").
+WORD_RE = re.compile(rf'\w+(?:{ZWNJ}\w+)*')
+ANCHOR_DROP_RE = re.compile(rf'[^\w{ZWNJ}-]')
+
+
+def content_hash(content):
+    return hashlib.sha256(f'{COMPILER_VERSION}\n{content}'.encode()).hexdigest()
+
+
+def plain_text(content_html):
+    text = TAG_RE.sub('', BLOCK_TAG_RE.sub(' ', content_html))
+    return ' '.join(html.unescape(text).split())
+
+
+def anchor(text, taken):
+    """Heading id in the style the frontend used; unique within the post."""
+    base = ANCHOR_DROP_RE.sub('', re.sub(r'\s+', '-', text.strip().lower()))
+    base = re.sub(r'-+', '-', base).strip('-') or 'heading'
+    slug, counter = base, 1
+    while slug in taken:
+        slug = f'{base}-{counter}'
+        counter += 1
+    taken.add(slug)
+    return slug
+
+
+def compile_content(content):
+    """Return the derived fields for `content`: html, toc, word_count, reading_time, text."""
+    source = INVISIBLE_RE.sub('', content or '')
+    # HTML from the editor starts with a tag; anything else is Markdown,
+    # which may carry inline HTML of its own.
+    if not source.lstrip().startswith('<'):
+        source = markdown.markdown(source, extensions=MARKDOWN_EXTENSIONS)
+    # nh3 drops any id the source carried; headings get fresh ones below.
+    cleaned = nh3.clean(source, attributes=ALLOWED_ATTRIBUTES)
+
+    toc, taken = [], set()
+
+    def add_anchor(match):
+        level, attributes, inner = match.group(1), match.group(2) or '', match.group(3)
+        text = plain_text(inner)
+        if not text:
+            return match.group(0)
+        slug = anchor(text, taken)
+        toc.append({'id': slug, 'text': text, 'level': int(level)})
+        # Editor headings keep their dir/lang; nh3 has already dropped any id.
+        return f'<h{level}{attributes} id="{slug}">{inner}</h{level}>'
+
+    compiled = HEADING_RE.sub(add_anchor, cleaned)
+    text = plain_text(compiled)
+    word_count = len(WORD_RE.findall(text))
+    return {
+        'html': compiled,
+        'toc': toc,
+        'word_count': word_count,
+        'reading_time': max(1, math.ceil(word_count / WORDS_PER_MINUTE)),
+        'text': text,
+    }
+
+
+def excerpt_from(text, length=EXCERPT_LENGTH):
+    """The opening of `text`, cut at a word boundary."""
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1].rsplit(' ', 1)[0]
+    return f'{cut}…'
+
+
+COMPILED_FIELDS = ['content_html', 'toc', 'word_count', 'reading_time', 'content_hash', 'excerpt']
+
+
+def compile_posts(posts, batch_size=500, force=False):
+    """
+    Compile the content of `posts` (a queryset) whose hash is out of date;
+    returns the number of posts written.
+    """
+    batch, written = [], 0
+    for post in posts.only('pk', 'content', 'excerpt', 'content_hash').iterator(chunk_size=batch_size):
+        digest = content_hash(post.content)
+        if digest == post.content_hash and not force:
+            continue
+        compiled = compile_content(post.content)
+        post.content_html = compiled['html']
+        post.toc = compiled['toc']
+        post.word_count = compiled['word_count']
+        post.reading_time = compiled['reading_time']
+        post.content_hash = digest
+        if not post.excerpt.strip():
+            post.excerpt = excerpt_from(compiled['text'])
+        batch.append(post)
+        if len(batch) >= batch_size:
+            posts.model.objects.bulk_update(batch, COMPILED_FIELDS)
+            written += len(batch)
+            batch = []
+    if batch:
+        posts.model.objects.bulk_update(batch, COMPILED_FIELDS)
+        written += len(batch)
+    return written
@@ -0,0 +1,141 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+logger = logging.getLogger('api')
+
+
+class ViewCountBuffer:
+    """
+    Write-behind buffer for Post.view_count.
+
+    Views are counted in process memory and applied as batched
+    `F('view_count') + n` updates, so a hot article no longer turns every
+    page view into a row lock. Visitor sketch updates (see blog.visitors)
+    ride along and are written by the same flush.
+
+    Flushing is done by a daemon thread of the process, started with the
+    first view: every `flush_interval` seconds, sooner when too many posts
+    are pending, and once more when the worker exits. Readers never wait on
+    a flush, and a worker killed outright loses at most one interval of
+    views. With `background=False` nothing flushes until flush() is called.
+    """
+
+    def __init__(self, flush_interval, max_pending, background=True):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.background = background
+        self._pending = Counter()
+        self._visitors = defaultdict(dict)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def record(self, post_id, visitor=None):
+        """Count a view; `visitor` is the (register, rank) pair from blog.visitors.visitor_update."""
+        with self._lock:
+            self._pending[post_id] += 1
+            if visitor is not None:
+                ranks = self._visitors[post_id]
+                index, rank = visitor
+                if rank > ranks.get(index, 0):
+                    ranks[index] = rank
+            full = len(self._pending) >= self.max_pending
+        if self.background:
+            self._start()
+            if full:
+                self._wake.set()
+
+    def _start(self):
+        # A thread doesn't survive fork(): a forked worker starts its own.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='view-count-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing buffered post views failed")
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            visitors, self._visitors = self._visitors, defaultdict(dict)
+        if not pending:
+            return 0
+
+        # Posts that gained the same number of views share one UPDATE.
+        by_delta = defaultdict(list)
+        for post_id, delta in pending.items():
+            by_delta[delta].append(post_id)
+
+        from .models import Post, PostViewBucket
+        from .visitors import store_visitor_updates
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        try:
+            with transaction.atomic():
+                for delta, post_ids in by_delta.items():
+                    Post.objects.filter(pk__in=post_ids).update(view_count=F('view_count') + delta)
+                # The same deltas feed the hourly buckets behind trending posts.
+                existing = Post.objects.filter(pk__in=list(pending)).values_list('pk', flat=True)
+                PostViewBucket.objects.bulk_create(
+                    [PostViewBucket(post_id=post_id, hour=hour) for post_id in existing],
+                    ignore_conflicts=True,
+                )
+                for delta, post_ids in by_delta.items():
+                    PostViewBucket.objects.filter(post_id__in=post_ids, hour=hour).update(views=F('views') + delta)
+                if visitors:
+                    store_visitor_updates(visitors)
+        except DatabaseError:
+            logger.exception("Failed to flush %d buffered post views", sum(pending.values()))
+            with self._lock:
+                self._pending.update(pending)
+                for post_id, ranks in visitors.items():
+                    merged = self._visitors[post_id]
+                    for index, rank in ranks.items():
+                        merged[index] = max(rank, merged.get(index, 0))
+            return 0
+        return sum(pending.values())
+
+
+def adjust_count(queryset, field, delta):
+    """Add `delta` to a denormalized counter in one UPDATE, never going below zero."""
+    if delta:
+        queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def adjust_counts(model, field, deltas):
+    """Apply {pk: delta}; rows sharing a delta share one UPDATE."""
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        adjust_count(model.objects.filter(pk__in=pks), field, delta)
+
+
+view_count_buffer = ViewCountBuffer(
+    flush_interval=settings.BLOG_VIEW_COUNT_FLUSH_INTERVAL,
+    max_pending=settings.BLOG_VIEW_COUNT_MAX_PENDING,
+)
+atexit.register(view_count_buffer.flush)
@@ -0,0 +1,146 @@
+"""
+Personalized post feed.
+
+Readers fall into a segment by grade and field (one per pair of
+Category.GRADE_CHOICES x Category.FIELD_CHOICES, plus one for readers
+without a profile). For each segment the published posts it should see are
+split into tiers (exact grade and field, a partial match with the other
+side left general, and general posts), each kept newest first. Every tier
+is one bounded query filtered on the category's grade and field, and each
+segment is cached under its own "feed:<segment>" version. Signal handlers
+bump only the segments a post or category change can reach (see
+`segments_reaching`), so publishing a tenth-grade post leaves the other
+grades' candidates in place.
+
+A request only merges its segment's tiers lazily by recency, with closer
+tiers shifted forward in time so a matching post outranks a slightly newer
+general one; reading a page costs about the same as the plain list.
+"""
+import heapq
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .cache import bump_versions, get_versions
+from .models import Category, Post
+
+FEED_CACHE_KEY = 'blog:feed:'
+TIER_BOOST = {
+    'exact': timedelta(days=14),
+    'partial': timedelta(days=5),
+    'general': timedelta(0),
+}
+# Exam-prep (konkur) material is aimed at final-year students.
+GRADE_ALIASES = {'12': {'12', 'konkur'}, 'konkur': {'konkur', '12'}}
+
+GRADES = [code for code, _ in Category.GRADE_CHOICES]
+FIELDS = [code for code, _ in Category.FIELD_CHOICES]
+FIELD_CODES = {**{code: code for code in FIELDS}, **{label: code for code, label in Category.FIELD_CHOICES}}
+GRADE_CODES = {**{code: code for code in GRADES}, **{label: code for code, label in Category.GRADE_CHOICES}}
+SEGMENTS = [None] + [(grade, field) for grade in GRADES for field in FIELDS]
+
+NO_GRADE = Q(category__grade='') | Q(category__grade__isnull=True)
+NO_FIELD = Q(category__field='') | Q(category__field__isnull=True)
+
+
+def segment_for(grade, field):
+    """Map profile values (codes or Persian labels) to a segment; None when incomplete."""
+    grade = GRADE_CODES.get((grade or '').strip())
+    field = FIELD_CODES.get((field or '').strip())
+    if grade is None or field is None:
+        return None
+    return grade, field
+
+
+def _tier(segment, grade, field):
+    if segment is None:
+        return 'general'
+    grades = GRADE_ALIASES.get(segment[0], {segment[0]})
+    grade_match, field_match = grade in grades, field == segment[1]
+    if (grade and not grade_match) or (field and not field_match):
+        return None
+    if grade_match and field_match:
+        return 'exact'
+    if grade_match or field_match:
+        return 'partial'
+    return 'general'
+
+
+def _tier_filters(segment):
+    """The category filter of each tier of `segment`; mirrors `_tier`."""
+    if segment is None:
+        return {'exact': None, 'partial': None, 'general': Q()}
+    grade = Q(category__grade__in=GRADE_ALIASES.get(segment[0], {segment[0]}))
+    field = Q(category__field=segment[1])
+    return {
+        'exact': grade & field,
+        'partial': (grade & NO_FIELD) | (NO_GRADE & field),
+        'general': NO_GRADE & NO_FIELD,
+    }
+
+
+def build_segment(segment):
+    """{tier: [(timestamp, post_id), ...]} for one segment, newest first."""
+    limit = settings.BLOG_FEED_CANDIDATES
+    published = Post.objects.published().order_by('-published_at', '-pk')
+    tiers = {}
+    for tier, condition in _tier_filters(segment).items():
+        rows = [] if condition is None else published.filter(condition).values_list('published_at', 'pk')[:limit]
+        tiers[tier] = [(published_at.timestamp(), pk) for published_at, pk in rows]
+    return tiers
+
+
+def segment_name(segment):
+    return 'all' if segment is None else '-'.join(segment)
+
+
+def segments_reaching(*categories):
+    """Segments whose candidates can include posts filed under the given (grade, field) pairs."""
+    return {
+        segment for segment in SEGMENTS for grade, field in categories
+        if _tier(segment, grade or '', field or '') is not None
+    }
+
+
+def invalidate_segments(*categories):
+    bump_versions(*(f'feed:{segment_name(segment)}' for segment in segments_reaching(*categories)))
+
+
+def segment_candidates(segment):
+    name = segment_name(segment)
+    [version] = get_versions([f'feed:{name}'])
+    key = f'{FEED_CACHE_KEY}{name}:{version}'
+    candidates = cache.get(key)
+    if candidates is None:
+        candidates = build_segment(segment)
+        cache.set(key, candidates, settings.BLOG_CACHE_TIMEOUT)
+    return candidates
+
+
+def _boosted(posts, boost):
+    return ((timestamp + boost, pk) for timestamp, pk in posts)
+
+
+class Feed:
+    """Lazily merged post ids of one segment; sliceable for the paginator."""
+
+    def __init__(self, candidates):
+        self.candidates = candidates
+
+    def __len__(self):
+        return sum(len(posts) for posts in self.candidates.values())
+
+    def count(self):
+        return len(self)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or (index.step or 1) != 1:
+            raise TypeError('Feed supports contiguous slices only')
+        merged = heapq.merge(
+            *(_boosted(posts, TIER_BOOST[tier].total_seconds()) for tier, posts in self.candidates.items()),
+            reverse=True,
+        )
+        return [pk for _, pk in islice(merged, index.start or 0, index.stop)]
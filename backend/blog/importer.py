@@ -0,0 +1,273 @@
+"""
+Bulk post import.
+
+Records are streamed from JSON Lines, a JSON array or CSV and written in
+chunks: slugs for a whole chunk are allocated with one prefix query, derived
+fields are filled in memory, and posts, tag links, search terms, structured
+data and post counts go in with bulk writes. Each chunk is its own
+transaction, so an interrupted import can resume after the last committed
+chunk.
+"""
+import csv
+import json
+import time
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+
+from .cache import bump_versions
+from .counters import adjust_counts
+from .models import Author, Category, Post, SearchTerm, Tag
+from .search import post_terms
+from .structured_data import render_structured_data
+
+SLUG_MAX_LENGTH = Post._meta.get_field('slug').max_length
+# Room left for the "-<n>" suffix of a colliding slug.
+SLUG_BASE_LENGTH = SLUG_MAX_LENGTH - 8
+TAG_SLUG_BASE_LENGTH = Tag._meta.get_field('slug').max_length - 8
+
+TEXT_FIELDS = (
+    'subtitle', 'featured_image_alt', 'meta_title', 'meta_description', 'meta_keywords',
+    'og_title', 'og_description', 'schema_type',
+)
+
+
+class PostImportError(Exception):
+    pass
+
+
+def read_records(path, fmt=None):
+    """Yield record dicts from a .jsonl, .json or .csv file."""
+    fmt = fmt or path.rsplit('.', 1)[-1].lower()
+    if fmt == 'jsonl':
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+    elif fmt == 'json':
+        with open(path, encoding='utf-8') as handle:
+            records = json.load(handle)
+        if not isinstance(records, list):
+            raise PostImportError('JSON input must be an array of posts')
+        yield from records
+    elif fmt == 'csv':
+        with open(path, encoding='utf-8-sig', newline='') as handle:
+            yield from csv.DictReader(handle)
+    else:
+        raise PostImportError(f'Unsupported input format: {fmt}')
+
+
+def allocate_slugs(bases, model=Post):
+    """
+    Map each requested base slug to a free `model` slug, in order, with a
+    single query.
+
+    Follows Post.save: the first post keeps the base, later ones get "-1",
+    "-2", ... Duplicates within `bases` get distinct slugs too.
+    """
+    unique_bases = set(bases)
+    if not unique_bases:
+        return []
+    taken = set(
+        model.objects.filter(
+            reduce(or_, (Q(slug=base) | Q(slug__startswith=f'{base}-') for base in unique_bases))
+        ).values_list('slug', flat=True)
+    )
+
+    slugs, counters = [], {}
+    for base in bases:
+        slug, counter = base, counters.get(base, 1)
+        while slug in taken:
+            slug = f'{base}-{counter}'
+            counter += 1
+        counters[base] = counter
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def _split_tags(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return list(dict.fromkeys(name.strip() for name in value if name and name.strip()))
+
+
+def _json_field(value, default):
+    if value in (None, ''):
+        return default
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class PostImporter:
+    """
+    Import posts in chunks.
+
+    Each record needs `title`, `content` and `author` (the author's login
+    email or id); a missing `excerpt` is taken from the content. `category`
+    is a category slug and `tags` a list or comma-separated names, created
+    when missing. Records that cannot be imported are skipped and reported
+    in `errors`.
+    """
+
+    def __init__(self, chunk_size=500, on_chunk=None):
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+        self.imported = 0
+        self.processed = 0
+        self.errors = []
+        self.started = None
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started if self.started else 0
+        return self.imported / elapsed if elapsed else 0.0
+
+    def run(self, records, skip=0):
+        """Import `records`, skipping the first `skip` (already committed) ones."""
+        self.started = time.monotonic()
+        self.processed = skip
+        chunk = []
+        for index, record in enumerate(records):
+            if index < skip:
+                continue
+            chunk.append((index, record))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+        return self
+
+    # -- one chunk ---------------------------------------------------------
+
+    def _import_chunk(self, chunk):
+        with transaction.atomic():
+            authors = self._authors(record.get('author') for _, record in chunk)
+            categories = Category.objects.in_bulk(
+                {record['category'] for _, record in chunk if record.get('category')}, field_name='slug'
+            )
+
+            posts, post_tags = [], []
+            for index, record in chunk:
+                try:
+                    post = self._build_post(record, authors, categories)
+                except (PostImportError, ValueError, TypeError) as exc:
+                    self.errors.append((index, str(exc)))
+                    continue
+                posts.append(post)
+                post_tags.append(_split_tags(record.get('tags')))
+
+            bases = [post.slug or (slugify(post.title, allow_unicode=True)[:SLUG_BASE_LENGTH] or 'post')
+                     for post in posts]
+            for post, slug in zip(posts, allocate_slugs(bases)):
+                post.slug = slug
+                post.fill_derived_fields()
+
+            Post.objects.bulk_create(posts)
+            tags = self._tags(name for names in post_tags for name in names)
+            Post.tags.through.objects.bulk_create(
+                Post.tags.through(post_id=post.pk, tag_id=tags[name].pk)
+                for post, names in zip(posts, post_tags) for name in names
+            )
+
+            # bulk_create skips the post_save handlers, so do their work here.
+            terms = []
+            for post, names in zip(posts, post_tags):
+                terms.extend(
+                    SearchTerm(post=post, term=term, weight=weight)
+                    for term, weight in post_terms(post, names).items()
+                )
+                post.structured_data = render_structured_data(post)
+            SearchTerm.objects.bulk_create(terms, batch_size=2000)
+            Post.objects.bulk_update(posts, ['structured_data'])
+            self._count_published(posts, post_tags, tags)
+
+            transaction.on_commit(lambda: bump_versions('post', 'tag'))
+
+        self.imported += len(posts)
+        self.processed = chunk[-1][0] + 1
+        if self.on_chunk:
+            self.on_chunk(self)
+
+    def _count_published(self, posts, post_tags, tags):
+        authors, categories, tag_counts = Counter(), Counter(), Counter()
+        for post, names in zip(posts, post_tags):
+            if post.status != 'published':
+                continue
+            authors[post.author_id] += 1
+            if post.category_id:
+                categories[post.category_id] += 1
+            tag_counts.update(tags[name].pk for name in names)
+        adjust_counts(Author, 'published_post_count', authors)
+        adjust_counts(Category, 'published_post_count', categories)
+        adjust_counts(Tag, 'published_post_count', tag_counts)
+
+    def _authors(self, references):
+        references = {str(ref) for ref in references if ref not in (None, '')}
+        ids = {int(ref) for ref in references if ref.isdigit()}
+        users = get_user_model().USERNAME_FIELD
+        found = {}
+        for author in Author.objects.select_related('user').filter(
+                Q(pk__in=ids) | Q(**{f'user__{users}__in': references})):
+            found[str(author.pk)] = author
+            found[getattr(author.user, users)] = author
+        return found
+
+    def _tags(self, names):
+        names = set(names)
+        tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+        missing = sorted(names - set(tags))
+        bases = [slugify(name, allow_unicode=True)[:TAG_SLUG_BASE_LENGTH] or 'tag' for name in missing]
+        missing = [Tag(name=name, slug=slug) for name, slug in zip(missing, allocate_slugs(bases, Tag))]
+        tags.update({tag.name: tag for tag in Tag.objects.bulk_create(missing)})
+        return tags
+
+    def _build_post(self, record, authors, categories):
+        for field in ('title', 'content'):
+            if not record.get(field):
+                raise PostImportError(f'missing {field}')
+
+        author = authors.get(str(record.get('author', '')))
+        if author is None:
+            raise PostImportError(f"unknown author {record.get('author')!r}")
+        category = None
+        if record.get('category'):
+            category = categories.get(record['category'])
+            if category is None:
+                raise PostImportError(f"unknown category {record['category']!r}")
+
+        status = record.get('status') or 'draft'
+        if status not in dict(Post.STATUS_CHOICES):
+            raise PostImportError(f'invalid status {status!r}')
+        published_at = None
+        if record.get('published_at'):
+            published_at = parse_datetime(record['published_at'])
+            if published_at is None:
+                raise PostImportError(f"invalid published_at {record['published_at']!r}")
+
+        post = Post(
+            title=record['title'][:200],
+            slug=(record.get('slug') or '')[:SLUG_BASE_LENGTH],
+            excerpt=record.get('excerpt') or '',
+            content=record['content'],
+            author=author,
+            category=category,
+            status=status,
+            published_at=published_at,
+            key_points=_json_field(record.get('key_points'), []),
+            faq=_json_field(record.get('faq'), []),
+        )
+        for field in TEXT_FIELDS:
+            if record.get(field):
+                setattr(post, field, record[field])
+        if record.get('enable_comments') not in (None, ''):
+            post.enable_comments = str(record['enable_comments']).lower() not in ('0', 'false', 'no')
+        return post
@@ -0,0 +1 @@
+# This file is required for Django management commands
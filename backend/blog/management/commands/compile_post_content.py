@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from blog.cache import bump_versions
+from blog.content import compile_posts
+from blog.models import Post
+from blog.static_export import StaticExporter
+
+
+class Command(BaseCommand):
+    help = 'Compile post content (HTML, table of contents, reading time) where it is out of date'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Recompile every post, even when its content hash is current',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts written per batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        written = compile_posts(
+            Post.objects.order_by('pk'), batch_size=options['batch_size'], force=options['force']
+        )
+        # Bulk writes skip the post signals.
+        if written:
+            bump_versions('post')
+            if settings.BLOG_STATIC_EXPORT_ENABLED:
+                StaticExporter().export_all()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully compiled content of {written} posts')
+        )
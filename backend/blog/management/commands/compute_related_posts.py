@@ -0,0 +1,60 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from blog.related import RelatedPostsEngine, run_related
+
+
+class Command(BaseCommand):
+    help = 'Compute the top-k related posts for published posts (incremental by default, continuously with --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute every post instead of only stale ones',
+        )
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=settings.BLOG_RELATED_POSTS_COUNT,
+            help=f'Related posts stored per post (default: {settings.BLOG_RELATED_POSTS_COUNT})',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and recompute stale posts every --interval seconds',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=settings.BLOG_RELATED_INTERVAL,
+            help=f'Seconds between runs with --loop (default: {settings.BLOG_RELATED_INTERVAL})',
+        )
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            stop_event = threading.Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_: stop_event.set())
+
+            self.stdout.write(f"Recomputing stale related posts every {options['interval']}s")
+            run_related(options['interval'], options['top_k'], stop_event)
+            self.stdout.write(self.style.SUCCESS('Related posts updater stopped'))
+            return
+
+        started = time.monotonic()
+        engine = RelatedPostsEngine(top_k=options['top_k'])
+        updated = engine.run(full=options['full'])
+        if not engine.posts:
+            self.stdout.write(self.style.SUCCESS('No stale related posts to recompute'))
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully recomputed related posts for {updated} of {len(engine.posts)} '
+                f'published posts in {time.monotonic() - started:.1f}s'
+            )
+        )
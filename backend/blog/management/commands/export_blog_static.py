@@ -0,0 +1,76 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from blog.models import Post
+from blog.static_export import StaticExporter, export_everything, run_exporter
+
+
+class Command(BaseCommand):
+    help = 'Export published blog content as precompressed JSON/XML files for nginx'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--post',
+            help='Only re-export the pages affected by the post with this slug',
+        )
+        parser.add_argument(
+            '--root',
+            help='Output directory (default: BLOG_STATIC_EXPORT_ROOT)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running: export queued changes as they come and everything periodically',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=int,
+            default=settings.BLOG_STATIC_EXPORT_POLL_INTERVAL,
+            help=f'Seconds between queue reads (default: {settings.BLOG_STATIC_EXPORT_POLL_INTERVAL})',
+        )
+        parser.add_argument(
+            '--full-interval',
+            type=int,
+            default=settings.BLOG_STATIC_EXPORT_FULL_INTERVAL,
+            help=f'Seconds between full exports (default: {settings.BLOG_STATIC_EXPORT_FULL_INTERVAL})',
+        )
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            if options['root'] or options['post']:
+                raise CommandError('--loop exports everything to BLOG_STATIC_EXPORT_ROOT; drop --root and --post')
+            stop_event = threading.Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_: stop_event.set())
+
+            self.stdout.write(
+                f"Exporting queued blog changes every {options['poll_interval']}s "
+                f"and everything every {options['full_interval']}s"
+            )
+            run_exporter(options['poll_interval'], options['full_interval'], stop_event)
+            self.stdout.write(self.style.SUCCESS('Exporter stopped'))
+            return
+
+        started = time.monotonic()
+        exporter = StaticExporter(root=options['root'])
+
+        if options['post']:
+            post = Post.objects.filter(slug=options['post']).first()
+            if post is None:
+                raise CommandError(f"Post {options['post']!r} does not exist")
+            exporter.export_post(post.pk)
+            exporter.export_feeds()
+        elif options['root']:
+            exporter.export_all()
+        else:
+            export_everything(exporter)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully exported blog to {exporter.root} '
+                f'({exporter.changed} files changed in {time.monotonic() - started:.1f}s)'
+            )
+        )
@@ -0,0 +1,73 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from blog.importer import PostImporter, PostImportError, read_records
+from blog.static_export import queue_export
+
+
+class Command(BaseCommand):
+    help = 'Bulk import posts from a JSON Lines, JSON or CSV file, in resumable chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file (.jsonl, .json or .csv)')
+        parser.add_argument(
+            '--format',
+            choices=['jsonl', 'json', 'csv'],
+            help='Input format (default: taken from the file extension)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Posts written per transaction (default: 500)',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Skip the records committed by a previous run of the same file',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Progress file (default: <path>.progress)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        checkpoint = options['checkpoint'] or f'{path}.progress'
+
+        skip = 0
+        if options['resume'] and os.path.exists(checkpoint):
+            with open(checkpoint, encoding='utf-8') as handle:
+                skip = json.load(handle)['processed']
+            self.stdout.write(f'Resuming after {skip} records')
+
+        def on_chunk(importer):
+            with open(checkpoint, 'w', encoding='utf-8') as handle:
+                json.dump({'path': path, 'processed': importer.processed}, handle)
+            self.stdout.write(
+                f'{importer.processed} records processed, {importer.imported} posts imported '
+                f'({importer.rate:.0f} posts/s)'
+            )
+
+        importer = PostImporter(chunk_size=options['chunk_size'], on_chunk=on_chunk)
+        try:
+            importer.run(read_records(path, options['format']), skip=skip)
+        except (OSError, ValueError, PostImportError) as exc:
+            raise CommandError(f'Import stopped after {importer.processed} records: {exc}')
+
+        for index, error in importer.errors:
+            self.stderr.write(f'Record {index + 1} skipped: {error}')
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        # Bulk inserts skip the per-post export hook; the export process redoes everything.
+        if settings.BLOG_STATIC_EXPORT_ENABLED and importer.imported:
+            queue_export()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully imported {importer.imported} posts '
+                f'({len(importer.errors)} skipped) at {importer.rate:.0f} posts/s'
+            )
+        )
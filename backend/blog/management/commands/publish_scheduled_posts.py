@@ -0,0 +1,39 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from blog.scheduling import publish_due_posts, run_scheduler
+
+
+class Command(BaseCommand):
+    help = 'Publish scheduled posts that are due (once, or continuously with --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and publish each post as soon as it is due',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=int,
+            default=settings.BLOG_SCHEDULER_POLL_INTERVAL,
+            help=f'Longest sleep between queue reads in seconds (default: {settings.BLOG_SCHEDULER_POLL_INTERVAL})',
+        )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            published = publish_due_posts()
+            self.stdout.write(
+                self.style.SUCCESS(f'Successfully published {len(published)} scheduled posts')
+            )
+            return
+
+        stop_event = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop_event.set())
+
+        self.stdout.write(f"Publishing scheduled posts (polling at most every {options['poll_interval']}s)")
+        run_scheduler(options['poll_interval'], stop_event)
+        self.stdout.write(self.style.SUCCESS('Scheduler stopped'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from blog.models import Post
+from blog.search import index_post
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the blog full-text search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts loaded per batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.prefetch_related('tags').order_by('pk')
+        count = 0
+        for post in posts.iterator(chunk_size=options['batch_size']):
+            index_post(post, tag_names=[tag.name for tag in post.tags.all()])
+            count += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {count} posts')
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from blog.models import Post
+from blog.structured_data import refresh_structured_data
+
+
+class Command(BaseCommand):
+    help = 'Re-render the stored JSON-LD of every post (e.g. after changing SITE_URL or the publisher)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of posts written per batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        written = refresh_structured_data(Post.objects.order_by('pk'), batch_size=options['batch_size'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt structured data for {written} posts')
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from blog.cache import bump_versions
+from blog.models import Author, Category, Post, Tag
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized published post and approved comment counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows updated per statement, by primary key range (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        jobs = [
+            (Author, lambda qs: qs.recount_published_posts()),
+            (Category, lambda qs: qs.recount_published_posts()),
+            (Tag, lambda qs: qs.recount_published_posts()),
+            (Post, lambda qs: qs.recount_approved_comments()),
+        ]
+
+        for model, recount in jobs:
+            updated = 0
+            last_pk = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            for start in range(0, last_pk + 1, batch_size):
+                updated += recount(model.objects.filter(pk__gte=start, pk__lt=start + batch_size))
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {updated} rows recounted')
+
+        bump_versions('post', 'author', 'category', 'tag', 'comment')
+        self.stdout.write(self.style.SUCCESS('Successfully recounted blog counters'))
@@ -0,0 +1,46 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from blog.trending import TrendingUpdater, run_trending
+
+
+class Command(BaseCommand):
+    help = 'Update trending post scores from hourly view buckets (once, or continuously with --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute every window from the view buckets instead of advancing the stored scores',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and update the scores every --interval seconds',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=settings.BLOG_TRENDING_INTERVAL,
+            help=f'Seconds between updates with --loop (default: {settings.BLOG_TRENDING_INTERVAL})',
+        )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            rebuilt = TrendingUpdater().run(full=options['full'])
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Successfully updated trending scores (rebuilt: {', '.join(sorted(rebuilt)) or 'none'})"
+                )
+            )
+            return
+
+        stop_event = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop_event.set())
+
+        self.stdout.write(f"Updating trending scores every {options['interval']}s")
+        run_trending(options['interval'], stop_event)
+        self.stdout.write(self.style.SUCCESS('Trending updater stopped'))
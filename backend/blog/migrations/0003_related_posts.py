@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0002_searchterm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='related_stale',
+            field=models.BooleanField(db_index=True, default=True, editable=False),
+        ),
+        migrations.CreateModel(
+            name='RelatedPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='computed_related', to='blog.post')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post')),
+            ],
+            options={
+                'ordering': ['post', 'rank'],
+                'unique_together': {('post', 'rank')},
+            },
+        ),
+    ]
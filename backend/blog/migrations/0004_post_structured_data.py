@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_related_posts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='structured_data',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
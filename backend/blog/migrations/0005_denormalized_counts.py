@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:26
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counts(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Comment = apps.get_model('blog', 'Comment')
+    for model_name, relation in (('Author', 'author'), ('Category', 'category'), ('Tag', 'tags')):
+        published = (
+            Post.objects.filter(**{relation: OuterRef('pk')}, status='published')
+            .order_by().values(relation).annotate(total=Count('pk')).values('total')
+        )
+        apps.get_model('blog', model_name).objects.update(published_post_count=Coalesce(Subquery(published), 0))
+
+    approved = (
+        Comment.objects.filter(post=OuterRef('pk'), is_approved=True)
+        .order_by().values('post').annotate(total=Count('pk')).values('total')
+    )
+    Post.objects.update(approved_comment_count=Coalesce(Subquery(approved), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_post_structured_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='published_post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='published_post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='approved_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='published_post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
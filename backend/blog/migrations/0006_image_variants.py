@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_denormalized_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='profile_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='featured_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='og_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
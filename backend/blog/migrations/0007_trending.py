@@ -0,0 +1,62 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostViewBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('scored_views', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(choices=[('24h', '۲۴ ساعت'), ('7d', '۷ روز'), ('30d', '۳۰ روز')], max_length=3)),
+                ('score', models.FloatField(default=0)),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', '-view_count'], name='blog_post_status_5582d9_idx'),
+        ),
+        migrations.AddField(
+            model_name='postviewbucket',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_buckets', to='blog.post'),
+        ),
+        migrations.AddField(
+            model_name='trendingscore',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trending_scores', to='blog.post'),
+        ),
+        migrations.AddIndex(
+            model_name='postviewbucket',
+            index=models.Index(fields=['hour'], name='blog_postvi_hour_2cb678_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='postviewbucket',
+            unique_together={('post', 'hour')},
+        ),
+        migrations.AddIndex(
+            model_name='trendingscore',
+            index=models.Index(fields=['window', '-score'], name='blog_trendi_window_739182_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='trendingscore',
+            unique_together={('window', 'post')},
+        ),
+    ]
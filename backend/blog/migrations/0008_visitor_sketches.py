@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_trending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='unique_visitors',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='PostVisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(blank=True, null=True)),
+                ('registers', models.BinaryField()),
+                ('unique_visitors', models.PositiveIntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visitor_sketches', to='blog.post')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('post', 'day'), name='unique_post_visitor_day'), models.UniqueConstraint(condition=models.Q(('day__isnull', True)), fields=('post',), name='unique_post_visitor_lifetime')],
+            },
+        ),
+    ]
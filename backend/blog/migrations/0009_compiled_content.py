@@ -0,0 +1,127 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:46
+
+import hashlib
+import html
+import math
+import re
+
+import markdown
+import nh3
+from django.db import migrations, models
+
+# A frozen copy of blog.content as of compiler version 2, so this migration
+# keeps producing the same output whatever later happens to that module.
+COMPILER_VERSION = '2'
+ZWNJ = '\u200c'
+ALLOWED_ATTRIBUTES = {
+    **{tag: set(attributes) for tag, attributes in nh3.ALLOWED_ATTRIBUTES.items()},
+    '*': {'dir', 'lang'},
+}
+INVISIBLE_RE = re.compile('[\u200b\ufeff]')
+HEADING_RE = re.compile(r'<h([2-4])(\s[^>]*)?>(.*?)</h\1>', re.DOTALL)
+BLOCK_TAG_RE = re.compile(
+    r'</?(?:p|div|h[1-6]|ul|ol|li|dl|dt|dd|blockquote|pre|table|tr|td|th|figure|figcaption|br|hr|img)\b[^>]*>',
+    re.IGNORECASE,
+)
+TAG_RE = re.compile(r'<[^>]+>')
+WORD_RE = re.compile(rf'\w+(?:{ZWNJ}\w+)*')
+ANCHOR_DROP_RE = re.compile(rf'[^\w{ZWNJ}-]')
+
+
+def plain_text(content_html):
+    text = TAG_RE.sub('', BLOCK_TAG_RE.sub(' ', content_html))
+    return ' '.join(html.unescape(text).split())
+
+
+def anchor(text, taken):
+    base = ANCHOR_DROP_RE.sub('', re.sub(r'\s+', '-', text.strip().lower()))
+    base = re.sub(r'-+', '-', base).strip('-') or 'heading'
+    slug, counter = base, 1
+    while slug in taken:
+        slug = f'{base}-{counter}'
+        counter += 1
+    taken.add(slug)
+    return slug
+
+
+def compile_content(content):
+    source = INVISIBLE_RE.sub('', content or '')
+    if not source.lstrip().startswith('<'):
+        source = markdown.markdown(source, extensions=['extra', 'sane_lists'])
+    cleaned = nh3.clean(source, attributes=ALLOWED_ATTRIBUTES)
+    toc, taken = [], set()
+
+    def add_anchor(match):
+        level, attributes, inner = match.group(1), match.group(2) or '', match.group(3)
+        text = plain_text(inner)
+        if not text:
+            return match.group(0)
+        slug = anchor(text, taken)
+        toc.append({'id': slug, 'text': text, 'level': int(level)})
+        return f'<h{level}{attributes} id="{slug}">{inner}</h{level}>'
+
+    compiled = HEADING_RE.sub(add_anchor, cleaned)
+    text = plain_text(compiled)
+    word_count = len(WORD_RE.findall(text))
+    return compiled, toc, word_count, text
+
+
+def excerpt_from(text, length=300):
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1].rsplit(' ', 1)[0]
+    return f'{cut}…'
+
+
+def compile_existing(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    fields = ['content_html', 'toc', 'word_count', 'reading_time', 'content_hash', 'excerpt']
+    batch = []
+    for post in Post.objects.order_by('pk').only('pk', 'content', 'excerpt').iterator(chunk_size=500):
+        post.content_html, post.toc, post.word_count, text = compile_content(post.content)
+        post.reading_time = max(1, math.ceil(post.word_count / 200))
+        post.content_hash = hashlib.sha256(f'{COMPILER_VERSION}\n{post.content}'.encode()).hexdigest()
+        if not post.excerpt.strip():
+            post.excerpt = excerpt_from(text)
+        batch.append(post)
+        if len(batch) >= 500:
+            Post.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Post.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_visitor_sketches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='toc',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='excerpt',
+            field=models.TextField(blank=True, max_length=300),
+        ),
+        migrations.RunPython(compile_existing, migrations.RunPython.noop),
+    ]
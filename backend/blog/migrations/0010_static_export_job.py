@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_compiled_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaticExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_pk', models.BigIntegerField(blank=True, null=True)),
+                ('changes', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
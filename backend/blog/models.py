@@ -1,20 +1,38 @@
 from django.db import models
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.utils.text import slugify
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
+class PublishedPostCountQuerySet(models.QuerySet):
+    def recount_published_posts(self):
+        """Rewrite `published_post_count` from the posts table; returns the rows updated."""
+        relation = self.model._meta.get_field('posts').field.name
+        published = (
+            Post.objects.filter(**{relation: OuterRef('pk')}, status='published')
+            .order_by().values(relation).annotate(total=Count('pk')).values('total')
+        )
+        return self.update(published_post_count=Coalesce(Subquery(published), 0))
+
+
 class Author(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='author_profile')
     display_name = models.CharField(max_length=100)
     bio = models.TextField(blank=True)
     expertise = models.CharField(max_length=200, blank=True)
     profile_image = models.ImageField(upload_to='authors/', blank=True, null=True)
+    profile_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     twitter_url = models.URLField(blank=True)
     linkedin_url = models.URLField(blank=True)
     instagram_url = models.URLField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Maintained by blog.signals; `manage.py recount` repairs drift.
+    published_post_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PublishedPostCountQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
@@ -46,6 +64,9 @@ class Category(models.Model):
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    published_post_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PublishedPostCountQuerySet.as_manager()
 
     class Meta:
         ordering = ['name']
@@ -67,6 +88,10 @@ class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True)
     slug = models.SlugField(max_length=60, unique=True, allow_unicode=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    published_post_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PublishedPostCountQuerySet.as_manager()
 
     class Meta:
         ordering = ['name']
@@ -81,6 +106,32 @@ class Tag(models.Model):
         super().save(*args, **kwargs)
 
 
+class PostQuerySet(models.QuerySet):
+    def published(self):
+        # Evaluated per call: a cutoff captured at import time would hide
+        # every post published after the worker started.
+        return self.filter(status='published', published_at__lte=timezone.now())
+
+    def for_listing(self):
+        # A page costs two queries: the posts joined to author and category,
+        # and the prefetched tags. Counts are denormalized columns.
+        return self.select_related('author', 'category').prefetch_related('tags')
+
+    def recount_approved_comments(self):
+        approved = (
+            Comment.objects.filter(post=OuterRef('pk'), is_approved=True)
+            .order_by().values('post').annotate(total=Count('pk')).values('total')
+        )
+        return self.update(approved_comment_count=Coalesce(Subquery(approved), 0))
+
+    def for_detail(self):
+        return self.for_listing().prefetch_related(
+            Prefetch('related_posts', queryset=Post.objects.for_listing()),
+            Prefetch('computed_related', queryset=RelatedPost.objects.order_by('rank')),
+            Prefetch('computed_related__related', queryset=Post.objects.for_listing()),
+        )
+
+
 class Post(models.Model):
     STATUS_CHOICES = [
         ('draft', 'پیش‌نویس'),
@@ -91,9 +142,16 @@ class Post(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=250, unique=True, allow_unicode=True)
     subtitle = models.CharField(max_length=250, blank=True)
-    excerpt = models.TextField(max_length=300)
+    # Left blank, it is filled from the opening of the content.
+    excerpt = models.TextField(max_length=300, blank=True)
     content = models.TextField()
+    # Compiled from `content` on save; see blog.content.
+    content_html = models.TextField(blank=True, editable=False)
+    toc = models.JSONField(default=list, blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
     featured_image = models.ImageField(upload_to='blog/featured/', blank=True, null=True)
+    featured_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     featured_image_alt = models.CharField(max_length=200, blank=True)
     author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='posts')
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='posts')
@@ -109,12 +167,22 @@ class Post(models.Model):
     og_title = models.CharField(max_length=95, blank=True)
     og_description = models.CharField(max_length=200, blank=True)
     og_image = models.ImageField(upload_to='blog/og/', blank=True, null=True)
+    og_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     schema_type = models.CharField(max_length=50, default='Article')
     key_points = models.JSONField(default=list, blank=True)
     faq = models.JSONField(default=list, blank=True)
     view_count = models.PositiveIntegerField(default=0)
+    # HyperLogLog estimate of distinct readers; see blog.visitors.
+    unique_visitors = models.PositiveIntegerField(default=0, editable=False)
+    approved_comment_count = models.PositiveIntegerField(default=0, editable=False)
     related_posts = models.ManyToManyField('self', blank=True, symmetrical=False)
     enable_comments = models.BooleanField(default=True)
+    # Set when a save changes RELATED_FIELDS or the tags; compute_related_posts only revisits stale posts.
+    related_stale = models.BooleanField(default=True, db_index=True, editable=False)
+    # JSON-LD rendered from the revision stamped inside; see blog.structured_data.
+    structured_data = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-published_at', '-created_at']
@@ -123,11 +191,32 @@ class Post(models.Model):
             models.Index(fields=['status', 'published_at']),
             models.Index(fields=['category', 'status']),
             models.Index(fields=['author', 'status']),
+            models.Index(fields=['status', '-view_count']),
         ]
 
+    # What the related-posts engine scores on, besides the tags.
+    RELATED_FIELDS = ('title', 'excerpt', 'content', 'meta_keywords', 'category_id', 'status')
+
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_related = instance._related_state()
+        return instance
+
+    def _related_state(self):
+        loaded = self.__dict__
+        return {field: loaded[field] for field in self.RELATED_FIELDS if field in loaded}
+
+    def _related_fields_changed(self):
+        # Fields deferred at load time count as changed.
+        loaded = getattr(self, '_loaded_related', None)
+        return self._state.adding or loaded is None or loaded != {
+            field: getattr(self, field) for field in self.RELATED_FIELDS
+        }
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title, allow_unicode=True)
@@ -137,12 +226,37 @@ class Post(models.Model):
                 self.slug = f"{original_slug}-{counter}"
                 counter += 1
 
-        if self.content:
-            word_count = len(self.content.split())
-            self.reading_time = max(1, word_count // 200)
+        self.fill_derived_fields()
+
+        if kwargs.get('update_fields') is None and self._related_fields_changed():
+            self.related_stale = True
+
+        super().save(*args, **kwargs)
+        self._loaded_related = self._related_state()
+
+    def fill_derived_fields(self):
+        """Compiled content, publish date and meta fallbacks; shared with the bulk importer."""
+        from .content import compile_content, content_hash, excerpt_from, plain_text
+
+        digest = content_hash(self.content)
+        text = None
+        if digest != self.content_hash:
+            compiled = compile_content(self.content)
+            self.content_html = compiled['html']
+            self.toc = compiled['toc']
+            self.word_count = compiled['word_count']
+            self.reading_time = compiled['reading_time']
+            self.content_hash = digest
+            text = compiled['text']
+        if not self.excerpt.strip():
+            self.excerpt = excerpt_from(text if text is not None else plain_text(self.content_html))
 
         if self.status == 'published' and not self.published_at:
             self.published_at = timezone.now()
+        elif self.status == 'published' and self.published_at > timezone.now():
+            # A future publish date is a schedule; publish_scheduled_posts
+            # flips it back when it comes due.
+            self.status = 'scheduled'
 
         if not self.meta_title:
             self.meta_title = self.title[:70]
@@ -153,8 +267,6 @@ class Post(models.Model):
         if not self.og_description:
             self.og_description = self.excerpt[:200]
 
-        super().save(*args, **kwargs)
-
     def get_absolute_url(self):
         return f"/blog/{self.slug}"
 
@@ -163,8 +275,9 @@ class Post(models.Model):
         return self.status == 'published' and self.published_at and self.published_at <= timezone.now()
 
     def increment_view_count(self):
+        from .counters import view_count_buffer
+        view_count_buffer.record(self.pk)
         self.view_count += 1
-        self.save(update_fields=['view_count'])
 
 
 class Comment(models.Model):
@@ -184,4 +297,100 @@ class Comment(models.Model):
         indexes = [models.Index(fields=['post', 'is_approved'])]
 
     def __str__(self):
-        return f"{self.name or (getattr(self.user, 'username', 'ناشناس'))} - {self.post.title}"
\ No newline at end of file
+        return f"{self.name or (getattr(self.user, 'username', 'ناشناس'))} - {self.post.title}"
+
+
+class SearchTerm(models.Model):
+    """Inverted index row: one normalized term of a post with its weight."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64)
+    weight = models.FloatField()
+
+    class Meta:
+        unique_together = [('term', 'post')]
+
+    def __str__(self):
+        return f"{self.term} - {self.post_id}"
+
+
+
+class RelatedPost(models.Model):
+    """Precomputed top-k related posts, written by compute_related_posts."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='computed_related')
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['post', 'rank']
+        unique_together = [('post', 'rank')]
+
+    def __str__(self):
+        return f"{self.post_id} -> {self.related_id} ({self.score:.3f})"
+
+
+class PostViewBucket(models.Model):
+    """Views of a post within one clock hour; fed by the view count buffer."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='view_buckets')
+    hour = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+    # Views already folded into the trending scores.
+    scored_views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('post', 'hour')]
+        indexes = [models.Index(fields=['hour'])]
+
+    def __str__(self):
+        return f"{self.post_id} @ {self.hour:%Y-%m-%d %H}:00 ({self.views})"
+
+
+class TrendingScore(models.Model):
+    """Time-decayed view score of a post over one window, kept by update_trending."""
+    WINDOW_CHOICES = [
+        ('24h', '۲۴ ساعت'),
+        ('7d', '۷ روز'),
+        ('30d', '۳۰ روز'),
+    ]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='trending_scores')
+    window = models.CharField(max_length=3, choices=WINDOW_CHOICES)
+    score = models.FloatField(default=0)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('window', 'post')]
+        indexes = [models.Index(fields=['window', '-score'])]
+
+    def __str__(self):
+        return f"{self.post_id} [{self.window}] {self.score:.2f}"
+
+
+class StaticExportJob(models.Model):
+    """A re-export waiting for `export_blog_static --loop`; without a post it asks for a full export."""
+    post_pk = models.BigIntegerField(null=True, blank=True)
+    # Keyword arguments for StaticExporter.export_post.
+    changes = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.post_pk or 'all'} @ {self.created_at:%Y-%m-%d %H:%M:%S}"
+
+
+class PostVisitorSketch(models.Model):
+    """HyperLogLog sketch of a post's visitors on one day, or over its lifetime when `day` is null."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='visitor_sketches')
+    day = models.DateField(null=True, blank=True)
+    registers = models.BinaryField()
+    unique_visitors = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'day'], name='unique_post_visitor_day'),
+            models.UniqueConstraint(
+                fields=['post'], condition=Q(day__isnull=True), name='unique_post_visitor_lifetime'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.post_id} @ {self.day or 'all time'} (~{self.unique_visitors})"
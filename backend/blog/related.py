@@ -0,0 +1,218 @@
+"""
+Offline related-posts engine.
+
+Scores published posts against each other on shared tags, category and
+grade/field, and tf-idf similarity of their indexed text, then stores the
+top-k per post in the RelatedPost table. Only posts flagged `related_stale`
+(content, category or tags changed) and the posts whose lists they can
+affect are recomputed, and a run with nothing stale skips loading the
+corpus at all. A flag is cleared only if the post's `updated_at` still
+matches what the run loaded, so an edit committed mid-run is picked up by
+the next one.
+"""
+import heapq
+import logging
+import math
+import threading
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+
+from .cache import bump_versions
+from .models import Post, RelatedPost, SearchTerm
+
+logger = logging.getLogger('api')
+
+WEIGHT_TEXT = 0.5
+WEIGHT_TAGS = 0.3
+WEIGHT_CATEGORY = 0.15
+WEIGHT_SEGMENT = 0.05
+
+FINGERPRINT_TERMS = 25      # strongest tf-idf terms kept per post
+MAX_TERM_DF_RATIO = 0.2     # terms in more posts than this say nothing about relatedness
+MAX_CATEGORY_CANDIDATES = 200
+
+
+class RelatedPostsEngine:
+    def __init__(self, top_k=6):
+        self.top_k = top_k
+        self.posts = {}
+        self.tags = defaultdict(set)
+        self.fingerprints = {}
+        self.tag_posts = defaultdict(set)
+        self.term_posts = defaultdict(list)
+        self.category_posts = defaultdict(list)
+        self._scores = {}
+
+    # -- loading -----------------------------------------------------------
+
+    def load(self):
+        published = Post.objects.filter(status='published')
+        for row in published.order_by('-published_at').values(
+                'id', 'slug', 'updated_at', 'category_id', 'category__grade', 'category__field', 'related_stale'):
+            self.posts[row['id']] = row
+            if row['category_id']:
+                self.category_posts[row['category_id']].append(row['id'])
+
+        through = Post.tags.through.objects.filter(post__status='published')
+        for post_id, tag_id in through.values_list('post_id', 'tag_id'):
+            self.tags[post_id].add(tag_id)
+            self.tag_posts[tag_id].add(post_id)
+
+        self._load_fingerprints(published)
+
+    def _load_fingerprints(self, published):
+        total = max(len(self.posts), 1)
+        terms = SearchTerm.objects.filter(post__in=published)
+        document_frequency = dict(terms.values_list('term').annotate(df=Count('post')).order_by())
+        max_df = max(2, MAX_TERM_DF_RATIO * total)
+
+        def flush(post_id, weights):
+            top = heapq.nlargest(FINGERPRINT_TERMS, weights.items(), key=lambda item: item[1])
+            norm = math.sqrt(sum(weight * weight for _, weight in top)) or 1.0
+            fingerprint = {term: weight / norm for term, weight in top}
+            self.fingerprints[post_id] = fingerprint
+            for term, weight in fingerprint.items():
+                self.term_posts[term].append((post_id, weight))
+
+        current, weights = None, {}
+        for post_id, term, weight in terms.order_by('post_id').values_list('post_id', 'term', 'weight').iterator():
+            if post_id != current:
+                if current is not None:
+                    flush(current, weights)
+                current, weights = post_id, {}
+            df = document_frequency.get(term, 1)
+            if 2 <= df <= max_df:
+                weights[term] = weight * math.log(total / df)
+        if current is not None:
+            flush(current, weights)
+
+    # -- scoring -----------------------------------------------------------
+
+    def scores_for(self, post_id):
+        """Return {candidate_id: score} for every post sharing a signal with `post_id`."""
+        if post_id not in self._scores:
+            self._scores[post_id] = self._score(post_id)
+        return self._scores[post_id]
+
+    def _score(self, post_id):
+        post = self.posts[post_id]
+        text = defaultdict(float)
+        for term, weight in self.fingerprints.get(post_id, {}).items():
+            for other, other_weight in self.term_posts[term]:
+                text[other] += weight * other_weight
+
+        candidates = set(text)
+        for tag_id in self.tags[post_id]:
+            candidates |= self.tag_posts[tag_id]
+        if post['category_id']:
+            candidates.update(self.category_posts[post['category_id']][:MAX_CATEGORY_CANDIDATES])
+        candidates.discard(post_id)
+
+        my_tags = self.tags[post_id]
+        scores = {}
+        for other_id in candidates:
+            other = self.posts[other_id]
+            score = WEIGHT_TEXT * text.get(other_id, 0.0)
+
+            other_tags = self.tags[other_id]
+            if my_tags and other_tags:
+                score += WEIGHT_TAGS * len(my_tags & other_tags) / len(my_tags | other_tags)
+
+            if post['category_id'] and post['category_id'] == other['category_id']:
+                score += WEIGHT_CATEGORY
+            if post['category__grade'] and post['category__grade'] == other['category__grade']:
+                score += WEIGHT_SEGMENT / 2
+            if post['category__field'] and post['category__field'] == other['category__field']:
+                score += WEIGHT_SEGMENT / 2
+
+            if score > 0:
+                scores[other_id] = score
+        return scores
+
+    def top_related(self, post_id):
+        scores = self.scores_for(post_id)
+        return heapq.nlargest(self.top_k, scores.items(), key=lambda item: (item[1], -item[0]))
+
+    # -- incremental run ---------------------------------------------------
+
+    def dirty_posts(self, full=False):
+        """Posts whose stored list may be wrong and has to be recomputed."""
+        if full:
+            return set(self.posts)
+
+        stale = {post_id for post_id, row in self.posts.items() if row['related_stale']}
+        stored = defaultdict(list)
+        for post_id, related_id, score in RelatedPost.objects.values_list('post_id', 'related_id', 'score'):
+            stored[post_id].append((related_id, score))
+
+        dirty = set(stale)
+        # Lists that point at a changed or no longer published post.
+        for post_id, entries in stored.items():
+            if post_id in self.posts and any(
+                    related_id in stale or related_id not in self.posts for related_id, _ in entries):
+                dirty.add(post_id)
+        # Posts a changed post may now outrank an entry for; scores are
+        # symmetric, so the changed post's own candidates are exactly those.
+        for post_id in stale:
+            for other_id, score in self.scores_for(post_id).items():
+                entries = stored.get(other_id, [])
+                if len(entries) < self.top_k or score > min(entry_score for _, entry_score in entries):
+                    dirty.add(other_id)
+        return dirty
+
+    @staticmethod
+    def pending():
+        """Whether an incremental run would have anything to do."""
+        return (
+            Post.objects.filter(status='published', related_stale=True).exists()
+            or RelatedPost.objects.exclude(post__status='published', related__status='published').exists()
+        )
+
+    def run(self, full=False):
+        if not full and not self.pending():
+            return 0
+        self.load()
+        dirty = self.dirty_posts(full=full)
+
+        rows = []
+        for post_id in dirty:
+            for rank, (related_id, score) in enumerate(self.top_related(post_id), start=1):
+                rows.append(RelatedPost(post_id=post_id, related_id=related_id, score=score, rank=rank))
+
+        with transaction.atomic():
+            RelatedPost.objects.exclude(post__status='published').delete()
+            if full:
+                RelatedPost.objects.all().delete()
+            else:
+                RelatedPost.objects.filter(post_id__in=dirty).delete()
+            RelatedPost.objects.bulk_create(rows, batch_size=1000)
+            self._clear_stale()
+            slugs = [self.posts[post_id]['slug'] for post_id in dirty]
+            transaction.on_commit(lambda: bump_versions(*(f'post:{slug}' for slug in slugs)))
+        return len(dirty)
+
+    def _clear_stale(self, batch_size=500):
+        # Rows edited since load() keep their flag for the next run.
+        loaded = [(pk, row['updated_at']) for pk, row in self.posts.items() if row['related_stale']]
+        for start in range(0, len(loaded), batch_size):
+            batch = loaded[start:start + batch_size]
+            unchanged = reduce(or_, (Q(pk=pk, updated_at=updated_at) for pk, updated_at in batch))
+            Post.objects.filter(unchanged).update(related_stale=False)
+
+
+def run_related(interval, top_k, stop_event=None):
+    """Recompute stale related posts every `interval` seconds until `stop_event` is set."""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            updated = RelatedPostsEngine(top_k=top_k).run()
+            if updated:
+                logger.info(f"Recomputed related posts for {updated} posts")
+        except Exception as e:
+            logger.error(f"Related posts update failed: {str(e)}")
+        stop_event.wait(interval)
@@ -0,0 +1,67 @@
+"""
+Scheduled publishing.
+
+Posts with status "scheduled" and a publish date form the due queue; the
+(status, published_at) index keeps both the due batch and the next due time
+a single index range read. The worker sleeps until the head of the queue is
+due (or the poll interval passes, to pick up newly scheduled posts) and
+publishes through Post.save, so the usual signals re-render the post and
+bump the response cache versions.
+"""
+import logging
+import threading
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Post
+
+logger = logging.getLogger('api')
+
+
+def due_queue():
+    return Post.objects.filter(status='scheduled', published_at__isnull=False).order_by('published_at', 'pk')
+
+
+def next_due_at():
+    return due_queue().values_list('published_at', flat=True).first()
+
+
+def publish_due_posts(now=None, batch_size=100):
+    """Publish every scheduled post due by `now`; returns the published posts."""
+    now = now or timezone.now()
+    published = []
+    while True:
+        with transaction.atomic():
+            # SKIP LOCKED lets several workers drain the queue without
+            # publishing a post twice.
+            batch = list(
+                due_queue().filter(published_at__lte=now)
+                .select_for_update(skip_locked=True)[:batch_size]
+            )
+            for post in batch:
+                post.status = 'published'
+                post.related_stale = True
+                post.save(update_fields=['status', 'related_stale', 'updated_at'])
+        published.extend(batch)
+        if len(batch) < batch_size:
+            return published
+
+
+def run_scheduler(poll_interval, stop_event=None):
+    """Publish due posts until `stop_event` is set."""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            for post in publish_due_posts():
+                logger.info(f"Published scheduled post {post.slug} (due {post.published_at.isoformat()})")
+            due_at = next_due_at()
+        except Exception as e:
+            logger.error(f"Scheduled publishing failed: {str(e)}")
+            due_at = None
+
+        wait = poll_interval
+        if due_at is not None:
+            wait = min(poll_interval, max((due_at - timezone.now()).total_seconds(), 0))
+        stop_event.wait(wait)
@@ -0,0 +1,212 @@
+"""
+Persian full-text search over blog posts.
+
+Posts are tokenized into an inverted index (SearchTerm rows) whenever they
+are saved, so a query only reads the posting lists of its own terms instead
+of scanning every article body with icontains.
+"""
+import math
+import re
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.utils.html import escape, strip_tags
+from rest_framework.filters import BaseFilterBackend
+
+ZWNJ = '\u200c'
+
+# Arabic code points that Persian keyboards and copy-pasted text mix in.
+_CHAR_MAP = str.maketrans({
+    '\u064a': '\u06cc',  # ي -> ی
+    '\u0649': '\u06cc',  # ى -> ی
+    '\u0643': '\u06a9',  # ك -> ک
+    '\u0629': '\u0647',  # ة -> ه
+    '\u06c0': '\u0647',  # ۀ -> ه
+    '\u0623': '\u0627',  # أ -> ا
+    '\u0625': '\u0627',  # إ -> ا
+    '\u0624': '\u0648',  # ؤ -> و
+    **{chr(0x06f0 + i): str(i) for i in range(10)},  # Persian digits
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic digits
+})
+
+# Harakat, superscript alef and tatweel carry no meaning for matching.
+_STRIPPED = {chr(c) for c in range(0x064b, 0x0660)} | {'\u0670', '\u0640'}
+
+_WORD_RE = re.compile(r'[\w\u200c]+')
+
+MAX_TERM_LENGTH = 64
+
+STOPWORDS = frozenset("""
+و در به از که این آن را با است برای تا یا هم نیز اما اگر پس چه چون بر هر
+می شود شد بود باشد کرد کند کنید کنیم های ها یک دو ای ما شما او آنها
+the a an and or of to in on for is are
+""".split())
+
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'tags': 2.0,
+    'meta_keywords': 2.0,
+    'excerpt': 1.5,
+    'content': 1.0,
+}
+
+
+def normalize(text):
+    """Unify ye/kaf and digits, drop diacritics and lowercase Latin letters."""
+    text = text.translate(_CHAR_MAP)
+    return ''.join(ch for ch in text if ch not in _STRIPPED).lower()
+
+
+def tokenize(text):
+    """
+    Split normalized text into index terms.
+
+    A word written with ZWNJ ("کتاب‌ها") yields its joined form ("کتابها")
+    and each part ("کتاب"), so both spellings of the query find it.
+    """
+    tokens = []
+    for word in _WORD_RE.findall(normalize(text)):
+        parts = [part for part in word.split(ZWNJ) if part]
+        if not parts:
+            continue
+        candidates = [''.join(parts)]
+        if len(parts) > 1:
+            candidates.extend(parts)
+        tokens.extend(
+            token[:MAX_TERM_LENGTH] for token in candidates
+            if token not in STOPWORDS and (len(token) > 1 or token.isdigit())
+        )
+    return tokens
+
+
+def query_terms(query):
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def post_terms(post, tag_names=None):
+    """Return {term: weight} for a post, with log-scaled term frequencies."""
+    if tag_names is None:
+        tag_names = list(post.tags.values_list('name', flat=True)) if post.pk else []
+    fields = {
+        'title': post.title,
+        'tags': ' '.join(tag_names),
+        'meta_keywords': post.meta_keywords.replace(',', ' '),
+        'excerpt': post.excerpt,
+        'content': strip_tags(post.content),
+    }
+    weights = Counter()
+    for name, text in fields.items():
+        for term, tf in Counter(tokenize(text or '')).items():
+            weights[term] += FIELD_WEIGHTS[name] * (1 + math.log(tf))
+    return weights
+
+
+def index_post(post, tag_names=None):
+    from .models import SearchTerm
+
+    terms = post_terms(post, tag_names)
+    with transaction.atomic():
+        SearchTerm.objects.filter(post=post).delete()
+        SearchTerm.objects.bulk_create(
+            SearchTerm(post=post, term=term, weight=weight) for term, weight in terms.items()
+        )
+
+
+def matching_post_ids(terms):
+    from .models import SearchTerm
+
+    return SearchTerm.objects.filter(term__in=terms).values('post')
+
+
+def ranked_matches(posts, terms):
+    """
+    Rank `posts` against `terms`.
+
+    Returns a values queryset of {'post', 'matched', 'score'} ordered by the
+    number of query terms matched, then by the tf-idf score.
+    """
+    from .models import Post, SearchTerm
+
+    # The corpus size only scales idf, so a slightly stale value is fine and
+    # keeps a full-table count off the query path.
+    total = max(cache.get_or_set('blog:search:post_count', Post.objects.count, 600), 1)
+    document_frequency = dict(
+        SearchTerm.objects.filter(term__in=terms).values_list('term').annotate(df=Count('post'))
+    )
+    idf = {term: math.log(1 + total / document_frequency.get(term, total)) for term in terms}
+
+    return (
+        SearchTerm.objects.filter(term__in=terms, post__in=posts)
+        .values('post')
+        .annotate(
+            matched=Count('term'),
+            score=Sum(Case(
+                *[When(term=term, then=F('weight') * Value(idf[term])) for term in terms],
+                output_field=FloatField(),
+            )),
+        )
+        .order_by('-matched', '-score', 'post')
+    )
+
+
+def highlight(text, terms, length=200):
+    """
+    Cut an escaped snippet around the first matching term and wrap matches in
+    <mark>. Returns an empty string when nothing matches.
+    """
+    text = strip_tags(text or '')
+    if not text:
+        return ''
+
+    # Keep track of where each normalized character came from so matches
+    # can be mapped back onto the original text.
+    normalized, offsets = [], []
+    for index, ch in enumerate(text.translate(_CHAR_MAP)):
+        if ch in _STRIPPED or ch == ZWNJ:
+            continue
+        normalized.append(ch.lower())
+        offsets.append(index)
+    normalized = ''.join(normalized)
+
+    spans = []
+    for term in sorted(set(terms), key=len, reverse=True):
+        for match in re.finditer(re.escape(term), normalized):
+            start, end = offsets[match.start()], offsets[match.end() - 1] + 1
+            if not any(start < s_end and s_start < end for s_start, s_end in spans):
+                spans.append((start, end))
+    if not spans:
+        return ''
+    spans.sort()
+
+    window_start = max(0, spans[0][0] - length // 4)
+    window_end = min(len(text), window_start + length)
+
+    parts, cursor = [], window_start
+    for start, end in spans:
+        if start < window_start or end > window_end:
+            continue
+        parts.append(escape(text[cursor:start]))
+        parts.append(f'<mark>{escape(text[start:end])}</mark>')
+        cursor = end
+    parts.append(escape(text[cursor:window_end]))
+
+    snippet = ''.join(parts).strip()
+    if window_start > 0:
+        snippet = '…' + snippet
+    if window_end < len(text):
+        snippet += '…'
+    return snippet
+
+
+class IndexedSearchFilter(BaseFilterBackend):
+    """Drop-in for DRF's SearchFilter that matches through the search index."""
+
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        terms = query_terms(request.query_params.get(self.search_param, ''))
+        if not terms:
+            return queryset
+        return queryset.filter(pk__in=matching_post_ids(terms))
@@ -1,75 +1,100 @@
+from django.conf import settings
+from django.utils.html import escape
 from rest_framework import serializers
+from api.serializers import SrcsetField
+from .comments import CommentTree
 from .models import Author, Category, Tag, Post, Comment
+from .search import highlight
+from .structured_data import build_breadcrumb, build_schema_markup, stored_structured_data
 
 
 class AuthorSerializer(serializers.ModelSerializer):
-    post_count = serializers.SerializerMethodField()
+    post_count = serializers.IntegerField(source='published_post_count', read_only=True)
+    profile_image_srcset = SrcsetField('profile_image')
 
     class Meta:
         model = Author
         fields = ['id', 'display_name', 'bio', 'expertise', 'profile_image',
-                  'twitter_url', 'linkedin_url', 'instagram_url', 'post_count']
-
-    def get_post_count(self, obj):
-        return obj.posts.filter(status='published').count()
+                  'profile_image_srcset', 'twitter_url', 'linkedin_url', 'instagram_url', 'post_count']
 
 
 class CategorySerializer(serializers.ModelSerializer):
-    post_count = serializers.SerializerMethodField()
+    post_count = serializers.IntegerField(source='published_post_count', read_only=True)
 
     class Meta:
         model = Category
         fields = ['id', 'name', 'slug', 'description', 'grade', 'field',
                   'meta_description', 'parent', 'post_count']
 
-    def get_post_count(self, obj):
-        return obj.posts.filter(status='published').count()
-
 
 class TagSerializer(serializers.ModelSerializer):
-    post_count = serializers.SerializerMethodField()
+    post_count = serializers.IntegerField(source='published_post_count', read_only=True)
 
     class Meta:
         model = Tag
         fields = ['id', 'name', 'slug', 'post_count']
 
-    def get_post_count(self, obj):
-        return obj.posts.filter(status='published').count()
-
 
 class CommentSerializer(serializers.ModelSerializer):
     author_name = serializers.SerializerMethodField()
     replies = serializers.SerializerMethodField()
+    reply_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
         fields = ['id', 'post', 'parent', 'author_name', 'content',
-                  'rating', 'is_approved', 'created_at', 'replies']
+                  'rating', 'is_approved', 'created_at', 'replies', 'reply_count']
         read_only_fields = ['is_approved', 'created_at']
 
     def get_author_name(self, obj):
         return obj.name if obj.name else (getattr(obj.user, 'username', None) or 'ناشناس')
 
     def get_replies(self, obj):
-        if obj.replies.exists():
-            return CommentSerializer(obj.replies.filter(is_approved=True), many=True).data
-        return []
+        tree = self.context.get('comment_tree')
+        if tree is None:
+            if obj.replies.exists():
+                return CommentSerializer(obj.replies.filter(is_approved=True), many=True).data
+            return []
+
+        # Deeper levels and replies past the first page are fetched through
+        # the post's `comments` action using `reply_count` as the hint.
+        depth = self.context.get('comment_depth', 0) + 1
+        if depth > settings.BLOG_COMMENT_MAX_DEPTH:
+            return []
+        replies = tree.replies(obj.pk)[:settings.BLOG_COMMENT_REPLIES_PAGE_SIZE]
+        return CommentSerializer(replies, many=True, context={**self.context, 'comment_depth': depth}).data
+
+    def get_reply_count(self, obj):
+        tree = self.context.get('comment_tree')
+        if tree is None:
+            return obj.replies.filter(is_approved=True).count()
+        return len(tree.replies(obj.pk))
 
 
 class PostListSerializer(serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
-    comment_count = serializers.SerializerMethodField()
+    comment_count = serializers.IntegerField(source='approved_comment_count', read_only=True)
+    featured_image_srcset = SrcsetField('featured_image')
 
     class Meta:
         model = Post
         fields = ['id', 'title', 'slug', 'excerpt', 'featured_image',
-                  'featured_image_alt', 'author', 'category', 'tags',
+                  'featured_image_srcset', 'featured_image_alt', 'author', 'category', 'tags',
                   'published_at', 'reading_time', 'view_count', 'comment_count']
 
-    def get_comment_count(self, obj):
-        return obj.comments.filter(is_approved=True).count()
+
+class PostSearchResultSerializer(PostListSerializer):
+    score = serializers.FloatField(source='search_score', read_only=True)
+    snippet = serializers.SerializerMethodField()
+
+    class Meta(PostListSerializer.Meta):
+        fields = PostListSerializer.Meta.fields + ['score', 'snippet']
+
+    def get_snippet(self, obj):
+        terms = self.context.get('search_terms', [])
+        return highlight(obj.content, terms) or highlight(obj.excerpt, terms) or escape(obj.excerpt)
 
 
 class PostDetailSerializer(serializers.ModelSerializer):
@@ -77,57 +102,40 @@ class PostDetailSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
     comments = serializers.SerializerMethodField()
-    related_posts = PostListSerializer(many=True, read_only=True)
+    related_posts = serializers.SerializerMethodField()
     schema_markup = serializers.SerializerMethodField()
     breadcrumb = serializers.SerializerMethodField()
+    featured_image_srcset = SrcsetField('featured_image')
+    og_image_srcset = SrcsetField('og_image')
 
     class Meta:
         model = Post
-        fields = ['id', 'title', 'slug', 'subtitle', 'content', 'excerpt',
-                  'featured_image', 'featured_image_alt', 'author', 'category',
+        fields = ['id', 'title', 'slug', 'subtitle', 'content', 'content_html', 'toc', 'word_count', 'excerpt',
+                  'featured_image', 'featured_image_srcset', 'featured_image_alt', 'author', 'category',
                   'tags', 'published_at', 'updated_at', 'reading_time',
                   'view_count', 'meta_title', 'meta_description', 'meta_keywords',
-                  'og_title', 'og_description', 'og_image', 'key_points', 'faq',
+                  'og_title', 'og_description', 'og_image', 'og_image_srcset', 'key_points', 'faq',
                   'comments', 'related_posts', 'enable_comments', 'schema_markup',
                   'breadcrumb']
 
     def get_comments(self, obj):
         if obj.enable_comments:
-            comments = obj.comments.filter(is_approved=True, parent=None)
-            return CommentSerializer(comments, many=True).data
+            tree = CommentTree(obj)
+            return CommentSerializer(tree.roots(), many=True, context={**self.context, 'comment_tree': tree}).data
         return []
 
+    def get_related_posts(self, obj):
+        # Editors' picks win; otherwise use the precomputed list, which
+        # `for_detail()` prefetches together with its listing relations.
+        posts = [post for post in obj.related_posts.all() if post.is_published]
+        if not posts:
+            posts = [entry.related for entry in obj.computed_related.all() if entry.related.is_published]
+        return PostListSerializer(posts, many=True, context=self.context).data
+
     def get_schema_markup(self, obj):
-        return {
-            "@context": "https://schema.org",
-            "@type": obj.schema_type,
-            "headline": obj.title,
-            "description": obj.meta_description or obj.excerpt,
-            "image": obj.featured_image.url if obj.featured_image else None,
-            "author": {"@type": "Person", "name": obj.author.display_name, "description": obj.author.bio},
-            "publisher": {
-                "@type": "Organization",
-                "name": "مشاور کنکور",
-                "logo": {"@type": "ImageObject", "url": "https://your-domain.com/logo.png"},
-            },
-            "datePublished": obj.published_at.isoformat() if obj.published_at else None,
-            "dateModified": obj.updated_at.isoformat(),
-            "mainEntityOfPage": {"@type": "WebPage", "@id": f"https://your-domain.com{obj.get_absolute_url()}"},
-        }
+        data = stored_structured_data(obj)
+        return data['schema_markup'] if data else build_schema_markup(obj)
 
     def get_breadcrumb(self, obj):
-        items = [
-            {"@type": "ListItem", "position": 1, "name": "خانه", "item": "https://your-domain.com"},
-            {"@type": "ListItem", "position": 2, "name": "وبلاگ", "item": "https://your-domain.com/blog"},
-        ]
-
-        if obj.category:
-            items.append({"@type": "ListItem", "position": 3, "name": obj.category.name,
-                          "item": f"https://your-domain.com/blog/category/{obj.category.slug}"})
-            items.append({"@type": "ListItem", "position": 4, "name": obj.title,
-                          "item": f"https://your-domain.com{obj.get_absolute_url()}"})
-        else:
-            items.append({"@type": "ListItem", "position": 3, "name": obj.title,
-                          "item": f"https://your-domain.com{obj.get_absolute_url()}"})
-
-        return {"@context": "https://schema.org", "@type": "BreadcrumbList", "itemListElement": items}
\ No newline at end of file
+        data = stored_structured_data(obj)
+        return data['breadcrumb'] if data else build_breadcrumb(obj)
@@ -0,0 +1,328 @@
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_versions
+from .counters import adjust_count
+from .feed import invalidate_segments
+from .models import Author, Category, Comment, Post, RelatedPost, Tag
+from .search import index_post
+from .static_export import queue_export
+from .structured_data import refresh_structured_data, render_structured_data
+
+SEARCH_FIELDS = {'title', 'excerpt', 'content', 'meta_keywords'}
+COUNTED_FIELDS = {'status', 'author', 'author_id', 'category', 'category_id'}
+
+
+@receiver(post_save, sender=Post)
+def reindex_post(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    index_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def render_post_structured_data(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'updated_at' not in update_fields:
+        return
+    instance.structured_data = render_structured_data(instance)
+    Post.objects.filter(pk=instance.pk).update(structured_data=instance.structured_data)
+
+
+@receiver(post_save, sender=Author)
+def rerender_author_posts(sender, instance, created, **kwargs):
+    if not created:
+        refresh_structured_data(instance.posts.all())
+
+
+@receiver(post_save, sender=Category)
+def rerender_category_posts(sender, instance, created, **kwargs):
+    if not created:
+        refresh_structured_data(instance.posts.all())
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def reindex_post_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Tag.posts was changed; every post on the other side needs a refresh.
+        posts = Post.objects.filter(pk__in=pk_set) if pk_set else Post.objects.none()
+        for post in posts:
+            index_post(post)
+            bump_versions(f'post:{post.slug}')
+        _mark_related_stale(posts)
+        bump_versions('post')
+    else:
+        index_post(instance)
+        _mark_related_stale(Post.objects.filter(pk=instance.pk))
+        bump_versions('post', f'post:{instance.slug}')
+
+
+def _mark_related_stale(posts):
+    # Moving updated_at on keeps a related-posts run that loaded the old tags
+    # from clearing the flag; the JSON-LD is stamped with it, so re-render.
+    posts.update(related_stale=True, updated_at=timezone.now())
+    refresh_structured_data(posts)
+
+
+def _counts_post_fields(update_fields):
+    return update_fields is None or bool(COUNTED_FIELDS.intersection(update_fields))
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_state(sender, instance, **kwargs):
+    instance._previous = None
+    if instance.pk:
+        instance._previous = (
+            Post.objects.filter(pk=instance.pk)
+            .values('slug', 'status', 'published_at', 'author_id', 'category_id',
+                    'category__grade', 'category__field').first()
+        )
+
+
+@receiver(post_save, sender=Post)
+def update_post_counts(sender, instance, created, update_fields=None, **kwargs):
+    if not _counts_post_fields(update_fields):
+        return
+    before = getattr(instance, '_previous', None) or {}
+    was_published = before.get('status') == 'published'
+    is_published = instance.status == 'published'
+
+    for model, old_id, new_id in (
+        (Author, before.get('author_id'), instance.author_id),
+        (Category, before.get('category_id'), instance.category_id),
+    ):
+        moved = old_id != new_id
+        if was_published and old_id and (moved or not is_published):
+            adjust_count(model.objects.filter(pk=old_id), 'published_post_count', -1)
+        if is_published and new_id and (moved or not was_published):
+            adjust_count(model.objects.filter(pk=new_id), 'published_post_count', 1)
+
+    if was_published != is_published and not created:
+        adjust_count(Tag.objects.filter(posts=instance), 'published_post_count', 1 if is_published else -1)
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_tags(sender, instance, **kwargs):
+    # The tag links are gone by the time post_delete fires.
+    instance._tag_ids = list(instance.tags.values_list('pk', flat=True))
+    instance._referencing_slugs = _referencing_slugs(instance)
+
+
+@receiver(post_delete, sender=Post)
+def release_post_counts(sender, instance, **kwargs):
+    if instance.status != 'published':
+        return
+    adjust_count(Author.objects.filter(pk=instance.author_id), 'published_post_count', -1)
+    adjust_count(Category.objects.filter(pk=instance.category_id), 'published_post_count', -1)
+    adjust_count(Tag.objects.filter(pk__in=getattr(instance, '_tag_ids', [])), 'published_post_count', -1)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_tag_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    links = Post.tags.through.objects
+    if not reverse:
+        # `instance` is a post and pk_set holds tag ids.
+        if instance.status != 'published':
+            return
+        if action in ('pre_remove', 'pre_clear'):
+            dropped = links.filter(post=instance)
+            if action == 'pre_remove':
+                dropped = dropped.filter(tag_id__in=pk_set)
+            instance._dropped_tag_ids = list(dropped.values_list('tag_id', flat=True))
+        elif action in ('post_remove', 'post_clear'):
+            tags = Tag.objects.filter(pk__in=getattr(instance, '_dropped_tag_ids', []))
+            adjust_count(tags, 'published_post_count', -1)
+        elif action == 'post_add':
+            adjust_count(Tag.objects.filter(pk__in=pk_set), 'published_post_count', 1)
+    else:
+        # `instance` is a tag and pk_set holds post ids.
+        if action in ('pre_remove', 'pre_clear'):
+            dropped = links.filter(tag=instance, post__status='published')
+            if action == 'pre_remove':
+                dropped = dropped.filter(post_id__in=pk_set)
+            instance._dropped_post_count = dropped.count()
+        elif action in ('post_remove', 'post_clear'):
+            tag = Tag.objects.filter(pk=instance.pk)
+            adjust_count(tag, 'published_post_count', -getattr(instance, '_dropped_post_count', 0))
+        elif action == 'post_add':
+            added = Post.objects.filter(pk__in=pk_set, status='published').count()
+            adjust_count(Tag.objects.filter(pk=instance.pk), 'published_post_count', added)
+
+
+def _queue_export(post_id=None, **changes):
+    # The job commits or rolls back with the change; the export process runs it.
+    if settings.BLOG_STATIC_EXPORT_ENABLED:
+        queue_export(post_id, **changes)
+
+
+@receiver(post_save, sender=Post)
+def export_saved_post(sender, instance, **kwargs):
+    before = getattr(instance, '_previous', None) or {}
+    was_published = before.get('status') == 'published'
+    is_published = instance.status == 'published'
+    if not (was_published or is_published):
+        return
+    _queue_export(
+        instance.pk,
+        slug=before.get('slug'),
+        published_at=before.get('published_at') if was_published else None,
+        category_ids=[before.get('category_id')],
+        membership_changed=not (
+            was_published and is_published
+            and before.get('category_id') == instance.category_id
+            and before.get('published_at') == instance.published_at
+        ),
+    )
+
+
+@receiver(post_delete, sender=Post)
+def export_deleted_post(sender, instance, **kwargs):
+    if instance.status == 'published':
+        _queue_export(
+            instance.pk,
+            slug=instance.slug,
+            published_at=instance.published_at,
+            category_ids=[instance.category_id],
+            tag_ids=getattr(instance, '_tag_ids', []),
+        )
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def export_retagged_post(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        for post in Post.objects.filter(pk__in=pk_set or [], status='published'):
+            _queue_export(post.pk, tag_ids=[instance.pk])
+    elif instance.status == 'published':
+        dropped = getattr(instance, '_dropped_tag_ids', [])
+        _queue_export(instance.pk, tag_ids=[*(pk_set or []), *dropped])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def export_summary_change(sender, instance, **kwargs):
+    # Author, category and tag summaries are embedded in many pages.
+    _queue_export()
+
+
+def _referencing_slugs(post):
+    # Details embed their related posts, picked by hand or computed.
+    picked = Post.objects.filter(related_posts=post).values_list('slug', flat=True)
+    computed = RelatedPost.objects.filter(related=post).values_list('post__slug', flat=True)
+    return {*picked, *computed}
+
+
+@receiver(post_save, sender=Post)
+def invalidate_saved_post_responses(sender, instance, **kwargs):
+    before = getattr(instance, '_previous', None) or {}
+    slugs = {instance.slug, before.get('slug') or instance.slug, *_referencing_slugs(instance)}
+    bump_versions('post', *(f'post:{slug}' for slug in slugs))
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_deleted_post_responses(sender, instance, **kwargs):
+    slugs = {instance.slug, *getattr(instance, '_referencing_slugs', ())}
+    bump_versions('post', *(f'post:{slug}' for slug in slugs))
+
+
+@receiver(post_save, sender=Post)
+def invalidate_saved_post_feeds(sender, instance, created, **kwargs):
+    # Feed candidates hold ids and publish times only, so just these fields matter.
+    before = getattr(instance, '_previous', None) or {}
+    if 'published' not in (before.get('status'), instance.status):
+        return
+    if not created and all(before.get(field) == getattr(instance, field)
+                           for field in ('status', 'published_at', 'category_id')):
+        return
+    category = instance.category
+    categories = [(category.grade, category.field) if category else ('', '')]
+    if before:
+        categories.append((before['category__grade'], before['category__field']))
+    invalidate_segments(*categories)
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_deleted_post_feeds(sender, instance, **kwargs):
+    if instance.status == 'published':
+        invalidate_segments(
+            Category.objects.filter(pk=instance.category_id).values_list('grade', 'field').first() or ('', '')
+        )
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_segment(sender, instance, **kwargs):
+    instance._previous_segment = (
+        Category.objects.filter(pk=instance.pk).values_list('grade', 'field').first() if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Category)
+def invalidate_category_feeds(sender, instance, **kwargs):
+    before = getattr(instance, '_previous_segment', None)
+    if before is not None and before != (instance.grade, instance.field):
+        invalidate_segments(before, (instance.grade, instance.field))
+
+
+@receiver(post_delete, sender=Category)
+def invalidate_deleted_category_feeds(sender, instance, **kwargs):
+    # Its posts are left without a category, which every segment shows.
+    invalidate_segments(('', ''))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author_responses(sender, instance, **kwargs):
+    bump_versions('author')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_responses(sender, instance, **kwargs):
+    bump_versions('category')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_responses(sender, instance, **kwargs):
+    bump_versions('tag')
+
+
+@receiver(pre_save, sender=Comment)
+def remember_comment_approval(sender, instance, **kwargs):
+    instance._was_approved = bool(instance.pk) and Comment.objects.filter(pk=instance.pk, is_approved=True).exists()
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_count(sender, instance, **kwargs):
+    delta = int(instance.is_approved) - int(getattr(instance, '_was_approved', False))
+    adjust_count(Post.objects.filter(pk=instance.post_id), 'approved_comment_count', delta)
+
+
+@receiver(post_delete, sender=Comment)
+def release_comment_count(sender, instance, **kwargs):
+    if instance.is_approved:
+        adjust_count(Post.objects.filter(pk=instance.post_id), 'approved_comment_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_responses(sender, instance, **kwargs):
+    # Comments awaiting moderation are invisible, so they invalidate nothing.
+    if instance.is_approved or getattr(instance, '_was_approved', False):
+        bump_versions('comment', f'post:{instance.post.slug}')
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def export_commented_post(sender, instance, **kwargs):
+    # The post's page shows its approved comments, and its list entries their count.
+    if instance.is_approved or getattr(instance, '_was_approved', False):
+        _queue_export(instance.post_id, membership_changed=False)
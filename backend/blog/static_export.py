@@ -0,0 +1,315 @@
+"""
+Static export of the public blog API.
+
+Published content is rendered with the API serializers into JSON files (and
+a sitemap and RSS feed) under BLOG_STATIC_EXPORT_ROOT, each next to gzip and,
+when the `brotli` module is installed, brotli copies for nginx's
+`gzip_static`/`brotli_static`. A file is only rewritten when its bytes
+change, and writes are atomic renames, so nginx never serves a partial file.
+
+The full export renders everything and removes files nothing produces any
+more, looking only inside its own subtrees (EXPORT_DIRS) so nothing else
+kept under the root is touched; `export_post` re-renders only the pages a single post change can
+affect. Post counts embedded in other posts' pages (author, category and tag
+summaries) are left to the next full export.
+
+Nothing is exported on the request path. Signal handlers queue a
+StaticExportJob with the transaction that made the change, and the
+`export_blog_static --loop` process drains the queue, keeping a batch's jobs
+locked while it exports and deleting them only once the export succeeded:
+duplicate jobs collapse, a full-export job (author, category and tag edits) replaces the
+post jobs in its batch, and the sitemap and RSS feed are rebuilt once per
+batch. The same process runs a full export every
+BLOG_STATIC_EXPORT_FULL_INTERVAL, which also repairs whatever a failed job
+left behind.
+"""
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from email.utils import format_datetime
+from pathlib import Path
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from .categories import build_category_tree
+from .models import Category, Post, StaticExportJob, Tag
+from .serializers import CategorySerializer, PostDetailSerializer, PostListSerializer, TagSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('api')
+
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+# Directories the exporter owns outright; the only places a full export prunes.
+EXPORT_DIRS = ('posts', 'categories', 'tags')
+RSS_ITEMS = 20
+
+
+def _json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _xml(root):
+    return ElementTree.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+class StaticExporter:
+    def __init__(self, root=None, page_size=None):
+        self.root = Path(root or settings.BLOG_STATIC_EXPORT_ROOT)
+        self.base_url = settings.BLOG_STATIC_EXPORT_URL.rstrip('/')
+        self.page_size = page_size or settings.BLOG_STATIC_EXPORT_PAGE_SIZE
+        self.written = set()
+        self.changed = 0
+
+    # -- files ---------------------------------------------------------------
+
+    def write(self, relative_path, data):
+        path = self.root / relative_path
+        self.written.add(path)
+        if path.exists() and path.read_bytes() == data:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._replace(path, data)
+        # mtime=0 keeps the gzip bytes stable for identical content.
+        self._replace(path.with_name(path.name + '.gz'), gzip.compress(data, 9, mtime=0))
+        if brotli is not None:
+            self._replace(path.with_name(path.name + '.br'), brotli.compress(data))
+        self.changed += 1
+
+    def remove(self, relative_path):
+        path = self.root / relative_path
+        for candidate in (path, *(path.with_name(path.name + suffix) for suffix in COMPRESSED_SUFFIXES)):
+            if candidate.exists():
+                candidate.unlink()
+                self.changed += 1
+
+    def _replace(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+    def url(self, relative_path):
+        return f'{self.base_url}/{relative_path}'
+
+    # -- pages ---------------------------------------------------------------
+
+    def list_path(self, prefix, number):
+        return f'{prefix}/page/{number}.json'
+
+    def export_list(self, prefix, posts, first_page=1, last_page=None):
+        """Write pages first_page..last_page of `posts`; drop pages past the end."""
+        count = posts.count()
+        pages = max(1, -(-count // self.page_size))
+        last_page = min(last_page or pages, pages)
+        for number in range(first_page, last_page + 1):
+            start = (number - 1) * self.page_size
+            page = posts.for_listing()[start:start + self.page_size]
+            self.write(self.list_path(prefix, number), _json({
+                'count': count,
+                'next': self.url(self.list_path(prefix, number + 1)) if number < pages else None,
+                'previous': self.url(self.list_path(prefix, number - 1)) if number > 1 else None,
+                'results': PostListSerializer(page, many=True).data,
+            }))
+        if last_page == pages:
+            number = pages + 1
+            while (self.root / self.list_path(prefix, number)).exists():
+                self.remove(self.list_path(prefix, number))
+                number += 1
+
+    def export_post_detail(self, post):
+        self.write(f'posts/{post.slug}.json', _json(PostDetailSerializer(post).data))
+
+    def export_indexes(self):
+        categories = Category.objects.all()
+        tags = Tag.objects.all()
+        self.write('categories.json', _json(CategorySerializer(categories, many=True).data))
+        self.write('categories-tree.json', _json(build_category_tree()))
+        self.write('tags.json', _json(TagSerializer(tags, many=True).data))
+        for category in categories:
+            self.write(f'categories/{category.slug}.json', _json(CategorySerializer(category).data))
+        for tag in tags:
+            self.write(f'tags/{tag.slug}.json', _json(TagSerializer(tag).data))
+
+    def export_feeds(self):
+        site = settings.SITE_URL
+        published = Post.objects.published().order_by('-published_at')
+
+        urlset = ElementTree.Element('urlset', xmlns='http://www.sitemaps.org/schemas/sitemap/0.9')
+        for slug, updated_at in published.values_list('slug', 'updated_at').iterator():
+            url = ElementTree.SubElement(urlset, 'url')
+            ElementTree.SubElement(url, 'loc').text = f'{site}/blog/{slug}'
+            ElementTree.SubElement(url, 'lastmod').text = updated_at.isoformat()
+        for slug in Category.objects.values_list('slug', flat=True):
+            url = ElementTree.SubElement(urlset, 'url')
+            ElementTree.SubElement(url, 'loc').text = f'{site}/blog/category/{slug}'
+        self.write('sitemap.xml', _xml(urlset))
+
+        rss = ElementTree.Element('rss', version='2.0')
+        channel = ElementTree.SubElement(rss, 'channel')
+        ElementTree.SubElement(channel, 'title').text = settings.SITE_PUBLISHER_NAME
+        ElementTree.SubElement(channel, 'link').text = f'{site}/blog'
+        ElementTree.SubElement(channel, 'description').text = settings.SITE_PUBLISHER_NAME
+        for post in published.select_related('author')[:RSS_ITEMS]:
+            item = ElementTree.SubElement(channel, 'item')
+            link = f'{site}{post.get_absolute_url()}'
+            ElementTree.SubElement(item, 'title').text = post.title
+            ElementTree.SubElement(item, 'link').text = link
+            ElementTree.SubElement(item, 'guid').text = link
+            ElementTree.SubElement(item, 'pubDate').text = format_datetime(post.published_at)
+            ElementTree.SubElement(item, 'author').text = post.author.display_name
+            ElementTree.SubElement(item, 'description').text = post.excerpt
+        self.write('rss.xml', _xml(rss))
+
+    # -- entry points ----------------------------------------------------------
+
+    def export_all(self):
+        """Render every page and delete files that are no longer produced."""
+        published = Post.objects.published().order_by('-published_at', '-pk')
+        for post in published.for_detail().iterator(chunk_size=200):
+            self.export_post_detail(post)
+        self.export_list('posts', published)
+        for category in Category.objects.all():
+            self.export_list(f'categories/{category.slug}', published.filter(category=category))
+        for tag in Tag.objects.all():
+            self.export_list(f'tags/{tag.slug}', published.filter(tags=tag))
+        self.export_indexes()
+        self.export_feeds()
+
+        for directory in EXPORT_DIRS:
+            for dirpath, _, filenames in os.walk(self.root / directory):
+                for name in filenames:
+                    path = Path(dirpath) / name
+                    original = path.with_suffix('') if path.suffix in COMPRESSED_SUFFIXES else path
+                    if original.suffix == '.json' and original not in self.written:
+                        path.unlink()
+                        self.changed += 1
+        return self.changed
+
+    def export_post(self, post_id, slug=None, published_at=None, category_ids=(), tag_ids=(),
+                    membership_changed=True):
+        """
+        Re-render what one post change can affect, except the feeds
+        (`export_feeds`), which callers rebuild once per batch of changes.
+
+        `slug`, `published_at`, `category_ids` and `tag_ids` describe the
+        post before the change (it may be gone by now). Lists are rewritten
+        from the page holding the post; when the post entered or left a list
+        every later page shifts, otherwise that one page is enough.
+        """
+        category_ids = set(category_ids)
+        tag_ids = set(tag_ids)
+        # Whatever the post's status now, the lists it currently belongs to
+        # may have to drop or gain it.
+        category_ids.update(Post.objects.filter(pk=post_id).values_list('category_id', flat=True))
+        tag_ids.update(Post.tags.through.objects.filter(post_id=post_id).values_list('tag_id', flat=True))
+
+        post = Post.objects.published().for_detail().filter(pk=post_id).first()
+        if post is not None:
+            self.export_post_detail(post)
+            published_at = post.published_at
+        if slug and (post is None or post.slug != slug):
+            self.remove(f'posts/{slug}.json')
+        if published_at is None:
+            return self.changed
+
+        published = Post.objects.published().order_by('-published_at', '-pk')
+        lists = [('posts', published)]
+        lists += [(f'categories/{category.slug}', published.filter(category=category))
+                  for category in Category.objects.filter(pk__in=[pk for pk in category_ids if pk])]
+        lists += [(f'tags/{tag.slug}', published.filter(tags=tag))
+                  for tag in Tag.objects.filter(pk__in=tag_ids)]
+        for prefix, posts in lists:
+            newer = posts.filter(published_at__gt=published_at).count()
+            first_page = newer // self.page_size + 1
+            self.export_list(prefix, posts, first_page, None if membership_changed else first_page)
+
+        if membership_changed:
+            self.export_indexes()
+        return self.changed
+
+
+# ----------------------
+# Export queue
+# ----------------------
+def queue_export(post_id=None, **changes):
+    """Queue the pages of one post change (export_post's arguments), or a full export without `post_id`."""
+    if changes.get('published_at') is not None:
+        changes['published_at'] = changes['published_at'].isoformat()
+    StaticExportJob.objects.create(post_pk=post_id, changes=changes)
+
+
+def claim_jobs(batch_size=500):
+    """
+    Lock the oldest queued jobs (SKIP LOCKED, so exporters can run side by
+    side). Call inside a transaction and delete the jobs once exported.
+    """
+    return list(StaticExportJob.objects.select_for_update(skip_locked=True).order_by('pk')[:batch_size])
+
+
+def run_jobs(exporter=None, batch_size=500):
+    """Export one batch of queued jobs; returns the number of jobs handled."""
+    # A failed export rolls back with the jobs still queued.
+    with transaction.atomic():
+        jobs = claim_jobs(batch_size)
+        if not jobs:
+            return 0
+        _export_jobs(exporter or StaticExporter(), jobs)
+        StaticExportJob.objects.filter(pk__in=[job.pk for job in jobs]).delete()
+    return len(jobs)
+
+
+def _export_jobs(exporter, jobs):
+    if any(job.post_pk is None for job in jobs):
+        exporter.export_all()
+        return
+
+    done = set()
+    for job in jobs:
+        key = (job.post_pk, json.dumps(job.changes, sort_keys=True))
+        if key in done:
+            continue
+        done.add(key)
+        changes = dict(job.changes)
+        if changes.get('published_at'):
+            changes['published_at'] = parse_datetime(changes['published_at'])
+        exporter.export_post(job.post_pk, **changes)
+    exporter.export_feeds()
+
+
+def export_everything(exporter=None):
+    """Full export; drops the jobs queued before it started, which it covers."""
+    last_job = StaticExportJob.objects.aggregate(last=Max('pk'))['last']
+    changed = (exporter or StaticExporter()).export_all()
+    if last_job is not None:
+        StaticExportJob.objects.filter(pk__lte=last_job).delete()
+    return changed
+
+
+def run_exporter(poll_interval, full_interval, stop_event=None):
+    """Drain the export queue every `poll_interval` seconds and export everything every `full_interval`."""
+    stop_event = stop_event or threading.Event()
+    last_full = None
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            if last_full is None or time.monotonic() - last_full >= full_interval:
+                last_full = time.monotonic()
+                logger.info(f"Full static export: {export_everything()} files changed")
+            while run_jobs() and not stop_event.is_set():
+                pass
+        except Exception as e:
+            logger.error(f"Static export failed: {str(e)}")
+        stop_event.wait(poll_interval)
@@ -0,0 +1,200 @@
+"""
+Title and tag autocomplete.
+
+Every process keeps a sorted array of normalized keys: each published
+post's title from every word onward ("آموزش کامل مشتق", "کامل مشتق",
+"مشتق") and each tag name. A query is one bisection and a short scan, so
+suggestions never touch the database.
+
+A background thread per process asks the database every SYNC_INTERVAL
+whether anything changed, so a request only ever reads memory: the latest `updated_at` and the number of published posts, and the
+same plus the summed post counts for tags. The cache versions can't be used
+for this, since a per-process cache never sees a save made by another worker,
+the scheduler or the importer. When posts changed it reloads only the posts
+saved since the last sync and drops ids that are no longer published; tags
+are few and are reloaded on every change. Changes are applied to a copy that is swapped
+in when ready, so readers never see a half-updated index. Only the first
+queries of a fresh process wait, briefly, for the initial build.
+"""
+import bisect
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from .models import Post, Tag
+from .search import ZWNJ, normalize
+
+logger = logging.getLogger('api')
+
+SYNC_INTERVAL = 1.0
+# Longest a query waits for a new process's first build before answering from an empty index.
+INITIAL_SYNC_WAIT = 2.0
+# Clock skew allowance between the app servers and the database.
+SYNC_OVERLAP = timedelta(seconds=5)
+# Matches looked at per query before ranking; keeps very short prefixes cheap.
+MAX_SCAN = 200
+MIN_QUERY_LENGTH = 2
+
+
+def suggest_key(text):
+    return ' '.join(normalize(text).replace(ZWNJ, '').split())
+
+
+def word_suffixes(key):
+    words = key.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def post_item(pk, title, slug, view_count):
+    return ('post', pk), {'type': 'post', 'id': pk, 'title': title, 'slug': slug,
+                          'key': suggest_key(title), 'weight': view_count}
+
+
+def tag_item(pk, name, slug, post_count):
+    return ('tag', pk), {'type': 'tag', 'id': pk, 'name': name, 'slug': slug,
+                         'key': suggest_key(name), 'weight': post_count}
+
+
+def fingerprint():
+    """A cheap summary of the indexed rows that changes whenever the index would."""
+    posts = Post.objects.aggregate(
+        latest=Max('updated_at'),
+        published=Count('pk', filter=Q(status='published', published_at__lte=timezone.now())),
+    )
+    tags = Tag.objects.filter(published_post_count__gt=0).aggregate(
+        latest=Max('updated_at'), count=Count('pk'), posts=Sum('published_post_count'),
+    )
+    return {'post': tuple(posts.values()), 'tag': tuple(tags.values())}
+
+
+class SuggestIndex:
+    def __init__(self, background=True):
+        # (sorted [(key, kind, pk)], {(kind, pk): item}), replaced as a whole.
+        self.snapshot = ([], {})
+        self.fingerprint = None
+        self.synced_at = None
+        # Without the background thread, callers run sync() themselves.
+        self.background = background
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    # -- reading -----------------------------------------------------------
+
+    def suggest(self, query, limit):
+        prefix = suggest_key(query)
+        if len(prefix) < MIN_QUERY_LENGTH:
+            return []
+        if self.background:
+            self._start()
+            self._ready.wait(INITIAL_SYNC_WAIT)
+        keys, items = self.snapshot
+        start = bisect.bisect_left(keys, (prefix,))
+        found = {}
+        for key, kind, pk in keys[start:start + MAX_SCAN]:
+            if not key.startswith(prefix):
+                break
+            item = items[(kind, pk)]
+            # Matches at the start of the title rank first, then popularity.
+            rank = (key == item['key'], item['weight'])
+            found[(kind, pk)] = max(rank, found.get((kind, pk), rank))
+        best = sorted(found, key=found.get, reverse=True)[:limit]
+        return [{k: v for k, v in items[ref].items() if k not in ('key', 'weight')} for ref in best]
+
+    # -- syncing -----------------------------------------------------------
+
+    def _start(self):
+        # Threads don't survive a fork; each worker process starts its own.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='suggest-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            close_old_connections()
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Suggest index sync failed: {str(e)}")
+            finally:
+                close_old_connections()
+                self._ready.set()
+            self._stopped.wait(SYNC_INTERVAL)
+
+    def sync(self):
+        with self._lock:
+            synced_at = timezone.now()
+            current = fingerprint()
+            if current == self.fingerprint:
+                return
+            if self.fingerprint is None:
+                self.rebuild()
+            else:
+                # Tag post counts move with posts; tags are few, reload them too.
+                self.update(posts=current['post'] != self.fingerprint['post'])
+            self.fingerprint, self.synced_at = current, synced_at
+
+    def rebuild(self):
+        items = dict(post_item(*row) for row in
+                     Post.objects.published().values_list('pk', 'title', 'slug', 'view_count'))
+        items.update(self._tags())
+        keys = sorted((suffix, kind, pk) for (kind, pk), item in items.items()
+                      for suffix in word_suffixes(item['key']))
+        self.snapshot = (keys, items)
+
+    def update(self, posts=True):
+        keys, items = self.snapshot
+        changed = {}
+        if posts:
+            published = Post.objects.published()
+            saved = published.filter(updated_at__gte=self.synced_at - SYNC_OVERLAP)
+            changed.update(post_item(*row) for row in saved.values_list('pk', 'title', 'slug', 'view_count'))
+            live = set(published.values_list('pk', flat=True))
+            changed.update({ref: None for ref in items if ref[0] == 'post' and ref[1] not in live})
+        fresh = self._tags()
+        changed.update(fresh)
+        changed.update({ref: None for ref in items if ref[0] == 'tag' and ref not in fresh})
+
+        keys, items = list(keys), dict(items)
+        for ref, item in changed.items():
+            if items.get(ref) == item:
+                continue
+            old = items.pop(ref, None)
+            if old is not None:
+                for suffix in word_suffixes(old['key']):
+                    del keys[bisect.bisect_left(keys, (suffix, *ref))]
+            if item is not None:
+                items[ref] = item
+                for suffix in word_suffixes(item['key']):
+                    bisect.insort(keys, (suffix, *ref))
+        self.snapshot = (keys, items)
+
+    def _tags(self):
+        return dict(tag_item(*row) for row in Tag.objects.filter(published_post_count__gt=0).values_list(
+            'pk', 'name', 'slug', 'published_post_count'))
+
+
+suggest_index = SuggestIndex()
+
+
+def suggest(query, limit=None):
+    return suggest_index.suggest(query, limit or settings.BLOG_SUGGEST_LIMIT)
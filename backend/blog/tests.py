@@ -0,0 +1,1024 @@
+import json
+import math
+import tempfile
+import threading
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.test import SimpleTestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from api.models import StudentProfile
+
+from .content import compile_content
+from .counters import ViewCountBuffer
+from .feed import FIELDS, SEGMENTS, Feed, build_segment, segment_candidates, segments_reaching
+from .hll import REGISTERS, HyperLogLog, register_update, visitor_hash
+from .models import (
+    Author, Category, Comment, Post, PostViewBucket, RelatedPost, StaticExportJob, Tag, TrendingScore,
+)
+from .related import WEIGHT_CATEGORY, WEIGHT_SEGMENT, WEIGHT_TAGS, RelatedPostsEngine
+from .scheduling import next_due_at, publish_due_posts, run_scheduler
+from .structured_data import revision, stored_structured_data
+from .suggest import SuggestIndex
+from .trending import MAX_GAP, WINDOWS, TrendingUpdater
+from .visitors import store_visitor_updates
+
+User = get_user_model()
+
+
+class BlogDataMixin:
+    """Three authors, a category with two children, four tags and twenty published posts."""
+    post_count = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            Author.objects.create(user=User.objects.create_user(email=f'author{i}@example.com', password='x'),
+                                  display_name=f'نویسنده {i}')
+            for i in range(3)
+        ]
+        root = Category.objects.create(name='ریاضی', grade='12', field='riazi')
+        cls.categories = [root] + [
+            Category.objects.create(name=f'فصل {i}', parent=root, grade='11', field='tajrobi') for i in range(2)
+        ]
+        cls.tags = [Tag.objects.create(name=f'برچسب {i}') for i in range(4)]
+        now = timezone.now()
+        cls.posts = []
+        for i in range(cls.post_count):
+            post = Post.objects.create(
+                title=f'پست شماره {i}', excerpt='خلاصه', content='متن ' * (50 + i),
+                author=cls.authors[i % 3], category=cls.categories[i % 3], status='published',
+                published_at=now - timedelta(hours=i + 1),
+            )
+            post.tags.set(cls.tags[:i % 4 + 1])
+            for _ in range(i % 3):
+                comment = Comment.objects.create(post=post, content='نظر', name='خواننده', is_approved=True)
+                Comment.objects.create(post=post, parent=comment, content='پاسخ', name='نویسنده', is_approved=True)
+            cls.posts.append(post)
+
+    def setUp(self):
+        # Responses are cached; every test starts cold.
+        cache.clear()
+
+
+class ListingQueryCountTests(BlogDataMixin, APITestCase):
+    """Listings cost a fixed number of queries however many posts, tags and comments they show."""
+
+    def assertQueries(self, url, expected):
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list(self):
+        # count, page, tags
+        data = self.assertQueries('/api/blog/posts/', 3)
+        self.assertEqual(data['count'], self.post_count)
+        self.assertEqual(len(data['results']), 12)
+
+    def test_list_counts_match_the_database(self):
+        data = self.assertQueries('/api/blog/posts/?page_size=100', 3)
+        for item in data['results']:
+            post = Post.objects.get(pk=item['id'])
+            self.assertEqual(item['comment_count'], post.comments.filter(is_approved=True).count())
+            self.assertEqual(item['author']['post_count'], post.author.posts.filter(status='published').count())
+            self.assertEqual(len(item['tags']), post.tags.count())
+
+    def test_popular(self):
+        self.assertEqual(len(self.assertQueries('/api/blog/posts/popular/', 2)), 10)
+
+    def test_recent(self):
+        self.assertEqual(len(self.assertQueries('/api/blog/posts/recent/', 2)), 10)
+
+    def test_category_posts(self):
+        # category, count, page, tags
+        data = self.assertQueries(f'/api/blog/categories/{self.categories[0].slug}/posts/', 4)
+        self.assertEqual(data['count'], 7)
+
+    def test_tag_posts(self):
+        data = self.assertQueries(f'/api/blog/tags/{self.tags[0].slug}/posts/', 4)
+        self.assertEqual(data['count'], self.post_count)
+
+    def test_author_posts(self):
+        data = self.assertQueries(f'/api/blog/authors/{self.authors[0].pk}/posts/', 4)
+        self.assertEqual(data['count'], 7)
+
+
+class SearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(user=User.objects.create_user(email='writer@example.com', password='x'),
+                                       display_name='نویسنده')
+        published_at = timezone.now() - timedelta(days=1)
+
+        def post(title, content, **fields):
+            return Post.objects.create(title=title, content=content, excerpt='خلاصه', author=author,
+                                       status='published', published_at=published_at, **fields)
+
+        cls.in_title = post('آموزش فیزیک', 'مرور فصل اول')
+        cls.in_content = post('مرور فصل اول', 'نکته‌های فیزیک و فیزیک و فیزیک')
+        cls.both_terms = post('فیزیک هسته‌ای', 'تمرین‌های هسته و اتم')
+        cls.unrelated = post('شیمی آلی', 'واکنش‌ها')
+        cls.draft = Post.objects.create(title='فیزیک پیش‌نویس', content='فیزیک', author=author, status='draft')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        response = self.client.get('/api/blog/posts/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_tokenize_normalizes_persian_text(self):
+        from .search import tokenize
+        # Arabic ye/kaf, Persian digits and the ZWNJ joined and split forms; stopwords are dropped.
+        self.assertEqual(tokenize('كتاب‌هاي ۱۲ و فيزيك'), ['کتابهای', 'کتاب', '12', 'فیزیک'])
+
+    def test_title_match_outranks_body_match(self):
+        ids = [item['id'] for item in self.search('فیزیک')['results']]
+        self.assertLess(ids.index(self.in_title.pk), ids.index(self.in_content.pk))
+        self.assertNotIn(self.unrelated.pk, ids)
+        self.assertNotIn(self.draft.pk, ids)
+
+    def test_more_matched_terms_rank_first(self):
+        results = self.search('فیزیک هسته')['results']
+        self.assertEqual(results[0]['id'], self.both_terms.pk)
+        self.assertEqual(len(results), 3)
+
+    def test_arabic_spelling_and_snippet(self):
+        data = self.search('فيزيك')
+        self.assertEqual(data['count'], 3)
+        snippets = {item['id']: item['snippet'] for item in data['results']}
+        self.assertEqual(snippets[self.in_content.pk].count('<mark>'), 3)
+        self.assertEqual(snippets[self.in_title.pk], 'خلاصه')
+
+    def test_tags_are_indexed(self):
+        self.unrelated.tags.add(Tag.objects.create(name='فیزیک'))
+        ids = [item['id'] for item in self.search('فیزیک')['results']]
+        self.assertIn(self.unrelated.pk, ids)
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/api/blog/posts/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/blog/posts/search/', {'q': 'و از'}).status_code, 400)
+
+
+class KeysetPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(user=User.objects.create_user(email='keyset@example.com', password='x'),
+                                       display_name='نویسنده')
+        now = timezone.now()
+        # Pairs of posts share a publish time, so the id tiebreak matters.
+        cls.posts = [
+            Post.objects.create(title=f'پست {i}', content='متن', author=author, status='published',
+                                published_at=now - timedelta(hours=i // 2))
+            for i in range(25)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, page_size):
+        data = self.get('/api/blog/posts/', pagination='cursor', page_size=page_size)
+        pages = [data]
+        while data['next']:
+            data = self.get(data['next'])
+            pages.append(data)
+        return pages
+
+    def test_pages_cover_every_post_once_in_order(self):
+        pages = self.walk(page_size=4)
+        self.assertEqual(len(pages), 7)
+        ids = [item['id'] for page in pages for item in page['results']]
+        expected = sorted(self.posts, key=lambda post: (post.published_at, post.pk), reverse=True)
+        self.assertEqual(ids, [post.pk for post in expected])
+        self.assertIsNone(pages[0]['previous'])
+        self.assertTrue(all(page['count'] == 25 for page in pages))
+
+    def test_previous_returns_the_page_before(self):
+        pages = self.walk(page_size=4)
+        for before, page in zip(pages, pages[1:]):
+            self.assertEqual(self.get(page['previous'])['results'], before['results'])
+
+    def test_deep_pages_cost_the_same_queries(self):
+        first = self.get('/api/blog/posts/', pagination='cursor', page_size=4)
+        last = self.walk(page_size=4)[-2]
+        cache.clear()
+        with self.assertNumQueries(3):
+            self.client.get('/api/blog/posts/', {'pagination': 'cursor', 'page_size': 4})
+        cache.clear()
+        with self.assertNumQueries(3):
+            self.client.get(last['next'])
+        self.assertNotEqual(first['results'], last['results'])
+
+    def test_count_can_be_skipped(self):
+        data = self.get('/api/blog/posts/', pagination='cursor', count='false')
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 12)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/blog/posts/', {'cursor': 'not-a-cursor'}).status_code, 404)
+
+
+class ContentCompilerTests(SimpleTestCase):
+    def test_headings_keep_their_attributes(self):
+        compiled = compile_content('<h2 dir="rtl">سلام دنیا</h2><p>متن</p><h3 lang="fa" id="old">بخش دوم</h3>')
+        self.assertIn('<h2 dir="rtl" id="سلام-دنیا">سلام دنیا</h2>', compiled['html'])
+        self.assertIn('<h3 lang="fa" id="بخش-دوم">بخش دوم</h3>', compiled['html'])
+        self.assertEqual([entry['id'] for entry in compiled['toc']], ['سلام-دنیا', 'بخش-دوم'])
+
+    def test_markdown_headings(self):
+        compiled = compile_content('## اول\n\nمتن\n\n## اول\n')
+        self.assertEqual([entry['id'] for entry in compiled['toc']], ['اول', 'اول-1'])
+
+
+class SuggestTests(BlogDataMixin, APITestCase):
+    post_count = 3
+
+    def setUp(self):
+        super().setUp()
+        self.index = SuggestIndex(background=False)
+
+    def titles(self, query):
+        self.index.sync()
+        return [item.get('title') or item.get('name') for item in self.index.suggest(query, 10)]
+
+    def test_queries_only_read_memory(self):
+        self.index.sync()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.index.suggest('پست', 10)), 3)
+
+    def test_prefix_of_any_word(self):
+        self.assertEqual(sorted(self.titles('شماره')), ['پست شماره 0', 'پست شماره 1', 'پست شماره 2'])
+        self.assertEqual(self.titles('برچسب 2'), ['برچسب 2'])
+
+    def test_sees_changes_made_by_other_processes(self):
+        # Writes through the queryset skip the signals and the cache versions,
+        # like a save in another worker with its own cache.
+        self.titles('شماره')
+        Post.objects.filter(pk=self.posts[0].pk).update(title='انتگرال', updated_at=timezone.now())
+        Post.objects.filter(pk=self.posts[1].pk).update(status='draft')
+        Tag.objects.filter(pk=self.tags[2].pk).update(name='هندسه', updated_at=timezone.now())
+        self.assertEqual(self.titles('شماره'), ['پست شماره 2'])
+        self.assertEqual(self.titles('انتگ'), ['انتگرال'])
+        self.assertEqual(self.titles('هند'), ['هندسه'])
+
+        rebuilt = SuggestIndex()
+        rebuilt.rebuild()
+        self.assertEqual(rebuilt.snapshot, self.index.snapshot)
+
+
+class SuggestSyncThreadTests(TransactionTestCase):
+    def test_background_thread_builds_and_refreshes_the_index(self):
+        author = Author.objects.create(user=User.objects.create_user(email='author@example.com', password='x'),
+                                       display_name='نویسنده')
+        post = Post.objects.create(title='آموزش مشتق', excerpt='خلاصه', content='متن', author=author,
+                                   status='published', published_at=timezone.now() - timedelta(minutes=1))
+        index = SuggestIndex()
+        self.addCleanup(index.stop)
+        # The first query waits for the initial build; none of it runs on this thread.
+        with self.assertNumQueries(0):
+            self.assertEqual([item['id'] for item in index.suggest('مشتق', 10)], [post.pk])
+        self.assertNotEqual(index._thread.ident, threading.get_ident())
+
+
+class ImporterTests(APITestCase):
+    def test_new_tags_get_free_slugs(self):
+        from .importer import PostImporter
+
+        author = Author.objects.create(user=User.objects.create_user(email='importer@example.com', password='x'),
+                                       display_name='نویسنده')
+        Tag.objects.create(name='قدیمی', slug='c')
+        records = [
+            {'title': 'اول', 'content': 'متن', 'author': author.pk, 'status': 'published', 'tags': 'C++, C'},
+            {'title': 'دوم', 'content': 'متن', 'author': author.pk, 'status': 'published', 'tags': ['C#', 'قدیمی']},
+        ]
+        importer = PostImporter().run(records)
+        self.assertEqual((importer.imported, importer.errors), (2, []))
+        slugs = dict(Tag.objects.values_list('name', 'slug'))
+        self.assertEqual(slugs['قدیمی'], 'c')
+        self.assertEqual(sorted(slugs[name] for name in ('C', 'C#', 'C++')), ['c-1', 'c-2', 'c-3'])
+        self.assertEqual(Tag.objects.get(name='C++').published_post_count, 1)
+        self.assertEqual(Tag.objects.get(name='قدیمی').published_post_count, 1)
+
+
+class CategoryTreeTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_tree_and_a_category_named_tree(self):
+        root = Category.objects.create(name='درخت', slug='tree')
+        Category.objects.create(name='شاخه', parent=root)
+        detail = self.client.get('/api/blog/categories/tree/')
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.json()['id'], root.pk)
+        with self.assertNumQueries(1):
+            tree = self.client.get('/api/blog/categories-tree/').json()
+        self.assertEqual([node['slug'] for node in tree], ['tree'])
+        self.assertEqual(len(tree[0]['children']), 1)
+
+
+class StaticExportTests(BlogDataMixin, APITestCase):
+    post_count = 5
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = Path(root.name)
+        settings = override_settings(BLOG_STATIC_EXPORT_ENABLED=True, BLOG_STATIC_EXPORT_ROOT=root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def load(self, relative_path):
+        return json.loads((self.root / relative_path).read_bytes())
+
+    def test_changes_are_queued_not_exported(self):
+        from .static_export import run_jobs
+
+        post = self.posts[0]
+        post.title = 'عنوان تازه'
+        post.save()
+        post.save()
+        self.assertFalse((self.root / f'posts/{post.slug}.json').exists())
+        self.assertEqual(StaticExportJob.objects.count(), 2)
+
+        self.assertEqual(run_jobs(), 2)
+        self.assertEqual(self.load(f'posts/{post.slug}.json')['title'], 'عنوان تازه')
+        self.assertTrue((self.root / 'sitemap.xml').exists())
+        self.assertFalse(StaticExportJob.objects.exists())
+
+    def test_comment_approval_reexports_the_post(self):
+        from .static_export import export_everything, run_jobs
+
+        export_everything()
+        post = self.posts[0]
+        comment = Comment.objects.create(post=post, content='نظر تازه', name='خواننده')
+        self.assertFalse(StaticExportJob.objects.exists())
+        comment.is_approved = True
+        comment.save()
+        run_jobs()
+        detail = self.load(f'posts/{post.slug}.json')
+        self.assertIn('نظر تازه', [item['content'] for item in detail['comments']])
+        listed = {item['id']: item for item in self.load('posts/page/1.json')['results']}
+        self.assertEqual(listed[post.pk]['comment_count'], post.comments.filter(is_approved=True).count())
+
+    def test_summary_edits_queue_a_full_export(self):
+        from .static_export import run_jobs
+
+        tag = self.tags[0]
+        tag.name = 'نام تازه'
+        tag.save()
+        self.assertTrue(StaticExportJob.objects.filter(post_pk=None).exists())
+        run_jobs()
+        tags = {item['slug']: item['name'] for item in self.load('tags.json')}
+        self.assertEqual(tags[tag.slug], 'نام تازه')
+        post = Post.objects.published().filter(tags=tag).first()
+        detail = self.load(f'posts/{post.slug}.json')
+        self.assertIn('نام تازه', [item['name'] for item in detail['tags']])
+
+    def test_full_export_prunes_only_its_own_files(self):
+        from .static_export import export_everything
+
+        stale = self.root / 'posts' / 'gone.json'
+        foreign = [self.root / 'robots.txt', self.root / 'assets' / 'logo.png', self.root / 'posts' / 'README']
+        for path in (stale, stale.with_name('gone.json.gz'), *foreign):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b'x')
+        export_everything()
+        self.assertFalse(stale.exists())
+        self.assertFalse(stale.with_name('gone.json.gz').exists())
+        self.assertTrue(all(path.exists() for path in foreign))
+        self.assertTrue((self.root / f'posts/{self.posts[0].slug}.json').exists())
+
+
+class VisitorKeyTests(APITestCase):
+    def key(self, **meta):
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import RequestFactory
+        from .visitors import visitor_key
+
+        request = RequestFactory().get('/', REMOTE_ADDR='172.18.0.5', **meta)
+        request.user = AnonymousUser()
+        return visitor_key(request)
+
+    def test_readers_behind_the_proxy_are_told_apart(self):
+        self.assertEqual(self.key(HTTP_X_REAL_IP='5.1.1.1'), 'ip:5.1.1.1')
+        self.assertNotEqual(self.key(HTTP_X_REAL_IP='5.1.1.1'), self.key(HTTP_X_REAL_IP='5.2.2.2'))
+        self.assertEqual(self.key(HTTP_X_FORWARDED_FOR='5.3.3.3, 10.0.0.1'), 'ip:5.3.3.3')
+        self.assertEqual(self.key(), 'ip:172.18.0.5')
+
+
+class ExportQueueTests(TransactionTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(BLOG_STATIC_EXPORT_ROOT=root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_claims_take_the_oldest_jobs(self):
+        from .static_export import claim_jobs, queue_export
+
+        for post_pk in (1, 2, 3):
+            queue_export(post_pk, membership_changed=False)
+        with transaction.atomic():
+            self.assertEqual([job.post_pk for job in claim_jobs(batch_size=2)], [1, 2])
+
+    def test_jobs_are_deleted_only_after_a_successful_export(self):
+        from .static_export import StaticExporter, queue_export, run_jobs
+
+        for post_pk in (1, 2, 3):
+            queue_export(post_pk, membership_changed=False)
+        with mock.patch.object(StaticExporter, 'export_feeds', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                run_jobs(batch_size=2)
+        self.assertEqual(list(StaticExportJob.objects.values_list('post_pk', flat=True)), [1, 2, 3])
+
+        self.assertEqual(run_jobs(batch_size=2), 2)
+        self.assertEqual(list(StaticExportJob.objects.values_list('post_pk', flat=True)), [3])
+        self.assertEqual(run_jobs(batch_size=2), 1)
+        self.assertEqual(run_jobs(), 0)
+
+    @skipUnlessDBFeature('has_select_for_update_skip_locked')
+    def test_exporters_skip_jobs_locked_by_another(self):
+        from .static_export import claim_jobs, queue_export
+
+        queue_export(1, membership_changed=False)
+        queue_export(2, membership_changed=False)
+        locked, release = threading.Event(), threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    list(StaticExportJob.objects.select_for_update().filter(post_pk=1))
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        self.assertTrue(locked.wait(10))
+        try:
+            with transaction.atomic():
+                claimed = claim_jobs()
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual([job.post_pk for job in claimed], [2])
+
+
+class ViewCountBufferTests(BlogDataMixin, APITestCase):
+    post_count = 3
+
+    def setUp(self):
+        super().setUp()
+        self.buffer = ViewCountBuffer(flush_interval=3600, max_pending=100, background=False)
+
+    def view_counts(self):
+        return [Post.objects.get(pk=post.pk).view_count for post in self.posts]
+
+    def test_views_are_written_on_flush_only(self):
+        for post in (self.posts[0], self.posts[0], self.posts[1]):
+            self.buffer.record(post.pk)
+        self.assertEqual(self.view_counts(), [0, 0, 0])
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.view_counts(), [2, 1, 0])
+        self.assertEqual(
+            dict(PostViewBucket.objects.values_list('post_id', 'views')), {self.posts[0].pk: 2, self.posts[1].pk: 1}
+        )
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_posts_with_equal_deltas_share_an_update(self):
+        for post in self.posts:
+            self.buffer.record(post.pk)
+        self.buffer.record(self.posts[0].pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.buffer.flush()
+        post_updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "blog_post"')]
+        self.assertEqual(len(post_updates), 2)  # +2 for one post, +1 for the other two
+        self.assertEqual(self.view_counts(), [2, 1, 1])
+
+    def test_failed_flush_is_requeued(self):
+        self.buffer.record(self.posts[0].pk)
+        self.buffer.record(self.posts[0].pk, visitor=(3, 5))
+        with mock.patch.object(PostViewBucket.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.view_counts(), [0, 0, 0])
+        self.buffer.record(self.posts[0].pk)
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.view_counts(), [3, 0, 0])
+
+
+class SignallingBuffer(ViewCountBuffer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.flushed = threading.Event()
+
+    def flush(self):
+        written = super().flush()
+        if written:
+            self.flushed.set()
+        return written
+
+
+class ViewCountFlushThreadTests(TransactionTestCase):
+    def setUp(self):
+        author = Author.objects.create(user=User.objects.create_user(email='author@example.com', password='x'),
+                                       display_name='نویسنده')
+        self.post = Post.objects.create(title='پست', excerpt='خلاصه', content='متن', author=author,
+                                        status='published', published_at=timezone.now())
+
+    def test_timer_flushes_without_a_request(self):
+        buffer = SignallingBuffer(flush_interval=0.05, max_pending=100)
+        buffer.record(self.post.pk)
+        buffer.record(self.post.pk)
+        self.assertTrue(buffer.flushed.wait(5))
+        self.assertEqual(Post.objects.get(pk=self.post.pk).view_count, 2)
+
+    def test_full_buffer_wakes_the_flusher(self):
+        buffer = SignallingBuffer(flush_interval=3600, max_pending=1)
+        buffer.record(self.post.pk)
+        self.assertTrue(buffer.flushed.wait(5))
+        self.assertEqual(Post.objects.get(pk=self.post.pk).view_count, 1)
+
+
+@mock.patch('blog.views.view_count_buffer', ViewCountBuffer(flush_interval=3600, max_pending=100, background=False))
+class ResponseInvalidationTests(BlogDataMixin, APITestCase):
+    post_count = 3
+
+    def detail(self, slug):
+        return self.client.get(f'/api/blog/posts/{slug}/')
+
+    def listed_titles(self):
+        return [item['title'] for item in self.client.get('/api/blog/posts/').json()['results']]
+
+    def test_saved_post_refreshes_detail_and_listing(self):
+        post = self.posts[0]
+        self.detail(post.slug)
+        self.listed_titles()
+        post.title = 'عنوان تازه'
+        post.save()
+        self.assertEqual(self.detail(post.slug).json()['title'], 'عنوان تازه')
+        self.assertIn('عنوان تازه', self.listed_titles())
+
+    def test_renamed_slug_stops_serving_the_old_detail(self):
+        post = self.posts[0]
+        old_slug = post.slug
+        self.assertEqual(self.detail(old_slug).status_code, 200)
+        post.slug = 'slug-taze'
+        post.save()
+        self.assertEqual(self.detail(old_slug).status_code, 404)
+        self.assertEqual(self.detail('slug-taze').status_code, 200)
+
+    def test_related_post_changes_refresh_the_referencing_detail(self):
+        post, related = self.posts[0], self.posts[1]
+        post.related_posts.set([related])
+        self.assertEqual([p['title'] for p in self.detail(post.slug).json()['related_posts']], [related.title])
+        related.title = 'عنوان تازه'
+        related.save()
+        self.assertEqual([p['title'] for p in self.detail(post.slug).json()['related_posts']], ['عنوان تازه'])
+        related.status = 'draft'
+        related.save()
+        self.assertEqual(self.detail(post.slug).json()['related_posts'], [])
+
+
+@override_settings(BLOG_COMMENT_MAX_DEPTH=2, BLOG_COMMENT_REPLIES_PAGE_SIZE=3)
+@mock.patch('blog.views.view_count_buffer', ViewCountBuffer(flush_interval=3600, max_pending=100, background=False))
+class CommentTreeTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(user=User.objects.create_user(email='author@example.com', password='x'),
+                                       display_name='نویسنده')
+        cls.post = Post.objects.create(title='پست', excerpt='خلاصه', content='متن', author=author,
+                                       status='published', published_at=timezone.now() - timedelta(hours=1))
+
+        created = iter(timezone.now() - timedelta(minutes=60 - i) for i in range(60))
+
+        def comment(parent=None, approved=True):
+            # Threads list newest first; pin the timestamps so the order is exact.
+            comment = Comment.objects.create(post=cls.post, parent=parent, content='نظر', name='خواننده',
+                                             is_approved=approved)
+            Comment.objects.filter(pk=comment.pk).update(created_at=next(created))
+            return comment
+
+        # A chain five levels deep under the first root, and five replies under the second.
+        cls.chain = [comment()]
+        for _ in range(4):
+            cls.chain.append(comment(cls.chain[-1]))
+        cls.busy = comment()
+        cls.replies = [comment(cls.busy) for _ in range(5)]
+        comment(cls.busy, approved=False)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_detail_nests_replies_to_the_depth_limit(self):
+        with CaptureQueriesContext(connection) as queries:
+            comments = self.client.get(f'/api/blog/posts/{self.post.slug}/').json()['comments']
+        comment_queries = [q for q in queries.captured_queries if 'FROM "blog_comment"' in q['sql']]
+        self.assertEqual(len(comment_queries), 1)
+        self.assertEqual([c['id'] for c in comments], [self.busy.pk, self.chain[0].pk])
+        level1 = comments[1]['replies']
+        level2 = level1[0]['replies']
+        self.assertEqual([c['id'] for c in level1], [self.chain[1].pk])
+        self.assertEqual([c['id'] for c in level2], [self.chain[2].pk])
+        # The third level is cut off, but its count tells the client to fetch it.
+        self.assertEqual(level2[0]['replies'], [])
+        self.assertEqual(level2[0]['reply_count'], 1)
+
+    def test_detail_shows_the_first_page_of_approved_replies(self):
+        busy = self.client.get(f'/api/blog/posts/{self.post.slug}/').json()['comments'][0]
+        self.assertEqual(busy['reply_count'], 5)
+        self.assertEqual([c['id'] for c in busy['replies']], [c.pk for c in self.replies[:1:-1]])
+
+    def test_replies_are_paged_through_the_comments_action(self):
+        url = f'/api/blog/posts/{self.post.slug}/comments/'
+        page = self.client.get(url, {'parent': self.busy.pk, 'page_size': 3, 'page': 2}).json()
+        self.assertEqual(page['count'], 5)
+        self.assertEqual([c['id'] for c in page['results']], [c.pk for c in self.replies[1::-1]])
+
+        deeper = self.client.get(url, {'parent': self.chain[2].pk}).json()
+        self.assertEqual([c['id'] for c in deeper['results']], [self.chain[3].pk])
+        self.assertEqual([c['id'] for c in deeper['results'][0]['replies']], [self.chain[4].pk])
+        self.assertEqual(self.client.get(url, {'parent': 'x'}).status_code, 400)
+
+
+@mock.patch('blog.views.view_count_buffer', ViewCountBuffer(flush_interval=3600, max_pending=100, background=False))
+class StructuredDataTests(BlogDataMixin, APITestCase):
+    post_count = 2
+
+    def detail(self, post):
+        return self.client.get(f'/api/blog/posts/{post.slug}/').json()
+
+    def test_saved_post_stores_data_for_its_revision(self):
+        post = Post.objects.get(pk=self.posts[0].pk)
+        self.assertEqual(post.structured_data['revision'], revision(post))
+        self.assertEqual(stored_structured_data(post), post.structured_data)
+        self.assertEqual(post.structured_data['schema_markup']['headline'], post.title)
+
+    def test_detail_serves_the_stored_blob_while_it_is_current(self):
+        post = Post.objects.get(pk=self.posts[0].pk)
+        data = {**post.structured_data, 'schema_markup': {'stored': True}}
+        Post.objects.filter(pk=post.pk).update(structured_data=data)
+        self.assertEqual(self.detail(post)['schema_markup'], {'stored': True})
+
+    def test_stale_revision_falls_back_to_live_rendering(self):
+        post = Post.objects.get(pk=self.posts[0].pk)
+        data = {**post.structured_data, 'schema_markup': {'stored': True}}
+        # A queryset update moves the revision on without re-rendering.
+        Post.objects.filter(pk=post.pk).update(structured_data=data, title='عنوان تازه',
+                                               updated_at=post.updated_at + timedelta(seconds=1))
+        post.refresh_from_db()
+        self.assertIsNone(stored_structured_data(post))
+        self.assertEqual(self.detail(post)['schema_markup']['headline'], 'عنوان تازه')
+
+    def test_author_change_rerenders_their_posts(self):
+        author = self.posts[0].author
+        author.display_name = 'نام تازه'
+        author.save()
+        post = Post.objects.get(pk=self.posts[0].pk)
+        self.assertEqual(post.structured_data['schema_markup']['author']['name'], 'نام تازه')
+        self.assertIsNotNone(stored_structured_data(post))
+
+
+class ScheduledPublishingTests(BlogDataMixin, APITestCase):
+    post_count = 2
+
+    def schedule(self, title, due_in):
+        return Post.objects.create(title=title, excerpt='خلاصه', content='متن', author=self.authors[0],
+                                   category=self.categories[0], status='scheduled',
+                                   published_at=timezone.now() + due_in)
+
+    def listed_titles(self):
+        return [item['title'] for item in self.client.get('/api/blog/posts/').json()['results']]
+
+    def test_due_posts_are_published_and_listed(self):
+        due = self.schedule('پست موعد رسیده', timedelta(minutes=-1))
+        later = self.schedule('پست آینده', timedelta(hours=1))
+        self.assertEqual(next_due_at(), due.published_at)
+        self.assertNotIn(due.title, self.listed_titles())
+
+        self.assertEqual(publish_due_posts(), [due])
+        self.assertEqual(Post.objects.get(pk=due.pk).status, 'published')
+        self.assertEqual(Post.objects.get(pk=later.pk).status, 'scheduled')
+        self.assertEqual(next_due_at(), later.published_at)
+        # The cached listing above is superseded by the publish.
+        self.assertIn(due.title, self.listed_titles())
+        self.assertNotIn(later.title, self.listed_titles())
+        self.assertEqual(Author.objects.get(pk=self.authors[0].pk).published_post_count,
+                         Post.objects.filter(author=self.authors[0], status='published').count())
+
+    def test_batches_drain_the_whole_due_queue(self):
+        due = [self.schedule(f'پست {i}', timedelta(minutes=-i - 1)) for i in range(5)]
+        self.assertEqual(publish_due_posts(batch_size=2), due[::-1])
+        self.assertIsNone(next_due_at())
+
+    def test_scheduler_loop_publishes_until_stopped(self):
+        due = self.schedule('پست موعد رسیده', timedelta(minutes=-1))
+        with self.assertLogs('api', 'INFO') as logs:
+            run_scheduler(poll_interval=3600, stop_event=OneShotEvent())
+        self.assertEqual(Post.objects.get(pk=due.pk).status, 'published')
+        self.assertIn(due.slug, logs.output[0])
+
+
+class OneShotEvent(threading.Event):
+    """Stops a worker loop after its first pass instead of sleeping."""
+
+    def wait(self, timeout=None):
+        self.set()
+        return True
+
+
+class TrendingTests(BlogDataMixin, APITestCase):
+    post_count = 3
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+    def views(self, post, hours_ago, views, now=None):
+        hour = (now or self.now) - timedelta(hours=hours_ago)
+        bucket, _ = PostViewBucket.objects.get_or_create(post=post, hour=hour)
+        PostViewBucket.objects.filter(pk=bucket.pk).update(views=F('views') + views)
+
+    def scores(self):
+        return {(row.window, row.post_id): row.score for row in TrendingScore.objects.all()}
+
+    def test_first_run_scores_decayed_views(self):
+        self.views(self.posts[0], 0, 10)
+        self.views(self.posts[1], 6, 10)  # one 24h half-life ago
+        self.views(self.posts[2], 30, 10)  # outside the 24h window
+        self.assertEqual(TrendingUpdater(now=self.now).run(), set(WINDOWS))
+        scores = self.scores()
+        self.assertAlmostEqual(scores['24h', self.posts[0].pk], 10)
+        self.assertAlmostEqual(scores['24h', self.posts[1].pk], 5)
+        self.assertNotIn(('24h', self.posts[2].pk), scores)
+        self.assertAlmostEqual(scores['7d', self.posts[2].pk], 10 * 0.5 ** (30 / 42))
+
+    def test_incremental_run_matches_a_full_rebuild(self):
+        self.views(self.posts[0], 23, 8)  # slides out of the 24h window by the next run
+        self.views(self.posts[0], 1, 4)
+        self.views(self.posts[1], 3, 6)
+        TrendingUpdater(now=self.now).run()
+
+        later = self.now + timedelta(hours=2)
+        self.views(self.posts[1], 3, 5)  # more views in an already scored bucket
+        self.views(self.posts[2], 0, 7, now=later)
+        self.assertEqual(TrendingUpdater(now=later).run(), set())
+        advanced = self.scores()
+
+        TrendingUpdater(now=later).run(full=True)
+        rebuilt = self.scores()
+        self.assertEqual(advanced.keys(), rebuilt.keys())
+        for key, score in rebuilt.items():
+            self.assertAlmostEqual(advanced[key], score, msg=key)
+
+    def test_stale_state_is_rebuilt(self):
+        self.views(self.posts[0], 0, 1)
+        TrendingUpdater(now=self.now).run()
+        self.assertEqual(TrendingUpdater(now=self.now + MAX_GAP + timedelta(hours=1)).run(), set(WINDOWS))
+
+
+class FeedTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(user=User.objects.create_user(email='author@example.com', password='x'),
+                                           display_name='نویسنده')
+        categories = {
+            'riazi-12': Category.objects.create(name='ریاضی دوازدهم', grade='12', field='riazi'),
+            'riazi-konkur': Category.objects.create(name='کنکور ریاضی', grade='konkur', field='riazi'),
+            '12': Category.objects.create(name='دوازدهم', grade='12'),
+            'riazi': Category.objects.create(name='ریاضی', field='riazi'),
+            'general': Category.objects.create(name='عمومی'),
+            'tajrobi-12': Category.objects.create(name='تجربی دوازدهم', grade='12', field='tajrobi'),
+            'riazi-10': Category.objects.create(name='ریاضی دهم', grade='10', field='riazi'),
+        }
+        now = timezone.now()
+        cls.posts = {
+            name: cls.publish(name, category, now - timedelta(hours=i + 1))
+            for i, (name, category) in enumerate([*categories.items(), ('uncategorized', None)])
+        }
+
+    @classmethod
+    def publish(cls, name, category, published_at):
+        return Post.objects.create(title=f'پست {name}', excerpt='خلاصه', content='متن', author=cls.author,
+                                   category=category, status='published', published_at=published_at)
+
+    def setUp(self):
+        cache.clear()
+
+    def pks(self, *names):
+        return [self.posts[name].pk for name in names]
+
+    def test_segment_tiers(self):
+        tiers = build_segment(('12', 'riazi'))
+        self.assertEqual([pk for _, pk in tiers['exact']], self.pks('riazi-12', 'riazi-konkur'))
+        self.assertEqual([pk for _, pk in tiers['partial']], self.pks('12', 'riazi'))
+        self.assertEqual([pk for _, pk in tiers['general']], self.pks('general', 'uncategorized'))
+
+        anonymous = build_segment(None)
+        self.assertEqual(anonymous['exact'], [])
+        self.assertEqual([pk for _, pk in anonymous['general']], [post.pk for post in self.posts.values()])
+
+    def test_closer_tiers_outrank_newer_general_posts(self):
+        newer = self.publish('newer', None, timezone.now())
+        ids = Feed(build_segment(('12', 'riazi')))[0:6]
+        self.assertEqual(ids, [*self.pks('riazi-12', 'riazi-konkur', '12', 'riazi'), newer.pk,
+                               self.posts['general'].pk])
+
+    def test_feed_view_uses_the_profile_segment(self):
+        user = User.objects.create_user(email='student@example.com', password='x')
+        StudentProfile.objects.create(user=user, name='سارا احمدی', grade='دوازدهم', field='ریاضی',
+                                      phone='09120000000', birthdate_jalali='1386-01-01')
+        self.client.force_authenticate(user)
+        results = self.client.get('/api/blog/feed/').json()['results']
+        self.assertEqual([post['id'] for post in results][:2], self.pks('riazi-12', 'riazi-konkur'))
+        self.assertNotIn(self.posts['riazi-10'].pk, [post['id'] for post in results])
+
+    def test_publishing_rebuilds_only_the_segments_it_reaches(self):
+        for segment in SEGMENTS:
+            segment_candidates(segment)
+        with mock.patch('blog.feed.build_segment', wraps=build_segment) as build:
+            self.publish('new', Category.objects.get(name='ریاضی دهم'), timezone.now())
+            for segment in SEGMENTS:
+                segment_candidates(segment)
+        self.assertEqual({call.args[0] for call in build.call_args_list}, {None, ('10', 'riazi')})
+
+    def test_general_posts_reach_every_segment(self):
+        self.assertEqual(segments_reaching(('', '')), set(SEGMENTS))
+        self.assertEqual(segments_reaching(('12', '')), {None, *(('12', field) for field in FIELDS),
+                                                         *(('konkur', field) for field in FIELDS)})
+
+
+class RelatedPostsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(user=User.objects.create_user(email='author@example.com', password='x'),
+                                       display_name='نویسنده')
+        riazi = Category.objects.create(name='حسابان', grade='12', field='riazi')
+        ensani = Category.objects.create(name='تاریخ', grade='10', field='ensani')
+        algebra, geometry = Tag.objects.create(name='جبر'), Tag.objects.create(name='هندسه')
+
+        def post(title, content, category, tags, status='published'):
+            post = Post.objects.create(title=title, excerpt=content, content=content, author=author,
+                                       category=category, status=status, published_at=timezone.now())
+            post.tags.set(tags)
+            return post
+
+        # Only `a` and `b` share a term rare enough to count as text similarity.
+        cls.a = post('نخستین', 'انتگرال معین', riazi, [algebra, geometry])
+        cls.b = post('دومین', 'انتگرال نامعین', riazi, [algebra, geometry])
+        cls.c = post('سومین', 'دوره صفویه', ensani, [algebra])
+        cls.d = post('چهارمین', 'عصر قاجار', ensani, [])
+        post('پیش‌نویس', 'انتگرال دوگانه', riazi, [algebra, geometry], status='draft')
+
+    def related(self, post):
+        return [(row.related_id, row.rank, row.score)
+                for row in RelatedPost.objects.filter(post=post).order_by('rank')]
+
+    def test_scores_and_ranks(self):
+        self.assertEqual(RelatedPostsEngine(top_k=2).run(), 4)
+        a, c, d = self.related(self.a), self.related(self.c), self.related(self.d)
+
+        self.assertEqual([(pk, rank) for pk, rank, _ in a], [(self.b.pk, 1), (self.c.pk, 2)])
+        # Text, identical tags, same category and same grade and field.
+        self.assertGreater(a[0][2], WEIGHT_TAGS + WEIGHT_CATEGORY + WEIGHT_SEGMENT)
+        self.assertAlmostEqual(a[1][2], WEIGHT_TAGS / 2)  # one of two tags shared, nothing else
+
+        # Same category (and so grade and field) beats half the tags; ties go to the older id.
+        self.assertEqual([(pk, rank) for pk, rank, _ in c], [(self.d.pk, 1), (self.a.pk, 2)])
+        self.assertAlmostEqual(c[0][2], WEIGHT_CATEGORY + WEIGHT_SEGMENT)
+        self.assertEqual([pk for pk, _, _ in d], [self.c.pk])
+        self.assertFalse(Post.objects.filter(status='published', related_stale=True).exists())
+
+    def test_only_relevant_edits_mark_a_post_stale(self):
+        RelatedPostsEngine().run()
+        post = Post.objects.get(pk=self.d.pk)
+        post.meta_description = 'توضیح تازه'
+        post.save()
+        self.assertFalse(Post.objects.get(pk=post.pk).related_stale)
+        post.title = 'عنوان تازه'
+        post.save()
+        self.assertTrue(Post.objects.get(pk=post.pk).related_stale)
+
+    def test_nothing_stale_skips_loading(self):
+        RelatedPostsEngine().run()
+        with self.assertNumQueries(2):
+            self.assertEqual(RelatedPostsEngine().run(), 0)
+
+    def run_editing_midway(self, edit):
+        """Run the engine with `edit` committed between its load and its writes."""
+        dirty_posts = RelatedPostsEngine.dirty_posts
+
+        def edit_then_continue(engine, **kwargs):
+            edit()
+            return dirty_posts(engine, **kwargs)
+
+        with mock.patch.object(RelatedPostsEngine, 'dirty_posts', edit_then_continue):
+            RelatedPostsEngine().run()
+
+    def test_edit_committed_mid_run_stays_stale(self):
+        def edit():
+            post = Post.objects.get(pk=self.d.pk)
+            post.content = 'عصر زندیه'
+            post.save()
+
+        self.run_editing_midway(edit)
+        self.assertEqual(list(Post.objects.filter(related_stale=True, status='published')), [self.d])
+
+    def test_retag_committed_mid_run_stays_stale(self):
+        self.run_editing_midway(lambda: self.d.tags.add(Tag.objects.get(name='جبر')))
+        self.assertEqual(list(Post.objects.filter(related_stale=True, status='published')), [self.d])
+
+    def test_unpublished_posts_leave_every_list(self):
+        RelatedPostsEngine().run()
+        self.b.status = 'draft'
+        self.b.save()
+        RelatedPostsEngine().run()
+        self.assertFalse(RelatedPost.objects.filter(related=self.b).exists())
+        self.assertFalse(RelatedPost.objects.filter(post=self.b).exists())
+
+
+class HyperLogLogTests(SimpleTestCase):
+    def sketch(self, keys):
+        sketch = HyperLogLog()
+        for key in keys:
+            sketch.add(key)
+        return sketch
+
+    def assertWithinError(self, estimate, actual, sigmas=3):
+        # Standard error is 1.04 / sqrt(registers), about 1.6%.
+        self.assertLessEqual(abs(estimate - actual) / actual, sigmas * 1.04 / math.sqrt(REGISTERS))
+
+    def test_estimate_error_on_a_known_cardinality(self):
+        self.assertWithinError(self.sketch(f'user:{i}' for i in range(20000)).estimate(), 20000)
+
+    def test_small_cardinalities_are_nearly_exact(self):
+        self.assertLessEqual(abs(self.sketch(f'ip:{i}' for i in range(100)).estimate() - 100), 2)
+
+    def test_repeat_visitors_are_counted_once(self):
+        sketch = self.sketch(f'user:{i}' for i in range(500))
+        before = sketch.to_bytes()
+        self.assertFalse(any(sketch.add(f'user:{i}') for i in range(500)))
+        self.assertEqual(sketch.to_bytes(), before)
+
+    def test_merge_is_the_sketch_of_the_union(self):
+        first = self.sketch(f'user:{i}' for i in range(10000))
+        second = self.sketch(f'user:{i}' for i in range(5000, 15000))
+        union = self.sketch(f'user:{i}' for i in range(15000))
+        merged = HyperLogLog(first.to_bytes()).merge(second)
+        self.assertEqual(merged.to_bytes(), union.to_bytes())
+        self.assertWithinError(merged.estimate(), 15000)
+
+    def test_registers_round_trip(self):
+        sketch = self.sketch(['user:1'])
+        self.assertEqual(HyperLogLog(sketch.to_bytes()).to_bytes(), sketch.to_bytes())
+        with self.assertRaises(ValueError):
+            HyperLogLog(b'short')
+
+
+class VisitorAnalyticsTests(BlogDataMixin, APITestCase):
+    post_count = 1
+
+    def test_period_estimate_merges_daily_sketches(self):
+        post = self.posts[0]
+        today = timezone.localdate()
+        updates = {f'user:{i}': register_update(visitor_hash(f'user:{i}')) for i in range(300)}
+        for day, keys in ((today - timedelta(days=1), range(0, 200)), (today, range(100, 300))):
+            pending = {}
+            for i in keys:
+                index, rank = updates[f'user:{i}']
+                pending[index] = max(rank, pending.get(index, 0))
+            with transaction.atomic():
+                store_visitor_updates({post.pk: pending}, day=day)
+
+        url = f'/api/blog/posts/{post.slug}/analytics/'
+        self.client.force_authenticate(User.objects.create_user(email='reader@example.com', password='x'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_authenticate(User.objects.create_user(email='staff@example.com', password='x',
+                                                                is_staff=True))
+        data = self.client.get(url, {'days': 2}).json()
+        # Linear counting keeps estimates this small within a few visitors.
+        self.assertEqual(len(data['daily']), 2)
+        for day in data['daily']:
+            self.assertAlmostEqual(day['unique_visitors'], 200, delta=3)
+        self.assertAlmostEqual(data['period_unique_visitors'], 300, delta=3)
+        self.assertEqual(data['unique_visitors'], data['period_unique_visitors'])
+        self.assertEqual(self.client.get(url, {'days': 1}).json()['period_unique_visitors'],
+                         data['daily'][1]['unique_visitors'])
@@ -0,0 +1,134 @@
+"""
+Trending posts.
+
+Views land in hourly PostViewBucket rows (see counters.ViewCountBuffer). For
+each window a TrendingScore row per post holds the sum of its bucket views in
+that window, each weighted by exponential decay with a half-life of a
+quarter of the window, so yesterday's spike fades instead of staying on top.
+
+Scores are advanced incrementally: every row decays by the time since the
+last run, views not yet scored are added, and buckets that slid out of the
+window since the last run are subtracted. A run that finds no previous
+state, or one too old to advance from, rebuilds the window from the buckets.
+"""
+import logging
+import math
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .cache import bump_versions
+from .models import PostViewBucket, TrendingScore
+
+logger = logging.getLogger('api')
+
+WINDOWS = {
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+HALF_LIFE_RATIO = 4
+# Advancing from a state older than this would need buckets that may already
+# have been pruned; rebuild instead.
+MAX_GAP = timedelta(hours=6)
+MIN_SCORE = 1e-3
+
+
+def decay(window, age):
+    half_life = WINDOWS[window] / HALF_LIFE_RATIO
+    return math.pow(0.5, max(age.total_seconds(), 0) / half_life.total_seconds())
+
+
+class TrendingUpdater:
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+
+    def run(self, full=False):
+        now = self.now
+        longest = max(WINDOWS.values())
+        last_runs = dict(
+            TrendingScore.objects.values_list('window').annotate(last=Max('computed_at')).order_by()
+        )
+        rebuild = {
+            window for window in WINDOWS
+            if full or last_runs.get(window) is None or now - last_runs[window] > MAX_GAP
+        }
+
+        with transaction.atomic():
+            buckets = PostViewBucket.objects.filter(hour__gt=now - longest)
+            if not rebuild:
+                # Only unscored views and buckets leaving a window matter.
+                changed = Q(views__gt=F('scored_views'))
+                for window, span in WINDOWS.items():
+                    changed |= Q(hour__gt=last_runs[window] - span, hour__lte=now - span)
+                buckets = PostViewBucket.objects.filter(changed)
+            buckets = list(buckets.values_list('pk', 'post_id', 'hour', 'views', 'scored_views'))
+
+            for window, span in WINDOWS.items():
+                if window in rebuild:
+                    self._rebuild(window, span, buckets)
+                else:
+                    self._advance(window, span, last_runs[window], buckets)
+
+            PostViewBucket.objects.bulk_update(
+                [PostViewBucket(pk=pk, scored_views=views) for pk, _, _, views, scored in buckets if views != scored],
+                ['scored_views'],
+                batch_size=1000,
+            )
+            PostViewBucket.objects.filter(hour__lte=now - longest).delete()
+            transaction.on_commit(lambda: bump_versions('trending'))
+        return rebuild
+
+    def _rebuild(self, window, span, buckets):
+        scores = defaultdict(float)
+        for _, post_id, hour, views, _ in buckets:
+            if hour > self.now - span:
+                scores[post_id] += views * decay(window, self.now - hour)
+
+        TrendingScore.objects.filter(window=window).delete()
+        TrendingScore.objects.bulk_create(
+            [TrendingScore(post_id=post_id, window=window, score=score, computed_at=self.now)
+             for post_id, score in scores.items() if score >= MIN_SCORE],
+            batch_size=1000,
+        )
+
+    def _advance(self, window, span, last_run, buckets):
+        now = self.now
+        deltas = defaultdict(float)
+        for _, post_id, hour, views, scored in buckets:
+            weight = decay(window, now - hour)
+            if hour > now - span:
+                deltas[post_id] += (views - scored) * weight
+            elif hour > last_run - span:
+                # Counted up to the last run, outside the window now.
+                deltas[post_id] -= scored * weight
+
+        rows = TrendingScore.objects.filter(window=window)
+        rows.update(score=F('score') * decay(window, now - last_run), computed_at=now)
+
+        existing = {row.post_id: row for row in rows.filter(post_id__in=list(deltas))}
+        for post_id, row in existing.items():
+            row.score += deltas[post_id]
+        TrendingScore.objects.bulk_update(existing.values(), ['score'], batch_size=1000)
+        TrendingScore.objects.bulk_create(
+            [TrendingScore(post_id=post_id, window=window, score=delta, computed_at=now)
+             for post_id, delta in deltas.items() if post_id not in existing and delta >= MIN_SCORE],
+            batch_size=1000,
+        )
+        rows.filter(score__lt=MIN_SCORE).delete()
+
+
+def run_trending(interval, stop_event=None):
+    """Update trending scores every `interval` seconds until `stop_event` is set."""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            TrendingUpdater().run()
+        except Exception as e:
+            logger.error(f"Trending update failed: {str(e)}")
+        stop_event.wait(interval)
@@ -1,6 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PostViewSet, CategoryViewSet, TagViewSet, AuthorViewSet
+from .views import (
+    PostViewSet, CategoryViewSet, CategoryTreeView, TagViewSet, AuthorViewSet, FeedView, SuggestView,
+)
 
 router = DefaultRouter()
 router.register(r'posts', PostViewSet, basename='post')
@@ -9,5 +11,8 @@ router.register(r'tags', TagViewSet, basename='tag')
 router.register(r'authors', AuthorViewSet, basename='author')
 
 urlpatterns = [
+    path('feed/', FeedView.as_view(), name='feed'),
+    path('suggest/', SuggestView.as_view(), name='suggest'),
+    path('categories-tree/', CategoryTreeView.as_view(), name='category-tree'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
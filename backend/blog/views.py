@@ -1,15 +1,27 @@
 from rest_framework import viewsets, filters, status
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
 from django_filters.rest_framework import DjangoFilterBackend
-from django.utils import timezone
-from .models import Author, Category, Tag, Post
+from api.models import StudentProfile
+from api.pagination import KeysetPagination, wants_cursor_pagination
+from .cache import LISTING_SCOPES, cache_response, cached_response
+from .categories import build_category_tree
+from .comments import CommentTree
+from .counters import view_count_buffer
+from .feed import Feed, segment_candidates, segment_for, segment_name
+from .models import Author, Category, Tag, Post, TrendingScore
+from .search import IndexedSearchFilter, query_terms, ranked_matches
+from .suggest import suggest
 from .serializers import (
     AuthorSerializer, CategorySerializer, TagSerializer,
     PostListSerializer, PostDetailSerializer, CommentSerializer,
+    PostSearchResultSerializer,
 )
+from .visitors import visitor_stats, visitor_update
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -18,41 +30,138 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class PostCursorPagination(KeysetPagination):
+    ordering_field = 'published_at'
+    page_size = 12
+
+
+def post_paginator(request):
+    if wants_cursor_pagination(request):
+        return PostCursorPagination()
+    return StandardResultsSetPagination()
+
+
 class PostViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [AllowAny]
-    queryset = Post.objects.filter(status='published', published_at__lte=timezone.now())
+    queryset = Post.objects.all()
     serializer_class = PostListSerializer
     pagination_class = StandardResultsSetPagination
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, IndexedSearchFilter, filters.OrderingFilter]
     filterset_fields = ['category__slug', 'category__grade', 'category__field', 'tags__slug', 'author__id']
-    search_fields = ['title', 'content', 'excerpt', 'meta_keywords']
     ordering_fields = ['published_at', 'view_count', 'reading_time']
     ordering = ['-published_at']
     lookup_field = 'slug'
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = post_paginator(self.request) if self.action == 'list' else super().paginator
+        return self._paginator
+
+    def get_queryset(self):
+        queryset = super().get_queryset().published()
+        if self.action == 'retrieve':
+            return queryset.for_detail()
+        if self.action in ('list', 'popular', 'recent', 'trending'):
+            return queryset.for_listing()
+        return queryset
+
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return PostDetailSerializer
         return PostListSerializer
 
+    @cache_response(*LISTING_SCOPES)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        instance.increment_view_count()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        # The detail body is cached, but every hit still counts as a view.
+        scopes = [f"post:{kwargs['slug']}", 'author', 'category', 'tag']
+        response = cached_response(request, scopes, lambda: super(PostViewSet, self).retrieve(request, *args, **kwargs))
+        if response.status_code == 200:
+            view_count_buffer.record(response.data['id'], visitor=visitor_update(request))
+        return response
 
     @action(detail=False, methods=['get'])
+    @cache_response(*LISTING_SCOPES)
     def popular(self, request):
-        posts = self.queryset.order_by('-view_count')[:10]
+        posts = self.get_queryset().order_by('-view_count')[:10]
         serializer = self.get_serializer(posts, many=True)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
+    @cache_response(*LISTING_SCOPES, 'trending')
+    def trending(self, request):
+        window = request.query_params.get('window', '24h')
+        if window not in dict(TrendingScore.WINDOW_CHOICES):
+            return Response(
+                {'error': 'بازه نامعتبر است. مقادیر مجاز: 24h، 7d، 30d.'}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        top = TrendingScore.objects.filter(
+            window=window, post__in=self.get_queryset()
+        ).order_by('-score').values_list('post_id', flat=True)[:settings.BLOG_TRENDING_SIZE]
+        top = list(top)
+        posts = self.get_queryset().in_bulk(top)
+        serializer = self.get_serializer([posts[pk] for pk in top if pk in posts], many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    @cache_response(*LISTING_SCOPES)
     def recent(self, request):
-        posts = self.queryset.order_by('-published_at')[:10]
+        posts = self.get_queryset().order_by('-published_at')[:10]
         serializer = self.get_serializer(posts, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        terms = query_terms(request.query_params.get('q', ''))
+        if not terms:
+            return Response({'error': 'پارامتر جستجو (q) الزامی است.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = StandardResultsSetPagination()
+        page = paginator.paginate_queryset(ranked_matches(self.get_queryset(), terms), request)
+        posts = Post.objects.filter(pk__in=[row['post'] for row in page]).for_listing().in_bulk()
+        results = []
+        for row in page:
+            post = posts[row['post']]
+            post.search_score = row['score']
+            results.append(post)
+
+        serializer = PostSearchResultSerializer(results, many=True, context={'search_terms': terms})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAdminUser])
+    def analytics(self, request, slug=None):
+        post = self.get_object()
+        days = request.query_params.get('days', '30')
+        if not days.isdigit() or not 1 <= int(days) <= settings.BLOG_VISITOR_SKETCH_DAYS:
+            return Response(
+                {'error': f'پارامتر days باید عددی بین ۱ و {settings.BLOG_VISITOR_SKETCH_DAYS} باشد.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # Fold this process's buffered views in so the numbers are current.
+        view_count_buffer.flush()
+        post.refresh_from_db(fields=['view_count', 'unique_visitors'])
+        return Response({'id': post.id, 'slug': post.slug, 'view_count': post.view_count,
+                         **visitor_stats(post, int(days))})
+
+    @action(detail=True, methods=['get'])
+    @cache_response('post:{slug}')
+    def comments(self, request, slug=None):
+        post = self.get_object()
+        tree = CommentTree(post) if post.enable_comments else None
+        parent = request.query_params.get('parent')
+        if parent and not parent.isdigit():
+            return Response({'error': 'پارامتر parent نامعتبر است.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        comments = [] if tree is None else (tree.replies(int(parent)) if parent else tree.roots())
+        paginator = StandardResultsSetPagination()
+        page = paginator.paginate_queryset(comments, request)
+        serializer = CommentSerializer(page, many=True, context={'request': request, 'comment_tree': tree})
+        return paginator.get_paginated_response(serializer.data)
+
     @action(detail=True, methods=['post'])
     def add_comment(self, request, slug=None):
         post = self.get_object()
@@ -72,16 +181,37 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     lookup_field = 'slug'
     pagination_class = None
 
+    @cache_response('category', 'post')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response('category', 'post')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=True, methods=['get'])
+    @cache_response(*LISTING_SCOPES)
     def posts(self, request, slug=None):
         category = self.get_object()
-        posts = Post.objects.filter(category=category, status='published', published_at__lte=timezone.now()).order_by('-published_at')
-        paginator = StandardResultsSetPagination()
+        posts = Post.objects.published().filter(category=category).for_listing().order_by('-published_at')
+        paginator = post_paginator(request)
         page = paginator.paginate_queryset(posts, request)
         serializer = PostListSerializer(page, many=True)
         return paginator.get_paginated_response(serializer.data)
 
 
+class CategoryTreeView(APIView):
+    """
+    The whole category hierarchy with rolled-up post counts. It lives outside
+    /categories/ so that no category slug can shadow it.
+    """
+    permission_classes = [AllowAny]
+
+    @cache_response('category', 'post')
+    def get(self, request):
+        return Response(build_category_tree())
+
+
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [AllowAny]
     queryset = Tag.objects.all()
@@ -89,11 +219,20 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     lookup_field = 'slug'
     pagination_class = None
 
+    @cache_response('tag', 'post')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response('tag', 'post')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=True, methods=['get'])
+    @cache_response(*LISTING_SCOPES)
     def posts(self, request, slug=None):
         tag = self.get_object()
-        posts = Post.objects.filter(tags=tag, status='published', published_at__lte=timezone.now()).order_by('-published_at')
-        paginator = StandardResultsSetPagination()
+        posts = Post.objects.published().filter(tags=tag).for_listing().order_by('-published_at')
+        paginator = post_paginator(request)
         page = paginator.paginate_queryset(posts, request)
         serializer = PostListSerializer(page, many=True)
         return paginator.get_paginated_response(serializer.data)
@@ -105,11 +244,51 @@ class AuthorViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = AuthorSerializer
     pagination_class = None
 
+    @cache_response('author', 'post')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response('author', 'post')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=True, methods=['get'])
+    @cache_response(*LISTING_SCOPES)
     def posts(self, request, pk=None):
         author = self.get_object()
-        posts = Post.objects.filter(author=author, status='published', published_at__lte=timezone.now()).order_by('-published_at')
-        paginator = StandardResultsSetPagination()
+        posts = Post.objects.published().filter(author=author).for_listing().order_by('-published_at')
+        paginator = post_paginator(request)
         page = paginator.paginate_queryset(posts, request)
         serializer = PostListSerializer(page, many=True)
-        return paginator.get_paginated_response(serializer.data)
\ No newline at end of file
+        return paginator.get_paginated_response(serializer.data)
+
+
+class FeedView(APIView):
+    """Published posts for the caller's grade and field; anonymous readers get the general feed."""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        segment = None
+        if request.user.is_authenticated:
+            profile = StudentProfile.objects.filter(user=request.user).values_list('grade', 'field').first()
+            if profile:
+                segment = segment_for(*profile)
+        # The segment scope keeps each segment's pages apart in the cache.
+        scopes = [*LISTING_SCOPES, f'feed:{segment_name(segment)}']
+        return cached_response(request, scopes, lambda: self.page(request, segment))
+
+    def page(self, request, segment):
+        paginator = StandardResultsSetPagination()
+        ids = paginator.paginate_queryset(Feed(segment_candidates(segment)), request)
+        posts = Post.objects.published().filter(pk__in=ids).for_listing().in_bulk()
+        serializer = PostListSerializer([posts[pk] for pk in ids if pk in posts], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class SuggestView(APIView):
+    """Autocomplete for the search box: posts and tags whose title or name has a word starting with ?q=."""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        return Response({'query': query, 'results': suggest(query)})
@@ -0,0 +1,98 @@
+"""
+Unique-visitor estimates.
+
+Each detail view hashes the reader (user id, or the client IP for anonymous
+readers) into a HyperLogLog register update that the view count buffer holds
+in memory; a flush folds the buffered updates into the post's sketch for the
+day and its lifetime sketch. Every sketch is a fixed 4 KB, so storage per
+post depends on the retention in days, never on traffic. Daily sketches
+older than BLOG_VISITOR_SKETCH_DAYS are dropped; the lifetime one is kept.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .hll import HyperLogLog, register_update, visitor_hash
+
+
+def client_ip(request):
+    """
+    The reader's address. Behind nginx REMOTE_ADDR is the proxy's own, so the
+    X-Real-IP (or first X-Forwarded-For hop) it sets comes first.
+    """
+    real_ip = request.META.get('HTTP_X_REAL_IP', '').strip()
+    if real_ip:
+        return real_ip
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')[0].strip()
+    return forwarded or request.META.get('REMOTE_ADDR', '')
+
+
+def visitor_key(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f'ip:{client_ip(request)}'
+
+
+def visitor_update(request):
+    """The (register, rank) a request sets in a sketch."""
+    return register_update(visitor_hash(visitor_key(request)))
+
+
+def store_visitor_updates(pending, day=None):
+    """
+    Merge {post_id: {register: rank}} into today's and the lifetime sketches.
+
+    Must run inside a transaction: the sketch rows are locked while merged.
+    """
+    from .models import Post, PostVisitorSketch
+
+    day = day or timezone.localdate()
+    post_ids = list(Post.objects.filter(pk__in=list(pending)).values_list('pk', flat=True))
+    if not post_ids:
+        return
+    PostVisitorSketch.objects.bulk_create(
+        [PostVisitorSketch(post_id=post_id, day=sketch_day, registers=HyperLogLog().to_bytes())
+         for post_id in post_ids for sketch_day in (day, None)],
+        ignore_conflicts=True,
+    )
+
+    rows = PostVisitorSketch.objects.select_for_update().filter(
+        Q(day=day) | Q(day__isnull=True), post_id__in=post_ids
+    ).order_by('pk')
+    changed, lifetime = [], {}
+    for row in rows:
+        sketch = HyperLogLog(row.registers)
+        if sketch.update(pending[row.post_id]):
+            row.registers = sketch.to_bytes()
+            row.unique_visitors = sketch.estimate()
+            changed.append(row)
+            if row.day is None:
+                lifetime[row.post_id] = row.unique_visitors
+    PostVisitorSketch.objects.bulk_update(changed, ['registers', 'unique_visitors'])
+    Post.objects.bulk_update(
+        [Post(pk=post_id, unique_visitors=estimate) for post_id, estimate in lifetime.items()],
+        ['unique_visitors'],
+    )
+    PostVisitorSketch.objects.filter(
+        post_id__in=post_ids, day__lt=day - timedelta(days=settings.BLOG_VISITOR_SKETCH_DAYS)
+    ).delete()
+
+
+def visitor_stats(post, days):
+    """Lifetime estimate, the estimate over the last `days` days and the daily estimates."""
+    from .models import PostVisitorSketch
+
+    since = timezone.localdate() - timedelta(days=days - 1)
+    period = HyperLogLog()
+    daily = []
+    for row in PostVisitorSketch.objects.filter(post=post, day__gte=since).order_by('day'):
+        period.merge(HyperLogLog(row.registers))
+        daily.append({'date': row.day, 'unique_visitors': row.unique_visitors})
+    return {
+        'unique_visitors': post.unique_visitors,
+        'period_days': days,
+        'period_unique_visitors': period.estimate(),
+        'daily': daily,
+    }
@@ -163,6 +163,18 @@ MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Cache
+# LocMemCache is per process; with several gunicorn workers point this at a
+# shared backend (e.g. django.core.cache.backends.redis.RedisCache) so that
+# invalidation reaches every worker.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='konkour-default'),
+    }
+}
+
+
 
 from datetime import timedelta
 
@@ -207,6 +219,98 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@konkoor-app.local')
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=30, cast=int)  # seconds
+
+# Outbound mail is queued in OutboundEmail and delivered by send_queued_mail.
+# Failed sends are retried after EMAIL_QUEUE_RETRY_DELAY, doubling each time.
+# A claimed batch is leased for EMAIL_TIMEOUT per message plus EMAIL_QUEUE_LEASE.
+EMAIL_QUEUE_BATCH_SIZE = config('EMAIL_QUEUE_BATCH_SIZE', default=50, cast=int)
+EMAIL_QUEUE_POLL_INTERVAL = config('EMAIL_QUEUE_POLL_INTERVAL', default=2, cast=float)  # seconds
+EMAIL_QUEUE_MAX_ATTEMPTS = config('EMAIL_QUEUE_MAX_ATTEMPTS', default=6, cast=int)
+EMAIL_QUEUE_RETRY_DELAY = config('EMAIL_QUEUE_RETRY_DELAY', default=30, cast=int)  # seconds
+EMAIL_QUEUE_LEASE = config('EMAIL_QUEUE_LEASE', default=300, cast=int)  # seconds
+EMAIL_QUEUE_KEEP_DAYS = config('EMAIL_QUEUE_KEEP_DAYS', default=7, cast=int)
+
+# Login codes: where they are kept (api.otp), how long they live and how many
+# wrong guesses a code survives. OTP_AUDIT also records them in EmailOTP.
+OTP_BACKEND = config('OTP_BACKEND', default='api.otp.CacheOTPBackend')
+OTP_CACHE_ALIAS = config('OTP_CACHE_ALIAS', default='default')
+OTP_TTL = config('OTP_TTL', default=900, cast=int)  # seconds
+OTP_MAX_ATTEMPTS = config('OTP_MAX_ATTEMPTS', default=5, cast=int)
+OTP_AUDIT = config('OTP_AUDIT', default=False, cast=bool)
+
+# Planner workers (api.planner, run_planner_workers). PLANNER_LLM_CONCURRENCY
+# caps LLM calls across all worker processes; PLANNER_LEASE must outlast a
+# request's LLM calls including retries.
+PLANNER_LLM_CLIENT = config('PLANNER_LLM_CLIENT', default='api.planner.HTTPLLMClient')
+PLANNER_LLM_URL = config('PLANNER_LLM_URL', default='http://localhost:8089/plan')
+PLANNER_LLM_API_KEY = config('PLANNER_LLM_API_KEY', default='')
+PLANNER_LLM_TIMEOUT = config('PLANNER_LLM_TIMEOUT', default=60, cast=int)  # seconds per call
+PLANNER_LLM_RETRIES = config('PLANNER_LLM_RETRIES', default=2, cast=int)
+PLANNER_LLM_RETRY_DELAY = config('PLANNER_LLM_RETRY_DELAY', default=2, cast=float)  # seconds, doubled per retry
+PLANNER_LLM_CONCURRENCY = config('PLANNER_LLM_CONCURRENCY', default=4, cast=int)
+PLANNER_WORKER_THREADS = config('PLANNER_WORKER_THREADS', default=4, cast=int)
+PLANNER_POLL_INTERVAL = config('PLANNER_POLL_INTERVAL', default=2, cast=float)  # seconds
+PLANNER_LEASE = config('PLANNER_LEASE', default=600, cast=int)  # seconds
+PLANNER_MAX_ATTEMPTS = config('PLANNER_MAX_ATTEMPTS', default=3, cast=int)
+PLANNER_RETRY_DELAY = config('PLANNER_RETRY_DELAY', default=60, cast=int)  # seconds, times the attempt number
+# Plans are first drafted locally (api.plan_generator); the LLM only refines
+# the draft, and the draft is kept when the LLM is off or fails.
+PLANNER_LLM_ENABLED = config('PLANNER_LLM_ENABLED', default=True, cast=bool)
+PLANNER_MINUTES_PER_PAGE = config('PLANNER_MINUTES_PER_PAGE', default=5, cast=float)
+# Finished plans are reused for requests with the same inputs (api.plan_cache).
+PLANNER_CACHE_ENABLED = config('PLANNER_CACHE_ENABLED', default=True, cast=bool)
+PLANNER_CACHE_TTL = config('PLANNER_CACHE_TTL', default=7 * 24 * 3600, cast=int)  # seconds
+PLANNER_CACHE_MAX_ENTRIES = config('PLANNER_CACHE_MAX_ENTRIES', default=10000, cast=int)
+
+
+# Blog: post views are buffered in memory and written back in batches
+BLOG_VIEW_COUNT_FLUSH_INTERVAL = config('BLOG_VIEW_COUNT_FLUSH_INTERVAL', default=10, cast=int)  # seconds
+BLOG_VIEW_COUNT_MAX_PENDING = config('BLOG_VIEW_COUNT_MAX_PENDING', default=500, cast=int)  # distinct posts
+BLOG_CACHE_TIMEOUT = config('BLOG_CACHE_TIMEOUT', default=300, cast=int)  # seconds
+BLOG_COMMENT_MAX_DEPTH = config('BLOG_COMMENT_MAX_DEPTH', default=4, cast=int)
+BLOG_COMMENT_REPLIES_PAGE_SIZE = config('BLOG_COMMENT_REPLIES_PAGE_SIZE', default=10, cast=int)
+BLOG_RELATED_POSTS_COUNT = config('BLOG_RELATED_POSTS_COUNT', default=6, cast=int)
+# Seconds between incremental related-posts runs of `compute_related_posts --loop`
+BLOG_RELATED_INTERVAL = config('BLOG_RELATED_INTERVAL', default=600, cast=int)
+# Longest the scheduled-publish worker sleeps before re-reading the due queue
+BLOG_SCHEDULER_POLL_INTERVAL = config('BLOG_SCHEDULER_POLL_INTERVAL', default=30, cast=int)
+# Seconds between trending score updates, and posts returned per trending window
+BLOG_TRENDING_INTERVAL = config('BLOG_TRENDING_INTERVAL', default=300, cast=int)
+BLOG_TRENDING_SIZE = config('BLOG_TRENDING_SIZE', default=10, cast=int)
+# Days of per-day unique-visitor sketches kept (4 KB per post and day)
+BLOG_VISITOR_SKETCH_DAYS = config('BLOG_VISITOR_SKETCH_DAYS', default=90, cast=int)
+# Newest posts kept per relevance tier of each grade/field feed segment
+BLOG_FEED_CANDIDATES = config('BLOG_FEED_CANDIDATES', default=500, cast=int)
+BLOG_SUGGEST_LIMIT = config('BLOG_SUGGEST_LIMIT', default=8, cast=int)
+
+# Public site identity used in structured data (JSON-LD); after changing these
+# run `python manage.py rebuild_structured_data`.
+SITE_URL = config('SITE_URL', default='https://your-domain.com').rstrip('/')
+SITE_PUBLISHER_NAME = config('SITE_PUBLISHER_NAME', default='مشاور کنکور')
+SITE_LOGO_URL = config('SITE_LOGO_URL', default=f'{SITE_URL}/logo.png')
+
+# Precompressed JSON/XML export of the public blog for nginx to serve directly
+# (`python manage.py export_blog_static`). When enabled, content changes queue
+# a re-export of the pages they affect for `export_blog_static --loop`, which
+# also exports everything every BLOG_STATIC_EXPORT_FULL_INTERVAL seconds.
+BLOG_STATIC_EXPORT_ENABLED = config('BLOG_STATIC_EXPORT_ENABLED', default=False, cast=bool)
+BLOG_STATIC_EXPORT_POLL_INTERVAL = config('BLOG_STATIC_EXPORT_POLL_INTERVAL', default=5, cast=int)  # seconds
+BLOG_STATIC_EXPORT_FULL_INTERVAL = config('BLOG_STATIC_EXPORT_FULL_INTERVAL', default=3600, cast=int)  # seconds
+BLOG_STATIC_EXPORT_ROOT = config('BLOG_STATIC_EXPORT_ROOT', default=str(BASE_DIR / 'blog_static'))
+BLOG_STATIC_EXPORT_URL = config('BLOG_STATIC_EXPORT_URL', default='/blog-static')
+BLOG_STATIC_EXPORT_PAGE_SIZE = config('BLOG_STATIC_EXPORT_PAGE_SIZE', default=12, cast=int)
+
+# Responsive image derivatives (api.images): widths per "app.Model.field".
+IMAGE_DERIVATIVES = {
+    'blog.Post.featured_image': [320, 640, 960, 1280],
+    'blog.Post.og_image': [600, 1200],
+    'blog.Author.profile_image': [96, 192, 384],
+    'api.StudentProfile.avatar': [64, 128, 256],
+}
+IMAGE_DERIVATIVE_QUALITY = config('IMAGE_DERIVATIVE_QUALITY', default=80, cast=int)
+# Size of the resizing process pool; 0 renders in-process right after commit.
+IMAGE_DERIVATIVE_WORKERS = config('IMAGE_DERIVATIVE_WORKERS', default=2, cast=int)
 
 
 # =====================================================
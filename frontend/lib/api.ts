@@ -635,6 +635,7 @@ export interface PlannerRequest {
   exam_code: string | null
   target_rank: number | null
   period_days: number
+  parent: number | null
   created_at: string
   updated_at: string
   expires_at: string
@@ -679,6 +680,17 @@ export async function submitPlannerRequest(
   return apiRequest(`/api/planner/${requestId}/submit/`, 'POST', undefined, token)
 }
 
+/**
+ * ویرایش یک برنامه تکمیل‌شده (فقط روزها و درس‌های تغییرکرده دوباره ساخته می‌شوند)
+ */
+export async function revisePlannerRequest(
+  requestId: number,
+  formData: Partial<PlannerFormData>,
+  token: string
+): Promise<{ message: string; data: PlannerRequest }> {
+  return apiRequest(`/api/planner/${requestId}/revise/`, 'POST', { form_data: formData }, token)
+}
+
 /**
  * دریافت یک درخواست برنامه‌ریزی
  */